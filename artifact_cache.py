@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from planet_store import atomic_write
+
+
+# Hash of the inputs an artifact is made from: the values (e.g. the planet size) and the contents of the files
+# (e.g. the scripts generating the planet). A missing file hashes differently from any content
+def input_key(values, paths):
+    digest = hashlib.sha256(json.dumps(list(values)).encode())
+    for path in paths:
+        digest.update(os.path.basename(path).encode() + b'\0')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        else:
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+
+# Artifacts kept in a directory under names derived from the keys of the inputs they were made from.
+# The manifest in the directory maps every key to the file name, its size and the last time it was used. When
+# the artifacts take more than max_bytes (None for no limit), the least recently used ones are deleted. Files
+# that aren't in the manifest are never touched. The cache can be shared by several threads.
+#   cache = ArtifactCache('./input/', 2 ** 33)
+#   key = input_key([4], ['export.rkt'])
+#   path = cache.get(key)                           <- None if there's no artifact for the key
+#   path = cache.path(key, 'earthgen_export_4.planet')
+#   ... write the artifact to path ...
+#   cache.add(key, path)
+class ArtifactCache:
+    def __init__(self, directory, max_bytes=None, manifest='manifest.json'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(directory, manifest)
+        self.entries = {}
+        self._lock = threading.RLock()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.entries = json.load(f)
+
+    # Where the artifact with the key is kept. name is the usual name of the artifact, the key is added to it
+    def path(self, key, name):
+        stem, ext = os.path.splitext(name)
+        return os.path.join(self.directory, f'{stem}_{key[:16]}{ext}')
+
+    # Path of the artifact with the key, or None if there's none (e.g. it was deleted by hand)
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            path = os.path.join(self.directory, entry['file'])
+            if not os.path.exists(path):
+                del self.entries[key]
+                self._save()
+                return None
+            entry['used'] = time.time()
+            self._save()
+            return path
+
+    # Records the artifact written to path, then evicts the least recently used ones over max_bytes
+    def add(self, key, path, name=None):
+        with self._lock:
+            self.entries[key] = {'file': os.path.basename(path), 'name': name, 'bytes': os.path.getsize(path),
+                                 'used': time.time()}
+            self.evict(keep=key)
+
+    # Path of the most recently used artifact with the usual name, or None
+    def latest(self, name):
+        with self._lock:
+            entries = [entry for entry in self.entries.values()
+                       if entry.get('name') == name and os.path.exists(os.path.join(self.directory, entry['file']))]
+            if not entries:
+                return None
+            return os.path.join(self.directory, max(entries, key=lambda entry: entry['used'])['file'])
+
+    # Deletes the least recently used artifacts, except the one with the key keep, until they take at most
+    # max_bytes
+    def evict(self, keep=None):
+        with self._lock:
+            if self.max_bytes is not None:
+                total = sum(entry['bytes'] for entry in self.entries.values())
+                for key in sorted(self.entries, key=lambda key: self.entries[key]['used']):
+                    if total <= self.max_bytes:
+                        break
+                    if key == keep:
+                        continue
+                    entry = self.entries.pop(key)
+                    path = os.path.join(self.directory, entry['file'])
+                    if os.path.exists(path):
+                        print(f'    deleting the least recently used {path}')
+                        os.remove(path)
+                    total -= entry['bytes']
+            self._save()
+
+    # Written to a temporary file first, so an interrupted run doesn't leave a broken manifest
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write(self.manifest_path, lambda f: json.dump(self.entries, f, indent=1), mode='w')
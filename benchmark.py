@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import numpy as np
+import generate_images as images
+from planet_store import load_planet, save_planet, read_legacy_planet, convert_legacy_planet
+from synthetic_planet import synthetic_planet, synthetic_slices, write_legacy_py
+
+# Benchmarks the steps of generate_images.py on synthetic planets (see synthetic_planet.py) and saves the results
+# to a JSON file, so that the results of two revisions can be compared:
+#   python benchmark.py --sizes 1 2 3 --output before.json
+#   ... change the code ...
+#   python benchmark.py --sizes 1 2 3 --compare before.json
+# Every step is run REPEAT times and the fastest time is kept. Then it's run once more with tracemalloc to get
+# its peak memory, which counts the memory allocated by python and numpy but not the pixels of the images
+# (Pillow allocates them itself).
+
+# Sizes of the planets (as PLANET_CHARACTERISTIC_SIZE)
+SIZES = [1, 2, 3]
+# Largest size that is also benchmarked in the legacy .py and .pickle formats. The legacy structure of bigger
+# planets takes several GB
+LEGACY_MAX_SIZE = 4
+# Number of seasons of the planets
+SEASONS = 4
+# DYMAXION_HEX_R of the benchmarked Dymaxion projections
+HEX_RS = [10, 50]
+# EQUIRECTANGULAR_DEGREE of the benchmarked equirectangular projections
+DEGREES = [5, 20]
+# Number of runs of every step
+REPEAT = 3
+# Directory of the results
+BENCHMARK_OUTPUT = r'./benchmark/'
+# Steps that are slower than in the compared results by more than REGRESSION_RATIO and REGRESSION_SECONDS are
+# marked as regressions
+REGRESSION_RATIO = 1.1
+REGRESSION_SECONDS = 0.01
+
+
+# Seconds of the fastest of repeat runs of function, and its peak memory in bytes (None if not measured).
+# The output of the function is discarded
+def measure(function, repeat, memory=True):
+    best = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        peak = None
+        if memory:
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return best, peak
+
+# Current git revision, None outside of a git repository
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Steps of one planet size as (step, resolution, function)
+def planet_steps(size, directory):
+    planet = synthetic_planet(size, SEASONS)
+    planet_path = os.path.join(directory, f'synthetic_{size}.planet')
+    save_planet(planet, planet_path)
+    steps = []
+    if size <= LEGACY_MAX_SIZE:
+        slices = synthetic_slices(size, SEASONS)
+        py_path = os.path.join(directory, f'synthetic_{size}.py')
+        pickle_path = os.path.join(directory, f'synthetic_{size}.pickle')
+        write_legacy_py(slices, py_path)
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(slices, f)
+
+        def load_pickle():
+            with open(pickle_path, 'rb') as f:
+                return pickle.load(f)
+
+        steps += [('load_py', None, lambda: read_legacy_planet(py_path)),
+                  ('convert_py', None,
+                   lambda: convert_legacy_planet(py_path, os.path.join(directory, 'converted.planet'))),
+                  ('load_pickle', None, load_pickle),
+                  ('merge_slices', None, lambda: images.merge_slices(slices))]
+
+    # the arrays are memory-mapped, so they're read to measure the loading
+    def read_planet():
+        loaded = load_planet(planet_path)
+        return [np.sum(array) for array in [loaded.corners, *loaded.fields.values()]]
+
+    summary = images.season_summary(planet)
+    codes, names = images.type_of_hexes(planet, summary)
+    steps += [('load_planet', None, read_planet),
+              ('season_summary', None, lambda: images.season_summary(planet)),
+              ('type_of_hexes', None, lambda: images.type_of_hexes(planet, summary)),
+              ('gather_statistics', None, lambda: images.gather_statistics(planet, codes, names))]
+
+    def dymaxion(hex_r):
+        images.DYMAXION_HEX_R = hex_r
+        images.save_dymaxion(planet, planet.size, images.StampCache(images.import_tile_icons()), codes)
+
+    def equirectangular(degree):
+        images.EQUIRECTANGULAR_DEGREE = degree
+        # the polygons of the last planet are kept in memory, every run projects them again
+        images._last_geometry.clear()
+        images.save_equirectangular(planet, images.StampCache(images.import_tile_icons()), codes)
+
+    steps += [('save_dymaxion', {'DYMAXION_HEX_R': hex_r}, lambda hex_r=hex_r: dymaxion(hex_r))
+              for hex_r in HEX_RS]
+    steps += [('save_equirectangular', {'EQUIRECTANGULAR_DEGREE': degree},
+               lambda degree=degree: equirectangular(degree)) for degree in DEGREES]
+    return len(planet), steps
+
+# Runs the benchmarks. The images are saved to a temporary directory, and CACHE isn't used, so that every run
+# does all the work
+def run_benchmarks(sizes, repeat=REPEAT, memory=True):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        images.OUTPUT = os.path.join(directory, '')
+        images.USE_CACHE = False
+        images.SAVE_STRIPS = False
+        for size in sizes:
+            tiles, steps = planet_steps(size, directory)
+            for step, resolution, function in steps:
+                seconds, peak = measure(function, repeat, memory)
+                results.append({'step': step, 'size': size, 'tiles': tiles, 'resolution': resolution,
+                                'seconds': seconds, 'peak_bytes': peak})
+                print(format_result(results[-1]))
+    return {'revision': revision(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'seasons': SEASONS,
+            'repeat': repeat, 'results': results}
+
+def result_key(result):
+    return result['step'], result['size'], json.dumps(result['resolution'], sort_keys=True)
+
+def format_result(result):
+    resolution = ' '.join(f'{name}={value}' for name, value in (result['resolution'] or {}).items())
+    memory = '' if result['peak_bytes'] is None else f'{result["peak_bytes"] / 2 ** 20:10.1f} MB'
+    return f'{result["step"]:<22}{result["size"]:>3} {resolution:<28}{result["seconds"]:10.3f} s{memory}'
+
+# Prints the time of every step in both results and their ratio. Returns the results that got slower by more
+# than REGRESSION_RATIO and REGRESSION_SECONDS
+def compare(old, new):
+    previous = {result_key(result): result for result in old['results']}
+    print(f'Compared to revision {old.get("revision")}:')
+    regressions = []
+    for result in new['results']:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        ratio = result['seconds'] / max(before['seconds'], 1e-9)
+        slower = ratio > REGRESSION_RATIO and result['seconds'] - before['seconds'] > REGRESSION_SECONDS
+        if slower:
+            regressions.append(result)
+        print(f'{format_result(result)}  was {before["seconds"]:.3f} s  x{ratio:.2f}' +
+              ('  SLOWER' if slower else ''))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks generate_images.py on synthetic planets')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, metavar='SIZE')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory")
+    parser.add_argument('--output', help='JSON file of the results (default benchmark_REVISION.json in '
+                                         f'{BENCHMARK_OUTPUT})')
+    parser.add_argument('--compare', metavar='JSON', help='results of another revision to compare with')
+    arguments = parser.parse_args()
+
+    benchmark = run_benchmarks(arguments.sizes, max(1, arguments.repeat), not arguments.no_memory)
+    output = arguments.output or os.path.join(BENCHMARK_OUTPUT,
+                                              f'benchmark_{(benchmark["revision"] or "unknown")[:10]}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(benchmark, f, indent=1)
+    print(f'Results saved to {output}')
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            regressions = compare(json.load(f), benchmark)
+        if regressions:
+            sys.exit(1)
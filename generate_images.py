@@ -1,20 +1,48 @@
 import os
+import json
+import hashlib
 import pickle
-import importlib.util
+import argparse
 import subprocess
-from collections import Counter
+import multiprocessing
+import numpy as np
 from PIL import Image, ImageDraw
-from math import asin, acos, pi
+from collections import OrderedDict
+from functools import partial
+from math import pi, ceil, floor
+from planet_store import (SEASONAL_FIELDS, STATIC_FIELDS, empty_planet, load_planet, save_planet,
+                          read_legacy_planet, convert_legacy_planet, print_progress, grid_fingerprint, atomic_write)
+from planet_statistics import planet_statistics, format_statistics, save_statistics
+from planet_regions import tile_adjacency, majority_filter
+from pipeline import Pipeline
+from artifact_cache import ArtifactCache, input_key
+from instrumentation import stage, count, count_file, start, save_report
 
-# Generate new planet from scratch vs. use the existing .py or .pickle file
+# Generate new planet from scratch vs. use the existing .planet, .py or .pickle file
 GENERATE_FROM_SCRATCH = True
 # Path to racket executable
 RACKET_PATH = r'C:\Program Files\Racket\racket.exe'
-# Save dict to internal python binary format (faster reuse)
-SAVE_PICKLE = True
-# Planet size parameter (between 0 and 4)
-# 0 produces no hexes and 12 pentagons; 5 results in MemoryError
+# Reuse a planet generated earlier from the same planet size, TERRAIN and GENERATOR_INPUTS instead of running
+# export.rkt again. The generated planets are kept in INPUT under names with the hash of their inputs
+REUSE_GENERATED_PLANETS = True
+# Terrain script of the generated planet (the seeds and the terrain settings, see README)
+TERRAIN = './terrain-generation/default.txt'
+# Files the generated planet depends on besides TERRAIN. Changing any of them (e.g. the climate parameters
+# in export.rkt) generates a new planet
+GENERATOR_INPUTS = ['export.rkt', 'earthgen.rkt']
+# Maximum total size in bytes of the generated planets kept in INPUT, or None for no limit. The least
+# recently used planets are deleted first
+GENERATED_PLANETS_BYTES = 8 * 2 ** 30
+# Save planets read from .py or .pickle files to the binary .planet format (faster reuse)
+SAVE_PLANET = True
+# Planet size parameter: the planet has 10 * 9 ** size + 2 tiles (0 produces no hexes and 12 pentagons).
+# The planet is kept in arrays of about 400 bytes per tile with 4 seasons in float64 (half with PLANET_DTYPE
+# 'float32'), memory-mapped from .planet files, so size 5 (590,492 tiles) takes about 230 MB and size 6 about
+# 2 GB. Large images can be saved in strips (SAVE_STRIPS) to bound the memory used by the projections
 PLANET_CHARACTERISTIC_SIZE = 3
+# Floating point type of the planet arrays after the import. 'float32' halves the memory
+# used by the planet, 'float64' keeps the values exactly as exported
+PLANET_DTYPE = 'float64'
 
 # Directory with icons.
 PICS = r'./pics/'
@@ -22,16 +50,35 @@ PICS = r'./pics/'
 IMAGE_EXT = '.png'
 # A portion of a tile (e.g. hex) occupied by an icon. An icon is assumed to have equal height and width
 PIC_RATIO = 0.8
+# Maximum number of resized icons and Dymaxion tile stamps kept in memory
+STAMP_CACHE_SIZE = 1024
+# Sizes of icons in the equirectangular projection are rounded to multiples of ICON_SIZE_STEP pixels,
+# so that tiles of similar size share one resized icon. 1 keeps the exact sizes
+ICON_SIZE_STEP = 1
 
 # Input directory
 INPUT = r'./input/'
 # Output directory
 OUTPUT = r'./output/'
-# .py file name
+# Directory for data that only depends on the planet size and the image settings (e.g. which tile is at
+# which pixel of the equirectangular projection) and can be reused for other planets
+CACHE = r'./cache/'
+# Use the CACHE directory?
+USE_CACHE = True
+# .planet file name (binary format written by export.rkt, see planet_store.py)
+PLANET = f'earthgen_export_{PLANET_CHARACTERISTIC_SIZE}.planet'
+# .py file name (legacy python format written by export.rkt)
 PY = f'earthgen_export_{PLANET_CHARACTERISTIC_SIZE}.py'
-# .pickle file name
+# .pickle file name (legacy)
 PICKLE = f'p{PLANET_CHARACTERISTIC_SIZE}.pickle'
 
+# Print the statistics of the tile types?
+PRINT_STATISTICS = True
+# Save the statistics to OUTPUT as STATISTICS.json, STATISTICS_types.csv and STATISTICS_bands.csv?
+SAVE_STATISTICS = True
+STATISTICS = f'statistics_{PLANET_CHARACTERISTIC_SIZE}'
+# Width in degrees of the latitude bands of the statistics
+LATITUDE_BAND_DEGREES = 30
 # Save Dymaxion projection?
 SAVE_DYMAXION = False
 # Dymaxion projection file name (including extension)
@@ -42,7 +89,7 @@ DYMAXION_HEX_R = 50
 
 # Save equirectangular projection?
 SAVE_EQUIRECTANGULAR = True
-# Save equirectangular projection heightmap?
+# Save equirectangular projection heightmap? (doesn't need the tiles to be classified)
 SAVE_EQUIRECTANGULAR_HEIGHT = False
 # Equirectangular projection file name (including extension) and the corresponding height map
 EQUIRECTANGULAR = f'equirectangular_{PLANET_CHARACTERISTIC_SIZE}.png'
@@ -50,6 +97,55 @@ EQUIRECTANGULAR_HEIGHT = f'equirectangular_height_{PLANET_CHARACTERISTIC_SIZE}.p
 # The number of pixels for 1 degree of latitude and longitude. Affects the resolution of the
 # resulting image.
 EQUIRECTANGULAR_DEGREE = 20
+# The edges of the tiles are arcs, which are curved in the equirectangular projection. Every edge is
+# drawn as 2 ** EQUIRECTANGULAR_SUBDIVISIONS segments
+EQUIRECTANGULAR_SUBDIVISIONS = 3
+
+# Fields animated over the seasons in the equirectangular projection (also given by --animate FIELD in the command
+# line), any of SEASON_COLORS. Every field is saved to OUTPUT as SEASON_ANIMATION with its name
+SEASON_ANIMATIONS = []
+SEASON_ANIMATION = f'seasons_{{field}}_{PLANET_CHARACTERISTIC_SIZE}'
+# 'gif', 'webp' (if Pillow supports it) or 'png' for a directory of one PNG per season
+SEASON_FORMAT = 'gif'
+# Duration of a frame in milliseconds
+SEASON_FRAME_MS = 500
+# Colors of the values of the animated fields, from the lowest to the highest value of the field over all the
+# seasons and tiles, with the colors evenly spaced between them
+SEASON_COLORS = {
+    'snow': [(29, 78, 145), (229, 229, 229), (255, 255, 255)],
+    'lai': [(168, 159, 109), (202, 227, 110), (79, 158, 69), (20, 80, 30)],
+    'temperature': [(49, 54, 149), (116, 173, 209), (255, 255, 191), (244, 109, 67), (165, 0, 38)],
+    'precipitation': [(242, 227, 120), (160, 215, 107), (29, 78, 145), (8, 20, 49)],
+}
+
+# Save the images in horizontal strips instead of single files? Each image becomes a directory of PNG strips
+# with a manifest.json describing them. Keeps the memory use bounded for very large images
+SAVE_STRIPS = False
+# Maximum number of pixels in one strip
+STRIP_PIXELS = 2 ** 24
+
+# Number of processes rendering the images (overridden by --workers N in the command line). 1 renders
+# everything in the main process
+WORKERS = 1
+
+# Tune mode (also turned on by --tune in the command line): after changing the settings of the classification,
+# only the tiles whose type changed are repainted on the images saved by the last run in tune mode
+TUNE = False
+# File in OUTPUT with the tile types of the last run in tune mode and the images it saved
+TUNE_STATE = f'tune_{PLANET_CHARACTERISTIC_SIZE}.npz'
+# Images that are saved whole are split into about BANDS_PER_WORKER bands per worker, so that workers
+# that finish early can take another band
+BANDS_PER_WORKER = 4
+
+# Run report in OUTPUT: the wall and CPU seconds, memory and counters (tiles drawn, icon resizes, bytes written...)
+# of every stage of the run, see instrumentation.py. None saves no report
+REPORT = f'report_{PLANET_CHARACTERISTIC_SIZE}.json'
+# Trace the peak memory of every stage with tracemalloc (also turned on by --trace-memory in the command line)?
+# Slows the run down
+TRACE_MEMORY = False
+# Stages profiled with cProfile (also given by --profile STAGE in the command line), e.g. ['classification',
+# 'equirectangular']. The statistics are saved to OUTPUT as profile_<stage>.prof
+PROFILE_STAGES = []
 
 # Grid Color (RGBA, ex. (0, 0, 0, 255)) or None (the color of the corresponding hex will be used)
 GRID_COLOR = (0, 0, 0, 255)
@@ -116,6 +212,10 @@ JUNGLE_MIN_TEMPERATURE = 30 + 273.15
 # at least SEASONAL_SNOW_RATIO. Note: only some tiles can be snowy
 SEASONAL_SNOW_RATIO = 0.75
 
+# Number of passes of smoothing of the classification (0 for none). Every pass gives each tile the most common type
+# of the tile and its neighbours, which removes isolated tiles. Land and ocean tiles don't change each other
+SMOOTHING_PASSES = 0
+
 # Background colors for the corresponding tiles (RGB)
 COLORS = {
     'Jungle Forest': (94, 178, 106),
@@ -165,172 +265,148 @@ COLORS = {
 # add snowy tiles
 
 
-# Changes the structure of imported planet variable
-def merge_slices(planet):
+# Changes the structure of imported planet variable (a list of seasons, each a list of 5 slices
+# of {hex: tile}) into a columnar Planet
+def merge_slices(planet, dtype=PLANET_DTYPE):
     planet_size = int(((1 + 8 * len(planet[0][0]))**0.5 + 1) / 4)
-    new_planet = []
-    for season in planet:
-        new_planet.append({})
-        for i, sl in enumerate(season):
-            for hx, params in sl.items():
-                corrected_hx = hx[0] + (planet_size - 1) * i, hx[1]
-                if corrected_hx not in new_planet[-1]:
-                    new_planet[-1][corrected_hx] = params
+
+    # the first season defines the hexes. Tiles are stored in the order of their ids, as in .planet files
+    hexes = {}
+    for i, sl in enumerate(planet[0]):
+        for hx, params in sl.items():
+            corrected_hx = hx[0] + (planet_size - 1) * i, hx[1]
+            if corrected_hx not in hexes:
+                hexes[corrected_hx] = params['id']
+    rows = {tile_id: row for row, tile_id in enumerate(sorted(set(hexes.values())))}
+
+    new_planet = empty_planet(planet_size, len(rows), len(planet), len(hexes), dtype)
+    new_planet.hexes[:] = list(hexes.keys())
+    new_planet.hex_rows[:] = [rows[tile_id] for tile_id in hexes.values()]
+
+    for s, season in enumerate(planet):
+        for sl in season:
+            for params in sl.values():
+                row = rows[params['id']]
+                for field in SEASONAL_FIELDS:
+                    new_planet.fields[field][s, row] = params[field]
+                if s == 0:
+                    new_planet.ids[row] = params['id']
+                    for field in STATIC_FIELDS:
+                        new_planet.fields[field][row] = params[field]
+                    coords = params['coords']
+                    new_planet.pentagon[row] = len(coords) == 5
+                    new_planet.corners[row, :len(coords)] = coords
+                    new_planet.corners[row, len(coords):] = coords[-1]
     return new_planet, planet_size
 
-# Classifies the tile
-def type_of_hex(hx, planet):
-    def seasonal(param):
-        return [season[hx][param] for season in planet]
-    def spread(lst):
-        return max(lst) - min(lst)
-    
-    lai = seasonal('lai')
-    precip = seasonal('precipitation')
-    snow = seasonal('snow')
-    temp = seasonal('temperature')
-    elevation = planet[0][hx]['elevation']
-    snowy_threshold = SEASONAL_SNOW_RATIO * len(planet)
-    
-    result = ''
-    
+# Tile types. The position of a type in the tuple is its code in the arrays returned by type_of_hexes
+TILE_TYPES = tuple(COLORS)
+TILE_CODES = {tpe: code for code, tpe in enumerate(TILE_TYPES)}
+
+# Reduces the seasonal fields over the seasons. Returns a dict of (tiles,) arrays, which is all the
+# classification needs from the seasons
+def season_summary(planet):
+    lai = planet.fields['lai']
+    precip = planet.fields['precipitation']
+    snow = planet.fields['snow']
+    temp = planet.fields['temperature']
+    elevation = planet.fields['elevation']
+    return {
+        'max_lai': lai.max(axis=0),
+        'min_lai': lai.min(axis=0),
+        'min_temperature': temp.min(axis=0),
+        'max_temperature': temp.max(axis=0),
+        'snow': snow.sum(axis=0),
+        # lowest precipitation of the seasons when the tile isn't covered by snow
+        'min_snowless_precipitation': np.where(snow > 0, np.inf, precip).min(axis=0),
+        # highest temperature with 1 degree less for every 100 m of elevation
+        'max_summit_temperature': (temp - elevation / 100).max(axis=0),
+    }
+
+# Classifies all tiles at once. Returns an array with the code of the type of every row of the planet
+# and the table of type names (code -> name). The rules are checked in the following order:
+# oceans, wetlands, forests, mountains with no forests, savanna / tundra, grass and deserts.
+# summary is the season_summary of the planet (computed if not given)
+def type_of_hexes(planet, summary=None):
+    if summary is None:
+        summary = season_summary(planet)
+    elevation = np.asarray(planet.fields['elevation'])
+    snowy_threshold = SEASONAL_SNOW_RATIO * planet.seasons
+
+    max_lai = summary['max_lai']
+    lai_spread = max_lai - summary['min_lai']
+    min_temp = summary['min_temperature']
+    max_temp = summary['max_temperature']
+    snowy = summary['snow'] >= snowy_threshold
+    mountain = elevation > MOUNTAIN_ELEVATION
+    hill = ~mountain & (elevation > HILL_ELEVATION)
+    # Mountain vs. Mountains
+    plural = (elevation % 2).astype(int) == 1
+
+    codes = np.zeros(len(planet), dtype=np.uint8)
+    undecided = np.ones(len(planet), dtype=bool)
+
+    def assign(condition, tpe):
+        mask = undecided & condition
+        codes[mask] = TILE_CODES[tpe] if isinstance(tpe, str) else tpe[mask]
+        undecided[mask] = False
+
+    # Combines a prefix ('', 'Heavy ', ...) and a base type ('Jungle Forest', ...) chosen per tile
+    def combine(prefixes, prefix_choice, bases, base_choice):
+        table = np.array([[TILE_CODES[prefix + base] for base in bases] for prefix in prefixes], dtype=np.uint8)
+        return table[prefix_choice, base_choice]
+
     # Oceans
-    if elevation < DEEP_OCEAN:
-        return 'Deep Ocean'
-    elif elevation < MID_OCEAN:
-        return 'Mid Ocean'
-    elif elevation < 0:
-        return 'Surface Ocean'
-    
+    assign(elevation < DEEP_OCEAN, 'Deep Ocean')
+    assign(elevation < MID_OCEAN, 'Mid Ocean')
+    assign(elevation < 0, 'Surface Ocean')
+
     # Wetlands
-    if (elevation < HILL_ELEVATION and 
-      all([(pre > WETLANDS_PRECIPITATION or sn > 0) for (pre, sn) in zip(precip, snow)]) and
-      sum(snow) < snowy_threshold):
-        if max(lai) > SAVANNA_TUNDRA_LAI:
-            return 'Swamp'
-        else:
-            return 'Marsh'
-    
+    wetlands = ((elevation < HILL_ELEVATION) &
+                (summary['min_snowless_precipitation'] > WETLANDS_PRECIPITATION) &
+                ~snowy)
+    assign(wetlands & (max_lai > SAVANNA_TUNDRA_LAI), 'Swamp')
+    assign(wetlands, 'Marsh')
+
     # Forests
-    if max(lai) > FOREST_LAI:
-        if (spread(lai) < JUNGLE_SEASONAL_LAI_VARIATION
-          and min(temp) > JUNGLE_MIN_TEMPERATURE
-          and sum(snow) < snowy_threshold):
-            result += 'Jungle Forest'
-        elif (spread(lai) < BOREAL_SEASONAL_LAI_VARIATION or sum(snow) >= snowy_threshold):
-            if sum(snow) < snowy_threshold:
-                result += 'Boreal Forest'
-            else:
-                result += 'Snowy Boreal Forest'
-        elif spread(lai) > DECIDUOUS_SEASONAL_LAI_VARIATION:
-            result += 'Deciduous Forest'
-        else:
-            result += 'Mixed Forest'
-        
-        if elevation > MOUNTAIN_ELEVATION:
-            result = ('Mountain ', 'Mountains ')[int(elevation % 2)] + result
-        elif elevation > HILL_ELEVATION:
-            result = 'Hill ' + result
-        elif max(lai) > HEAVY_FOREST_LAI:
-            result = 'Heavy ' + result
-        
-        return result
-    
+    forest_base = np.select(
+        [(lai_spread < JUNGLE_SEASONAL_LAI_VARIATION) & (min_temp > JUNGLE_MIN_TEMPERATURE) & ~snowy,
+         (lai_spread < BOREAL_SEASONAL_LAI_VARIATION) & ~snowy,
+         snowy,
+         lai_spread > DECIDUOUS_SEASONAL_LAI_VARIATION],
+        [0, 1, 2, 3], default=4)
+    forest_prefix = np.select([mountain & ~plural, mountain & plural, hill, max_lai > HEAVY_FOREST_LAI],
+                              [1, 2, 3, 4], default=0)
+    assign(max_lai > FOREST_LAI,
+           combine(['', 'Mountain ', 'Mountains ', 'Hill ', 'Heavy '], forest_prefix,
+                   ['Jungle Forest', 'Boreal Forest', 'Snowy Boreal Forest', 'Deciduous Forest', 'Mixed Forest'],
+                   forest_base))
+
     # Moutains with no forests
-    if elevation > MOUNTAIN_ELEVATION:
-        result = ('Mountain', 'Mountains')[int(elevation % 2)]
-        if sum(snow) >= snowy_threshold or max([t - elevation / 100 for t in temp]) < 0:
-            result = 'Snowy ' + result
-        
-        return result
-    
+    snowy_mountain = snowy | (summary['max_summit_temperature'] < 0)
+    assign(mountain, combine(['', 'Snowy '], snowy_mountain.astype(int),
+                             ['Mountain', 'Mountains'], plural.astype(int)))
+
     # Hills and Flat Lands with some trees (but not forests)
-    if max(lai) > SAVANNA_TUNDRA_LAI:
-        if min(temp) > SAVANNA_MIN_TEMPERATURE:
-            result = 'Savanna'
-        else:
-            result = 'Tundra'
-        if elevation > HILL_ELEVATION:
-            result = 'Hill ' + result
-        
-        return result
-    
+    assign(max_lai > SAVANNA_TUNDRA_LAI,
+           combine(['', 'Hill '], hill.astype(int),
+                   ['Savanna', 'Tundra'], (min_temp <= SAVANNA_MIN_TEMPERATURE).astype(int)))
+
     # Hills and Flat Lands with no trees (grass or deserts)
-    if sum(snow) >= snowy_threshold:
-        return 'Snow Desert'
-    elif max(lai) > LAND_LAI:
-        return 'Grass'
-    elif min(temp) > SAND_DESERT_MIN_TEMPERATURE:
-        return 'Sand Desert'
-    elif max(temp) < SNOW_DESERT_MAX_TEMPERATURE:
-        return 'Snow Desert'
-    else:
-        return 'Bare Land'
-
-# Classifies all tiles, used in statistics
-def type_of_hexes(planet):
-    season = planet[0]
-    hex_types = {}
-    for hx in season:
-        hex_types[hx] = type_of_hex(hx, planet)
-    return hex_types
-
-# Gathers statics of tile types
-def gather_statistics(hex_types):
-    def key_include(dct, word):
-        s = 0
-        for key in dct.keys():
-            if word in key:
-                s += dct[key]
-        return s     
-        
-    hexes = hex_types.values()
-    count = Counter(hexes)
-    
-    total = sum(count.values())
-    water = key_include(count, 'Ocean')
-    land = total - water
-    hill = key_include(count, 'Hill')
-    mountain = key_include(count, 'Mountain')
-    flat = land - hill - mountain
-    
-    jungle = key_include(count, 'Jungle')
-    deciduous = key_include(count, 'Deciduous')
-    boreal = key_include(count, 'Boreal')
-    mixed = key_include(count, 'Mixed')
-    forest = key_include(count, 'Forest')
-    
-    savanna = key_include(count, 'Savanna')
-    tundra = key_include(count, 'Tundra')
-    grass = key_include(count, 'Grass')
-    sand_desert = key_include(count, 'Sand Desert')
-    snow_desert = key_include(count, 'Snow Desert')
-    bare_land = key_include(count, 'Bare Land')
-    all_deserts = sand_desert + snow_desert + bare_land
-    
-    marsh = key_include(count, 'Marsh')
-    swamp = key_include(count, 'Swamp')
-    wetlands = marsh + swamp
-    
-    output = ("Ocean: {:.2f}%\nLand: {:.2f}%\n    Hill: {:.2f}%\n    Mountain: {:.2f}%\n    Flat: {:.2f}%\n" +
-              "Forests: {:.2f}%\n    Jungle: {:.2f}%\n    Deciduous: {:.2f}%\n    Boreal: {:.2f}%\n    Mixed: {:.2f}%\n" +
-              "Savanna: {:.2f}%\nTundra: {:.2f}%\nGrass: {:.2f}%\n" +
-              "Desert: {:.2f}%\n    Warm Desert: {:.2f}%\n    Snow Desert: {:.2f}%\n    Bare land: {:.2f}%\n" +
-              "Wetlands: {:.2f}%\n    Marsh: {:.2f}%\n    Swamp: {:.2f}%")
-
-    prc = lambda n, m: 100 * (n / m) if m > 0 else 0
-    params = [prc(water, total), prc(land, total), prc(hill, land), prc(mountain, land), prc(flat, land),
-              prc(forest, land), prc(jungle, forest), prc(deciduous, forest), prc(boreal, forest), prc(mixed, forest),
-              prc(savanna, land), prc(tundra, land), prc(grass, land),
-              prc(all_deserts, land), prc(sand_desert, all_deserts), prc(snow_desert, all_deserts), prc(bare_land, all_deserts),
-              prc(wetlands, land), prc(marsh, wetlands), prc(swamp, wetlands)]
-
-    # params = [water / total, land / total, hill / land, mountain / land, flat / land,
-    #           forest / land, jungle / forest, deciduous / forest, boreal / forest, mixed / forest,
-    #           savanna / land, tundra / land, grass / land,
-    #           all_deserts / land, sand_desert / all_deserts, snow_desert / all_deserts, bare_land / all_deserts,
-    #           wetlands / land, marsh / wetlands, swamp / wetlands]
-    return output.format(*params)
+    assign(snowy, 'Snow Desert')
+    assign(max_lai > LAND_LAI, 'Grass')
+    assign(min_temp > SAND_DESERT_MIN_TEMPERATURE, 'Sand Desert')
+    assign(max_temp < SNOW_DESERT_MAX_TEMPERATURE, 'Snow Desert')
+    assign(undecided, 'Bare Land')
+
+    if SMOOTHING_PASSES:
+        codes = majority_filter(tile_adjacency(planet), codes, SMOOTHING_PASSES, elevation < 0)
+    return codes, TILE_TYPES
+
+# Area-weighted statistics of the tile types of the planet, by latitude band and season (see planet_statistics.py).
+# codes are the tile types from type_of_hexes
+def gather_statistics(planet, codes, names=TILE_TYPES):
+    return planet_statistics(planet, codes, names, LATITUDE_BAND_DEGREES)
 
 # Imports icons for tiles
 def import_tile_icons():
@@ -348,16 +424,54 @@ def import_tile_icons():
 
     return icons
 
-# Generates and save Dymaxion map projections
-def save_dymaxion(planet, planet_size, icons):
+# LRU cache of resized icons and pre-rendered tile stamps, shared by both projections.
+# hits and misses count the lookups
+class StampCache:
+    def __init__(self, icons, max_size=STAMP_CACHE_SIZE, step=ICON_SIZE_STEP):
+        self.icons = icons
+        self.max_size = max_size
+        self.step = step
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    # Returns the cached value for the key, make() creates it on a miss
+    def get(self, key, make):
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        value = make()
+        self._cache[key] = value
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return value
+
+    # Icon of the terrain resized to (width, height). The sizes are rounded to multiples of the step
+    def icon(self, terrain, width, height):
+        width = max(self.step, round(width / self.step) * self.step)
+        height = max(self.step, round(height / self.step) * self.step)
+        def resize():
+            count('icon_resizes')
+            return self.icons[terrain].resize((width, height), resample=Image.LANCZOS)
+        return self.get(('icon', terrain, width, height), resize)
+
+# Sizes in pixels of the Dymaxion projection: (hex_r, hex_hw, figure_r, stamp_r), where stamp_r is
+# the distance from the center of a hex to the border of its stamp
+def dymaxion_sizes():
     # in px
     hex_r = DYMAXION_HEX_R
     hex_hw = round(hex_r * 3 ** 0.5 / 2)
     figure_r = PIC_RATIO * hex_r
+    # stamps cover the hex and the icon with a margin
+    stamp_r = ceil(max(hex_r, hex_hw, figure_r)) + 2
+    return hex_r, hex_hw, figure_r, stamp_r
 
-    def hex_cartesian_center_to_cartesian_vertices(x, y, r, hw):
-        return [(x - hw, y - r / 2), (x, y - r), (x + hw, y - r / 2),
-                (x + hw, y + r / 2), (x, y + r), (x - hw, y + r / 2)]
+# Positions in the Dymaxion projection: the centers (xs, ys) of the hexes of the planet and the
+# (width, height) of the image
+def dymaxion_geometry(planet, planet_size):
+    hex_r, hex_hw, figure_r, stamp_r = dymaxion_sizes()
 
     def hex_index_to_cartesian_center(a, b, r, hw, planet_size):
         x, y = 2 * hw * (a + b / 2), 3 * b / 2 * r
@@ -366,162 +480,886 @@ def save_dymaxion(planet, planet_size, icons):
     # width and height
     picture_size = round((11 * planet_size - 9) * hex_hw), round((4.5 * planet_size - 2.5) * hex_r)
 
-    dymaxion = Image.new('RGBA', picture_size, color=(0,0,0,0))
-    for hx in planet[0]:
-        a, b = hx
-        x, y = hex_index_to_cartesian_center(a, b, hex_r, hex_hw, planet_size)
+    hex_indices = np.asarray(planet.hexes, dtype=np.float64)
+    xs, ys = hex_index_to_cartesian_center(hex_indices[:, 0], hex_indices[:, 1], hex_r, hex_hw, planet_size)
+    return xs, ys, picture_size
+
+# Dymaxion map projection. Returns the (path, render) pairs of the image (see save_images) and its
+# (width, height). codes are the tile types from type_of_hexes
+def dymaxion_outputs(planet, stamps, codes, planet_size):
+    hex_r, hex_hw, figure_r, stamp_r = dymaxion_sizes()
+
+    def hex_cartesian_center_to_cartesian_vertices(x, y, r, hw):
+        return [(x - hw, y - r / 2), (x, y - r), (x + hw, y - r / 2),
+                (x + hw, y + r / 2), (x, y + r), (x - hw, y + r / 2)]
+
+    def rgba(color):
+        return tuple(color) + (255,) * (4 - len(color))
+
+    # A stamp is the hex (fill and outline) with the icon, drawn as they would be drawn on the map, and the
+    # mask to paste it with: the whole hex, plus the alpha of the parts of the icon sticking out of it.
+    # Pasting it once gives the same pixels as drawing the polygon and pasting the icon on the map.
+    # (x, y) only matter through their fractional parts and the rounding of the icon position
+    def make_stamp(tpe, fill, outline, x, y, icon_x, icon_y):
+        count('stamps_made')
+        size = 2 * stamp_r + 1
         coords = hex_cartesian_center_to_cartesian_vertices(x, y, hex_r, hex_hw)
-        tpe = type_of_hex(hx, planet)
-        fill = COLORS[tpe]
-        outline = GRID_COLOR or fill
-        
-        ImageDraw.Draw(dymaxion).polygon(coords, outline=outline, fill=fill)
-        
-        if tpe in icons:
-            icon = icons[tpe]
-            icon = icons[type_of_hex(hx, planet)]
-            icon = icon.resize((round(2 * figure_r), round(2 * figure_r)), resample=Image.LANCZOS)
-            dymaxion.paste(icon, (round(x - figure_r), round(y - figure_r)), icon)
-
-    dymaxion.save(OUTPUT + DYMAXION)
-
-# Generates and saves Equirectangular map and height map projections
-def save_equirectangular(planet, icons, save_height=True):
-    degree = EQUIRECTANGULAR_DEGREE
-    max_height = max([tile['elevation'] for tile in planet[0].values()])
-
-    def insert_points(lst):
-        new_lst = []
-        for i in range(len(lst)):
-            v1 = lst[i]
-            v2 = lst[(i + 1) % len(lst)]
-            v = [s + t for (s, t) in zip(v1, v2)]
-            v_norm = sum(vx ** 2 for vx in v) ** 0.5
-            v = [vx / v_norm for vx in v]
-            new_lst.extend([v1, v])
-        return new_lst
-
-    def divide_line(lst, n):
-        for i in range(n):
-            lst = insert_points(lst)
-        return lst
-        
-    def cart_to_spherical(lst):
+        stamp = Image.new('RGBA', (size, size), color=(0, 0, 0, 0))
+        ImageDraw.Draw(stamp).polygon(coords, outline=outline, fill=fill)
+        mask = Image.new('L', (size, size), color=0)
+        ImageDraw.Draw(mask).polygon(coords, fill=255)
+        # PIL only draws the outline if its color differs from the fill
+        if rgba(outline) != rgba(fill):
+            ImageDraw.Draw(mask).polygon(coords, outline=255)
+        if tpe in stamps.icons:
+            icon = stamps.icon(tpe, 2 * figure_r, 2 * figure_r)
+            stamp.paste(icon, (icon_x, icon_y), icon)
+            overhang = Image.new('RGBA', (size, size), color=(0, 0, 0, 0))
+            overhang.paste(icon, (icon_x, icon_y))
+            stamp = Image.composite(stamp, overhang, mask)
+            mask = Image.composite(mask, overhang.getchannel('A'), mask)
+        return stamp, mask
+
+    xs, ys, picture_size = dymaxion_geometry(planet, planet_size)
+    stamp_lefts, stamp_tops = np.floor(xs) - stamp_r, np.floor(ys) - stamp_r
+
+    # the columns [left, right) of the rows [top, bottom) of the image
+    def render(top, bottom, left=0, right=picture_size[0]):
+        dymaxion = Image.new('RGBA', (right - left, bottom - top), color=(0,0,0,0))
+        # hexes whose stamps intersect the rectangle
+        in_band = np.nonzero((stamp_tops + 2 * stamp_r >= top) & (stamp_tops < bottom) &
+                             (stamp_lefts + 2 * stamp_r >= left) & (stamp_lefts < right))[0]
+        count('tiles_drawn', len(in_band))
+        for i in in_band.tolist():
+            x, y = xs[i].item(), ys[i].item()
+            tpe = TILE_TYPES[codes[planet.hex_rows[i]]]
+            fill = COLORS[tpe]
+            outline = GRID_COLOR or fill
+
+            origin_x, origin_y = floor(x) - stamp_r, floor(y) - stamp_r
+            local_x, local_y = x - origin_x, y - origin_y
+            icon_x, icon_y = round(x - figure_r) - origin_x, round(y - figure_r) - origin_y
+            stamp, mask = stamps.get(('dymaxion', tpe, fill, outline, local_x, local_y, icon_x, icon_y),
+                                     lambda: make_stamp(tpe, fill, outline, local_x, local_y, icon_x, icon_y))
+            dymaxion.paste(stamp, (origin_x - left, origin_y - top), mask)
+        return dymaxion
+
+    return [(OUTPUT + DYMAXION, render)], picture_size
+
+# Generates and save Dymaxion map projections. codes are the tile types from type_of_hexes.
+# With a pool from render_pool the image is rendered by its workers
+def save_dymaxion(planet, planet_size, stamps, codes, pool=None):
+    outputs, (width, height) = dymaxion_outputs(planet, stamps, codes, planet_size)
+    save_images(outputs, width, height, pool, ('dymaxion', (planet_size,)))
+
+# Splits every edge of the polygons in two at its midpoint (projected back to the sphere), subdivisions
+# times. corners is a (polygons, n, 3) array; returns a (polygons, n * 2 ** subdivisions, 3) array
+def subdivide_polygons(corners, subdivisions):
+    for _ in range(subdivisions):
+        midpoints = corners + np.roll(corners, -1, axis=1)
+        midpoints /= np.sqrt((midpoints ** 2).sum(axis=2))[..., None]
+        corners = np.stack([corners, midpoints], axis=2).reshape(len(corners), -1, 3)
+    return corners
+
+# Projects the tiles to the equirectangular image with degree pixels per degree. Returns the polygons
+# (rows, offsets, points): polygon i is drawn for the tile at row rows[i] and has the pixel coordinates
+# points[offsets[i]:offsets[i + 1]]. The polygons are in the order the tiles were drawn before the label
+# raster (by the last hex of the tile in the export), so that the tile drawn last still wins the pixels where two
+# polygons overlap; tiles crossing the antimeridian are split into two polygons, the one on the left side of the
+# image first
+def equirectangular_polygons(planet, degree, subdivisions=EQUIRECTANGULAR_SUBDIVISIONS):
+    # (rows, part of the tile, (polygons, points, 2) longitudes and latitudes) for groups of polygons
+    # with the same number of points
+    groups = []
+    for pentagon in (False, True):
+        tile_rows = np.nonzero(planet.pentagon == pentagon)[0]
+        if len(tile_rows) == 0:
+            continue
+        corners = np.asarray(planet.corners[tile_rows, :5 if pentagon else 6], dtype=np.float64)
+        x, y, z = np.moveaxis(subdivide_polygons(corners, subdivisions), 2, 0)
+
         # lamb, phi = longitude, latitude
-        lamb = lambda x, y: acos(x / (x ** 2 + y ** 2) ** 0.5) * (1 if y > 0 else -1)
-        phi = asin
-        
-        new_lst = []
-        for i, (x, y, z) in enumerate(lst):
-            try:
-                new_lst.append((lamb(x, y), phi(z)))
-            except ZeroDivisionError:
-                # pole
-                last_lamb, last_phi = new_lst[-1]
-                max_phi = pi / 2 * (1 if last_phi > 0 else -1)
-                new_lst.extend([(last_lamb, max_phi), (- last_lamb, max_phi)])
-        return new_lst
-
-    def spherical_to_img(lst, scale=degree):
-        return [((lamb + pi) * 180 / pi * scale, (- phi + pi / 2) * 180 / pi * scale)   for (lamb, phi) in lst]
-
-    def draw_tile_with_spherical_coordinates(img, coords, outline, fill, terrain=None):
-        coords = spherical_to_img(coords)
-        ImageDraw.Draw(img).polygon(coords, outline=outline, fill=fill)
-        if terrain in icons:
-            xs, ys = zip(*coords)
-            tile_w, tile_h = max(xs) - min(xs), max(ys) - min(ys)
-            icon_w, icon_h = round(tile_w * PIC_RATIO), round(tile_h * PIC_RATIO)
-            icon_pos_x, icon_pos_y = (round(min(xs) + tile_w * (1 - PIC_RATIO) / 2), 
-                                      round(min(ys) + tile_h * (1 - PIC_RATIO) / 2))
-
-            icon = icons[terrain]
-            icon = icon.resize((icon_w, icon_h), resample=Image.LANCZOS)
-            img.paste(icon, (icon_pos_x, icon_pos_y), icon)
-
-    equirectangular = Image.new('RGBA', (360 * degree, 180 * degree), color=(0, 0, 0))
-    equirectangular_height = Image.new('RGBA', (360 * degree, 180 * degree), color=(0, 0, 0))
-    draw = ImageDraw.Draw(equirectangular)
-    draw_height = ImageDraw.Draw(equirectangular_height)
-
-    for hx in planet[0]:
-        cart_coords = planet[0][hx]['coords']
-        cart_coords = divide_line(cart_coords, 3)
-        
-        ys = [y for (x, y, z) in cart_coords]
-        special_case = cart_coords[0][0] < 0 and not (all(y > 0 for y in ys) or all(y < 0 for y in ys))
-        
-        coords = cart_to_spherical(cart_coords)
-        tpe = type_of_hex(hx, planet)
-        fill = COLORS[tpe]
-        outline = GRID_COLOR or fill
-
-        color_height = round(planet[0][hx]['elevation'] / max_height * 255)
-        fill_height = (color_height,) * 3
-
-        if special_case:
-            all_coords = [[c if c[0] < 0 else (c[0] - 2 * pi, c[1]) for c in coords],
-                          [c if c[0] > 0 else (c[0] + 2 * pi, c[1]) for c in coords]]
+        r = np.sqrt(x ** 2 + y ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lamb = np.arccos(np.clip(x / r, -1, 1)) * np.where(y > 0, 1, -1)
+        phi = np.arcsin(np.clip(z, -1, 1))
+        coords = np.stack([lamb, phi], axis=2)
+
+        split = (x[:, 0] < 0) & ~((y > 0).all(axis=1) | (y < 0).all(axis=1))
+        count('antimeridian_splits', int(split.sum()))
+        pole = (r == 0).any(axis=1)
+        for i in np.nonzero(pole)[0].tolist():
+            # the pole is replaced by an edge along the top or the bottom of the image
+            tile_coords = []
+            for (lamb_i, phi_i), at_pole in zip(coords[i].tolist(), (r[i] == 0).tolist()):
+                if at_pole:
+                    last_lamb, last_phi = tile_coords[-1]
+                    max_phi = pi / 2 * (1 if last_phi > 0 else -1)
+                    tile_coords.extend([(last_lamb, max_phi), (- last_lamb, max_phi)])
+                else:
+                    tile_coords.append((lamb_i, phi_i))
+            groups.append((tile_rows[i:i + 1], split[i:i + 1], np.array([tile_coords])))
+        groups.append((tile_rows[~pole], split[~pole], coords[~pole]))
+
+    rows, parts, polygons = [], [], []
+    for tile_rows, split, coords in groups:
+        lamb = coords[..., 0]
+        # split tiles: one polygon with all the points left of the antimeridian, one with all the points right of it
+        rows += [tile_rows, tile_rows[split]]
+        parts += [np.zeros(len(tile_rows)), np.ones(split.sum())]
+        polygons += [np.stack([np.where(split[:, None] & (lamb >= 0), lamb - 2 * pi, lamb), coords[..., 1]], axis=2),
+                     np.stack([np.where(lamb[split] <= 0, lamb[split] + 2 * pi, lamb[split]), coords[split, :, 1]], axis=2)]
+
+    lengths = np.concatenate([np.full(len(p), p.shape[1]) for p in polygons])
+    starts = np.cumsum(lengths) - lengths
+    draw_order = np.zeros(len(planet), dtype=np.int64)
+    np.maximum.at(draw_order, np.asarray(planet.hex_rows), np.arange(len(planet.hex_rows)))
+    order = np.lexsort((np.concatenate(parts), draw_order[np.concatenate(rows)]))
+    offsets = np.concatenate([[0], np.cumsum(lengths[order])])
+    gather = np.repeat(starts[order] - offsets[:-1], lengths[order]) + np.arange(offsets[-1])
+    lamb, phi = np.concatenate([p.reshape(-1, 2) for p in polygons])[gather].T
+    points = np.stack([(lamb + pi) * 180 / pi * degree, (- phi + pi / 2) * 180 / pi * degree], axis=1)
+    return np.concatenate(rows)[order].astype(np.int32), offsets, points
+
+# Bounding boxes of the polygons in pixels: (polygons, 4) array of min x, min y, max x, max y
+def polygon_bounds(polygons):
+    rows, offsets, points = polygons
+    return np.hstack([np.minimum.reduceat(points, offsets[:-1]), np.maximum.reduceat(points, offsets[:-1])])
+
+# Polygons and bounds of the last planet projected, so that the labels and the images share them
+_last_geometry = {}
+
+# equirectangular_polygons and polygon_bounds of the planet. The polygons only depend on the grid, so they are
+# kept in CACHE for every planet size, EQUIRECTANGULAR_SUBDIVISIONS and EQUIRECTANGULAR_DEGREE
+def equirectangular_geometry(planet, degree):
+    key = (id(planet), degree)
+    if key not in _last_geometry:
+        _last_geometry.clear()
+        path = os.path.join(CACHE, f'equirectangular_polygons_{planet.size}_{EQUIRECTANGULAR_SUBDIVISIONS}_'
+                                   f'{degree}_{grid_fingerprint(planet)}.npz')
+        if USE_CACHE and os.path.exists(path):
+            with np.load(path) as data:
+                polygons = data['rows'], data['offsets'], data['points']
+        else:
+            with stage('equirectangular_polygons'):
+                polygons = equirectangular_polygons(planet, degree)
+            if USE_CACHE:
+                os.makedirs(CACHE, exist_ok=True)
+                # render workers may read or write the file at the same time
+                atomic_write(path, lambda f: np.savez(f, rows=polygons[0], offsets=polygons[1], points=polygons[2]))
+                count_file(path)
+        # the planet is kept so that its id can't be reused by another planet
+        _last_geometry[key] = planet, polygons, polygon_bounds(polygons)
+    return _last_geometry[key][1:]
+
+# Indices of the polygons that intersect the rows [top, bottom), and the columns [left, right) if given
+# (with a pixel of margin for the outline)
+def polygons_in_band(bounds, top, bottom, left=-np.inf, right=np.inf):
+    return np.nonzero((bounds[:, 3] + 1 >= top) & (bounds[:, 1] - 1 < bottom) &
+                      (bounds[:, 2] + 1 >= left) & (bounds[:, 0] - 1 < right))[0]
+
+# Rasterizes the tiles in the rows [top, bottom) of the image: every pixel of the returned
+# (bottom - top, width) int32 array holds the row of the tile drawn there, -1 where there's no tile
+def rasterize_labels(polygons, bounds, width, top, bottom):
+    rows, offsets, points = polygons
+    in_band = polygons_in_band(bounds, top, bottom)
+    count('polygons_rasterized', len(in_band))
+    # PIL rasterizes polygons with negative coordinates slightly differently, so the band is drawn
+    # from the top of the highest polygon and cropped
+    start = max(0, min([top] + np.floor(bounds[in_band, 1] - 1).astype(int).tolist()))
+    labels = Image.new('I', (width, bottom - start), color=-1)
+    draw = ImageDraw.Draw(labels)
+    for i in in_band.tolist():
+        row = int(rows[i])
+        draw.polygon((points[offsets[i]:offsets[i + 1]] - (0, start)).ravel().tolist(), outline=row, fill=row)
+    return np.asarray(labels)[top - start:]
+
+# Path of the labels of the planet in CACHE
+def equirectangular_labels_path(planet, degree):
+    return os.path.join(CACHE, f'equirectangular_labels_{planet.size}_{EQUIRECTANGULAR_SUBDIVISIONS}_'
+                               f'{degree}_{grid_fingerprint(planet)}.npy')
+
+# Labels of the whole image. They only depend on the grid, so they are kept in CACHE for every
+# planet size, EQUIRECTANGULAR_SUBDIVISIONS and EQUIRECTANGULAR_DEGREE (at path, if the caller already has it)
+def equirectangular_labels(planet, degree, polygons, bounds, path=None):
+    path = path or equirectangular_labels_path(planet, degree)
+    if USE_CACHE and os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+
+    with stage('rasterize_labels'):
+        labels = rasterize_labels(polygons, bounds, 360 * degree, 0, 180 * degree)
+
+    if USE_CACHE:
+        os.makedirs(CACHE, exist_ok=True)
+        # other runs may read the file at the same time
+        atomic_write(path, lambda f: np.save(f, labels))
+        count_file(path)
+    return labels
+
+# Palette of paint_labels: colors is a (tiles, channels) array, background is used where there's no tile
+def label_palette(colors, background):
+    return np.ascontiguousarray(np.vstack([colors, background]), dtype=np.uint8)
+
+# Gives every pixel the color of its tile in the palette from label_palette
+def paint_labels(labels, palette):
+    # -1 picks the background
+    if palette.shape[1] == 4:
+        # gathering one uint32 per pixel is several times faster than 4 bytes
+        return palette.view(np.uint32)[:, 0][labels].view(np.uint8).reshape(labels.shape + (4,))
+    return palette[labels]
+
+# Pixels on the boundary of two tiles (the right or the lower neighbour is in another tile)
+def label_boundaries(labels):
+    boundaries = np.zeros(labels.shape, dtype=bool)
+    boundaries[:, :-1] |= labels[:, :-1] != labels[:, 1:]
+    boundaries[:-1] |= labels[:-1] != labels[1:]
+    return boundaries
+
+# Pastes the icons of the tiles over their polygons. img holds the rectangle of the map whose top left
+# corner is (left, top)
+def paste_equirectangular_icons(img, polygons, bounds, stamps, codes, top=0, left=0):
+    rows = polygons[0]
+    for i in polygons_in_band(bounds, top, top + img.height, left, left + img.width).tolist():
+        terrain = TILE_TYPES[codes[rows[i]]]
+        if terrain not in stamps.icons:
+            continue
+        min_x, min_y, max_x, max_y = bounds[i].tolist()
+        tile_w, tile_h = max_x - min_x, max_y - min_y
+        icon_w, icon_h = round(tile_w * PIC_RATIO), round(tile_h * PIC_RATIO)
+        icon_pos_x, icon_pos_y = (round(min_x + tile_w * (1 - PIC_RATIO) / 2),
+                                  round(min_y + tile_h * (1 - PIC_RATIO) / 2))
+
+        icon = stamps.icon(terrain, icon_w, icon_h)
+        img.paste(icon, (icon_pos_x - left, icon_pos_y - top), icon)
+        count('icons_pasted')
+
+# Colors of the tiles in the terrain map
+def terrain_colors(codes):
+    palette = np.array([COLORS[tpe] + (255,) for tpe in TILE_TYPES])
+    return palette[codes]
+
+# Colors of the tiles in the height map
+def height_colors(planet):
+    elevation = np.asarray(planet.fields['elevation'], dtype=np.float64)
+    height = np.clip(np.round(elevation / elevation.max() * 255), 0, 255)
+    return np.stack([height, height, height, np.full_like(height, 255)], axis=1)
+
+# Rows [top, bottom) of the bands of at most band_height rows that an image is split into
+def image_bands(height, band_height):
+    return [(top, min(top + band_height, height)) for top in range(0, height, band_height)]
+
+# Renders the strip (index, top, bottom) of every output and saves it in the directory of the output
+def save_strip(outputs, strip):
+    index, top, bottom = strip
+    for path, render in outputs:
+        strip_path = os.path.join(os.path.splitext(path)[0], f'strip_{index:05d}.png')
+        render(top, bottom).save(strip_path)
+        count_file(strip_path)
+
+# Saves images of the same size. outputs are (path, render) pairs, where render(top, bottom) returns the
+# rows [top, bottom) of the image. With SAVE_STRIPS every image is rendered and saved in horizontal
+# strips of at most STRIP_PIXELS pixels: the strips go to a directory named after the image, together
+# with a manifest.json listing them, so the memory use doesn't depend on the size of the image.
+# With a pool from render_pool the workers render the bands of the images instead of render.
+# projection is the (name, args) of the outputs in PROJECTIONS, used by the workers to build them.
+# Rendering and saving every image are stages named after the image (see instrumentation.py)
+def save_images(outputs, width, height, pool=None, projection=None):
+    def save(image, path):
+        with stage('save'):
+            image.save(path)
+            count_file(path)
+
+    if not SAVE_STRIPS:
+        if pool is None:
+            for path, render in outputs:
+                with stage(os.path.basename(path)):
+                    with stage('render'):
+                        image = render(0, height)
+                    save(image, path)
+            return
+        # the bands are pasted together here, in the order they were rendered
+        images = [Image.new('RGBA', (width, height)) for _ in outputs]
+        band_height = min(STRIP_PIXELS // width, ceil(height / (BANDS_PER_WORKER * WORKERS)))
+        bands = image_bands(height, max(1, band_height))
+        with stage('render_bands'):
+            for (top, bottom), band_images in zip(bands, pool.imap(partial(_render_band, projection), bands)):
+                for image, band in zip(images, band_images):
+                    image.paste(Image.frombytes('RGBA', (width, bottom - top), band), (0, top))
+        for (path, render), image in zip(outputs, images):
+            with stage(os.path.basename(path)):
+                save(image, path)
+        return
+
+    strips = [(index, top, bottom)
+              for index, (top, bottom) in enumerate(image_bands(height, max(1, STRIP_PIXELS // width)))]
+    for path, render in outputs:
+        os.makedirs(os.path.splitext(path)[0], exist_ok=True)
+    with stage('strips'):
+        if pool is None:
+            for strip in strips:
+                save_strip(outputs, strip)
         else:
-            all_coords = [coords]
-        
-        for c in all_coords:
-            draw_tile_with_spherical_coordinates(equirectangular, c, outline, fill, tpe)
-            draw_tile_with_spherical_coordinates(equirectangular_height, c, fill_height, fill_height)
+            # the workers save the strips themselves
+            for _ in pool.imap_unordered(partial(_save_strip, projection), strips):
+                pass
+
+    for path, render in outputs:
+        manifest = {'image': os.path.basename(path), 'width': width, 'height': height,
+                    'strips': [{'file': f'strip_{index:05d}.png', 'top': top, 'height': bottom - top}
+                               for index, top, bottom in strips]}
+        manifest_path = os.path.join(os.path.splitext(path)[0], 'manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        count_file(manifest_path)
+
+# Equirectangular map and height map projections. Returns the (path, render) pairs of the images
+# (see save_images) and their (width, height). codes are the tile types from type_of_hexes, only
+# needed for the map
+def equirectangular_outputs(planet, stamps, codes, save_terrain=True, save_height=True):
+    degree = EQUIRECTANGULAR_DEGREE
+    width, height = 360 * degree, 180 * degree
+    background = (0, 0, 0, 255)
+    # workers never rasterize the whole image: they use the labels in CACHE (see fill_equirectangular_labels)
+    # or rasterize their bands
+    labels_path = equirectangular_labels_path(planet, degree)
+    whole_labels = not SAVE_STRIPS and (_render_worker is None or (USE_CACHE and os.path.exists(labels_path)))
+    # the renders below are called once per band, strip or repainted rectangle, so everything that doesn't depend
+    # on the rows is only computed once
+    polygons, bounds = equirectangular_geometry(planet, degree)
+    palettes = {}
+    def palette(name):
+        if name not in palettes:
+            colors = terrain_colors(codes) if name == 'terrain' else height_colors(planet)
+            palettes[name] = label_palette(colors, background)
+        return palettes[name]
+
+    # labels of the rows [top, bottom] (one more row to find the boundaries of the last row);
+    # the whole labels or the last band are kept for the next renders
+    last_band = {}
+    def band_labels(top, bottom):
+        if whole_labels:
+            if 'whole' not in last_band:
+                last_band['whole'] = equirectangular_labels(planet, degree, polygons, bounds, labels_path)
+            return last_band['whole'][top:bottom + 1]
+        if (top, bottom) not in last_band:
+            last_band.clear()
+            last_band[(top, bottom)] = rasterize_labels(polygons, bounds, width, top, min(bottom + 1, height))
+        return last_band[(top, bottom)]
+
+    # the columns [left, right) of the rows [top, bottom) of the map
+    def render_terrain(top, bottom, left=0, right=width):
+        # one more column to find the boundaries of the last column
+        labels = band_labels(top, bottom)[:, left:right + 1]
+        terrain = paint_labels(labels[:bottom - top, :right - left], palette('terrain'))
+        if GRID_COLOR:
+            terrain[label_boundaries(labels)[:bottom - top, :right - left]] = GRID_COLOR
+        equirectangular = Image.fromarray(terrain, 'RGBA')
+        paste_equirectangular_icons(equirectangular, polygons, bounds, stamps, codes, top, left)
+        return equirectangular
 
-    equirectangular.save(OUTPUT + EQUIRECTANGULAR)
+    def render_height(top, bottom):
+        labels = band_labels(top, bottom)[:bottom - top]
+        return Image.fromarray(paint_labels(labels, palette('height')), 'RGBA')
+
+    outputs = []
+    if save_terrain:
+        outputs.append((OUTPUT + EQUIRECTANGULAR, render_terrain))
     if save_height:
-        equirectangular_height.save(OUTPUT + EQUIRECTANGULAR_HEIGHT)
+        outputs.append((OUTPUT + EQUIRECTANGULAR_HEIGHT, render_height))
+    return outputs, (width, height)
+
+# Rasterizes the labels of the whole equirectangular image into CACHE with the workers of the pool. The
+# .npy file is memory-mapped by every worker, which writes its bands straight into it
+def fill_equirectangular_labels(planet, pool):
+    degree = EQUIRECTANGULAR_DEGREE
+    width, height = 360 * degree, 180 * degree
+    path = equirectangular_labels_path(planet, degree)
+    if os.path.exists(path):
+        return
+    os.makedirs(CACHE, exist_ok=True)
+    band_height = min(STRIP_PIXELS // width, ceil(height / (BANDS_PER_WORKER * WORKERS)))
+
+    def fill(partial_path):
+        np.lib.format.open_memmap(partial_path, mode='w+', dtype=np.int32, shape=(height, width)).flush()
+        with stage('rasterize_labels'):
+            pool.map(partial(_fill_labels_band, partial_path, degree), image_bands(height, max(1, band_height)))
+
+    # other runs may read or write the file at the same time
+    atomic_write(path, fill, mode=None)
+    count_file(path)
+
+# Generates and saves Equirectangular map and height map projections. codes are the tile types from type_of_hexes.
+# With a pool from render_pool the images are rendered by its workers
+def save_equirectangular(planet, stamps, codes, save_terrain=True, save_height=True, pool=None):
+    if pool is not None and USE_CACHE:
+        # projected once here, the workers read the polygons from CACHE
+        equirectangular_geometry(planet, EQUIRECTANGULAR_DEGREE)
+        if not SAVE_STRIPS:
+            fill_equirectangular_labels(planet, pool)
+    outputs, (width, height) = equirectangular_outputs(planet, stamps, codes, save_terrain, save_height)
+    save_images(outputs, width, height, pool, ('equirectangular', (save_terrain, save_height)))
+
+# Seasonal animations. The tile of every pixel of the equirectangular projection (its labels, kept in CACHE) and
+# the grid are found once. Every frame is then a lookup of the palette index of every tile, without drawing the
+# polygons again, and the frames are palette images, which GIF and PNG encode as they are.
+
+# Number of colors of the gradients of the animations. The last two palette entries are the background and the grid
+SEASON_LEVELS = 254
+
+# (SEASON_LEVELS, 3) palette of evenly spaced colors
+def gradient_palette(colors, levels=SEASON_LEVELS):
+    colors = np.asarray(colors, dtype=np.float64)
+    positions = np.linspace(0, len(colors) - 1, levels)
+    below = np.minimum(positions.astype(int), len(colors) - 2)
+    weight = (positions - below)[:, None]
+    return np.round(colors[below] * (1 - weight) + colors[below + 1] * weight).astype(np.uint8)
+
+# Palette indices of the tiles in every season: (seasons, tiles) uint8 array, from 0 for the lowest value of the
+# field to SEASON_LEVELS - 1 for the highest
+def season_levels(planet, field):
+    values = np.asarray(planet.fields[field], dtype=np.float64)
+    low, high = values.min(), values.max()
+    scale = (SEASON_LEVELS - 1) / (high - low) if high > low else 0
+    return np.round((values - low) * scale).astype(np.uint8)
+
+# Frames of the animation of the field, one palette image per season. labels and boundaries are the labels of the
+# equirectangular projection and label_boundaries of them
+def season_frames(planet, field, labels, boundaries):
+    palette = np.vstack([gradient_palette(SEASON_COLORS[field]), [(0, 0, 0), (GRID_COLOR or (0, 0, 0, 255))[:3]]])
+    levels = season_levels(planet, field)
+    # -1 picks the background
+    lookup = np.full(len(planet) + 1, SEASON_LEVELS, dtype=np.uint8)
+    for season in range(planet.seasons):
+        with stage(f'season_{season}'):
+            lookup[:-1] = levels[season]
+            frame = lookup[labels]
+            if GRID_COLOR:
+                frame[boundaries] = SEASON_LEVELS + 1
+            # an 'L' image becomes a 'P' image with the palette
+            image = Image.fromarray(frame)
+            image.putpalette(palette.ravel().tolist())
+            count('frames')
+        yield image
+
+# Path of the animation of the field
+def season_animation_path(field):
+    name = SEASON_ANIMATION.format(field=field)
+    return OUTPUT + (name if SEASON_FORMAT == 'png' else f'{name}.{SEASON_FORMAT}')
+
+# Saves the animation of the fields over the seasons in the equirectangular projection (see SEASON_ANIMATIONS).
+# With a pool from render_pool the labels are rasterized by its workers. Returns the paths of the animations
+def save_season_animations(planet, fields, pool=None):
+    degree = EQUIRECTANGULAR_DEGREE
+    if pool is not None and USE_CACHE:
+        fill_equirectangular_labels(planet, pool)
+    polygons, bounds = equirectangular_geometry(planet, degree)
+    labels = np.asarray(equirectangular_labels(planet, degree, polygons, bounds))
+    boundaries = label_boundaries(labels) if GRID_COLOR else None
+    paths = []
+    for field in fields:
+        path = season_animation_path(field)
+        with stage(os.path.basename(path)):
+            frames = season_frames(planet, field, labels, boundaries)
+            if SEASON_FORMAT == 'png':
+                # one frame in memory at a time
+                os.makedirs(path, exist_ok=True)
+                for season, frame in enumerate(frames):
+                    frame_path = os.path.join(path, f'season_{season:02d}.png')
+                    frame.save(frame_path)
+                    count_file(frame_path)
+            else:
+                frames = list(frames)
+                with stage('save'):
+                    frames[0].save(path, save_all=True, append_images=frames[1:], duration=SEASON_FRAME_MS, loop=0)
+                    count_file(path)
+        paths.append(path)
+    return paths
+
+# Projections the workers can render: name -> function(planet, stamps, codes, *args) returning the
+# (path, render) pairs of the images and their (width, height)
+PROJECTIONS = {'dymaxion': dymaxion_outputs, 'equirectangular': equirectangular_outputs}
+
+# State of a render worker process: the planet, its icons and tile types, and the projections built so far.
+# None in the main process
+_render_worker = None
+
+def _init_render_worker(planet_path, codes, settings):
+    global _render_worker
+    # the settings of the main process, which may differ from the defaults of this file
+    globals().update(settings)
+    _render_worker = {'planet': load_planet(planet_path), 'stamps': StampCache(import_tile_icons()),
+                      'codes': codes, 'outputs': {}}
+
+def _worker_outputs(projection):
+    outputs = _render_worker['outputs']
+    if projection not in outputs:
+        name, args = projection
+        outputs[projection] = PROJECTIONS[name](_render_worker['planet'], _render_worker['stamps'],
+                                                _render_worker['codes'], *args)[0]
+    return outputs[projection]
+
+def _render_band(projection, band):
+    top, bottom = band
+    return [render(top, bottom).tobytes() for path, render in _worker_outputs(projection)]
+
+def _save_strip(projection, strip):
+    save_strip(_worker_outputs(projection), strip)
+
+def _fill_labels_band(path, degree, band):
+    top, bottom = band
+    polygons, bounds = equirectangular_geometry(_render_worker['planet'], degree)
+    labels = np.load(path, mmap_mode='r+')
+    labels[top:bottom] = rasterize_labels(polygons, bounds, labels.shape[1], top, bottom)
+    labels.flush()
+
+# Starts workers processes rendering the images. The planet is not sent to them: every worker
+# memory-maps the .planet file at planet_path, so the operating system shares its pages between them.
+# codes are the tile types from type_of_hexes (None if only the height map is rendered)
+def render_pool(workers, planet_path, codes=None):
+    settings = {name: value for name, value in globals().items() if name.isupper() and name != 'PROJECTIONS'}
+    return multiprocessing.Pool(workers, initializer=_init_render_worker, initargs=(planet_path, codes, settings))
+
+# Tune mode (TUNE, or --tune in the command line). The tile types are saved to TUNE_STATE together with
+# what the images depend on. When the same planet is rendered again in tune mode with the same image settings
+# (e.g. only the thresholds of the classification changed), the saved images are repainted where the type of a
+# tile changed instead of being rendered again. The modification time and size of every image are saved too, so
+# an image written since then (e.g. by a run without tune mode, which saves no state) is rendered again.
+
+# Settings the images depend on, apart from the tile types
+def tune_settings():
+    names = ['COLORS', 'GRID_COLOR', 'PICS', 'PIC_RATIO', 'ICON_SIZE_STEP', 'DYMAXION_HEX_R',
+             'EQUIRECTANGULAR_DEGREE', 'EQUIRECTANGULAR_SUBDIVISIONS', 'SAVE_STRIPS', 'STRIP_PIXELS']
+    return json.dumps({name: globals()[name] for name in names})
+
+# Identifies the planet (the grid and all the fields)
+def planet_fingerprint(planet):
+    sha = hashlib.sha1()
+    for array in [planet.ids, planet.corners] + [planet.fields[name] for name in sorted(planet.fields)]:
+        sha.update(np.ascontiguousarray(array).tobytes())
+    return sha.hexdigest()
+
+# Modification time and size of a saved image (of the manifest of its strips with SAVE_STRIPS), None if it
+# doesn't exist
+def image_stamp(image):
+    path = os.path.join(os.path.splitext(image)[0], 'manifest.json') if SAVE_STRIPS else image
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+# Reads the tune state. Returns the tile types of the last run and the paths of the images it saved that
+# haven't changed since, None if the state is for another planet or other settings
+def load_tune_state(path, fingerprint):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        codes = data['codes']
+        state = json.loads(str(data['state']))
+    if state['planet'] != fingerprint or state['settings'] != tune_settings():
+        return None
+    stamps = state.get('stamps', {})
+    return codes, [image for image in state['images'] if image in stamps and image_stamp(image) == stamps[image]]
+
+# Saves the tile types of the run and the paths of the images saved with them
+def save_tune_state(path, fingerprint, codes, images):
+    state = {'planet': fingerprint, 'settings': tune_settings(), 'images': images,
+             'stamps': {image: image_stamp(image) for image in images}}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        np.savez(f, codes=codes, state=np.array(json.dumps(state)))
+    count_file(path)
+
+# Rectangles (left, top, right, bottom) of an image of the given width and height, clipped to it
+def clip_rectangles(lefts, tops, rights, bottoms, width, height):
+    rectangles = np.stack([np.clip(lefts, 0, width), np.clip(tops, 0, height),
+                           np.clip(rights, 0, width), np.clip(bottoms, 0, height)], axis=1).astype(int)
+    return [tuple(r) for r in rectangles.tolist() if r[0] < r[2] and r[1] < r[3]]
+
+# Rectangles of the Dymaxion image that change when the tiles at rows change type: their stamps
+def dymaxion_footprints(planet, planet_size, rows):
+    stamp_r = dymaxion_sizes()[3]
+    xs, ys, (width, height) = dymaxion_geometry(planet, planet_size)
+    hexes = np.isin(planet.hex_rows, rows)
+    lefts, tops = np.floor(xs[hexes]) - stamp_r, np.floor(ys[hexes]) - stamp_r
+    return clip_rectangles(lefts, tops, lefts + 2 * stamp_r + 1, tops + 2 * stamp_r + 1, width, height)
+
+# Rectangles of the equirectangular map that change when the tiles at rows change type: their polygons,
+# with a margin for the outline and the icons, which can stick out of the polygons by a pixel
+def equirectangular_footprints(planet, rows):
+    degree = EQUIRECTANGULAR_DEGREE
+    polygons, bounds = equirectangular_geometry(planet, degree)
+    left, top, right, bottom = bounds[np.isin(polygons[0], rows)].T
+    return clip_rectangles(np.floor(left) - 2, np.floor(top) - 2, np.ceil(right) + 3, np.ceil(bottom) + 3,
+                           360 * degree, 180 * degree)
+
+# Renders the rectangles (left, top, right, bottom) of saved images again. outputs are (path, render)
+# pairs (see save_images) whose render also takes the columns: render(top, bottom, left, right).
+# With SAVE_STRIPS only the strips the rectangles intersect are rewritten
+def repaint_images(outputs, rectangles):
+    for path, render in outputs:
+        with stage(os.path.basename(path)):
+            repaint_image(path, render, rectangles)
+
+# Renders the rectangles of the saved image at path again (see repaint_images)
+def repaint_image(path, render, rectangles):
+    if SAVE_STRIPS:
+        directory = os.path.splitext(path)[0]
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            strips = [(os.path.join(directory, strip['file']), strip['top'], strip['top'] + strip['height'])
+                      for strip in json.load(f)['strips']]
+    else:
+        with Image.open(path) as image:
+            strips = [(path, 0, image.height)]
+
+    pixels = {}
+    for strip_path, top, bottom in strips:
+        inside = [rectangle for rectangle in rectangles if rectangle[1] < bottom and rectangle[3] > top]
+        if not inside:
+            continue
+        with Image.open(strip_path) as image:
+            strip = image.copy()
+        for left, rectangle_top, right, rectangle_bottom in inside:
+            key = left, rectangle_top, right, rectangle_bottom
+            if key not in pixels:
+                pixels[key] = render(rectangle_top, rectangle_bottom, left, right)
+            strip.paste(pixels[key], (left, rectangle_top - top))
+        strip.save(strip_path)
+        count_file(strip_path)
+
+# Generates the planet with export.rkt and saves it to planet_path. climate maps the names of the climate
+# parameters in export.rkt (e.g. 'axial-tilt') to the values replacing them
+def export_planet(planet_path, size=None, terrain=None, climate=None):
+    print('Generating planet based on parameters from extract.rkt')
+    size = PLANET_CHARACTERISTIC_SIZE if size is None else size
+    climate_arguments = [f'{name}={value}' for name, value in sorted((climate or {}).items())]
+    with stage('racket'):
+        subprocess.check_call([RACKET_PATH, "export.rkt", str(2 * size), planet_path, terrain or TERRAIN] +
+                              climate_arguments)
+        count_file(planet_path)
+    print('Done')
+
+# Key of the planet generated by export_planet from the current GENERATOR_INPUTS
+def generator_key(size=None, terrain=None, climate=None):
+    values = [PLANET_CHARACTERISTIC_SIZE if size is None else size]
+    if climate:
+        values.append(sorted(climate.items()))
+    return input_key(values, GENERATOR_INPUTS + [terrain or TERRAIN])
+
+# Path of the planet generated by export_planet. export.rkt is only run if there's no planet generated from
+# the same inputs in the cache
+def generated_planet(cache, size=None, terrain=None, climate=None):
+    key = generator_key(size, terrain, climate)
+    path = cache.get(key) if REUSE_GENERATED_PLANETS else None
+    if path is not None:
+        print(f'Reusing {path} generated from the same parameters')
+        return path
+    name = PLANET if size is None else f'earthgen_export_{size}.planet'
+    path = cache.path(key, name)
+    # export.rkt writes to a temporary file, so an interrupted export isn't taken for a generated planet
+    atomic_write(path, lambda partial_path: export_planet(partial_path, size, terrain, climate), mode=None)
+    cache.add(key, path, name)
+    return path
+
+# Reads the planet from the newest of the .planet file and the legacy .pickle and .py files, so that e.g. a .py
+# file exported again isn't shadowed by the .planet or .pickle files made from the old one
+def read_planet(planet_path, pickle_path, py_path):
+    print('Reading the map')
+    existing = [path for path in [planet_path, pickle_path, py_path] if os.path.exists(path)]
+    newest = max(existing, key=os.path.getmtime, default=py_path)
+    if newest == planet_path:
+        with stage('load_planet'):
+            planet = load_planet(planet_path)
+    elif newest == pickle_path:
+        print('    no up to date .planet file. Loading from .pickle file')
+        with stage('pickle_load'):
+            with open(pickle_path, 'rb') as f:
+                slices = pickle.load(f)
+        with stage('merge_slices'):
+            planet, _ = merge_slices(slices)
+        del slices
+        if SAVE_PLANET:
+            print('    saving map to .planet file')
+            with stage('save_planet'):
+                save_planet(planet, planet_path)
+                count_file(planet_path)
+            planet.path = planet_path
+    elif SAVE_PLANET:
+        print('    no up to date .planet file. Converting .py file to .planet file')
+        with stage('convert_legacy_planet'):
+            convert_legacy_planet(py_path, planet_path, PLANET_DTYPE, progress=print_progress)
+            count_file(planet_path)
+        with stage('load_planet'):
+            planet = load_planet(planet_path)
+    else:
+        print('    no up to date .planet file. Reading .py file')
+        with stage('read_legacy_planet'):
+            planet = read_legacy_planet(py_path, PLANET_DTYPE, progress=print_progress)
+    count('tiles', len(planet))
+    print('Done')
+    return planet
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Renders the maps of an earthgen planet')
+    parser.add_argument('--workers', type=int, default=WORKERS, metavar='N',
+                        help=f'number of processes rendering the images (default {WORKERS})')
+    parser.add_argument('--tune', action='store_true', default=TUNE,
+                        help='only repaint the tiles whose type changed since the last run with --tune')
+    parser.add_argument('--animate', action='append', default=list(SEASON_ANIMATIONS), metavar='FIELD',
+                        choices=sorted(SEASON_COLORS),
+                        help='save an animation of the field over the seasons (can be repeated)')
+    parser.add_argument('--trace-memory', action='store_true', default=TRACE_MEMORY,
+                        help='trace the peak memory of every stage with tracemalloc (slower)')
+    parser.add_argument('--profile', action='append', default=list(PROFILE_STAGES), metavar='STAGE',
+                        help='profile the stage with cProfile (can be repeated)')
+    arguments = parser.parse_args()
+    WORKERS = max(1, arguments.workers)
+    TUNE = arguments.tune
+    SEASON_ANIMATIONS = arguments.animate
+    TRACE_MEMORY = arguments.trace_memory
+    PROFILE_STAGES = arguments.profile
+    start(trace_memory=TRACE_MEMORY, profile=PROFILE_STAGES, profile_directory=OUTPUT)
+
+    PLANET_FILE_PATH = os.path.join(INPUT, PLANET)
     PICKLE_FILE_PATH = os.path.join(INPUT, PICKLE)
     PY_FILE_PATH = os.path.join(INPUT, PY)
+    GENERATED_PLANETS = ArtifactCache(INPUT, GENERATED_PLANETS_BYTES)
+    # without the files above, the planet generated last is used
+    if not any(os.path.exists(path) for path in [PLANET_FILE_PATH, PICKLE_FILE_PATH, PY_FILE_PATH]):
+        PLANET_FILE_PATH = GENERATED_PLANETS.latest(PLANET) or PLANET_FILE_PATH
+    # the render workers memory-map the planet, so a planet that isn't in a .planet file is saved here
+    TEMPORARY_PLANET_PATH = os.path.join(CACHE, f'render_{os.getpid()}.planet')
+    TUNE_STATE_PATH = os.path.join(OUTPUT, TUNE_STATE)
+    # images saved or repainted by this run
+    saved_images = []
 
-    if GENERATE_FROM_SCRATCH:
-        print('Generating planet based on parameters from extract.rkt')
-        subprocess.check_call([RACKET_PATH, "export.rkt",
-                            str(2 * PLANET_CHARACTERISTIC_SIZE), PY_FILE_PATH])
+    # the generated planet is read even if there are newer legacy files
+    def read(export=None):
+        if export is None:
+            return read_planet(PLANET_FILE_PATH, PICKLE_FILE_PATH, PY_FILE_PATH)
+        print('Reading the map')
+        with stage('load_planet'):
+            planet = load_planet(export)
+        count('tiles', len(planet))
         print('Done')
+        return planet
 
-    print('Reading the map')
-    try:
-        # try to load pickle first
-        planet = pickle.load(open(PICKLE_FILE_PATH, 'rb'))
-    except:
-        print('    failed to load from .pickle file. Trying to load from .py file')
-        spec = importlib.util.spec_from_file_location(PY, PY_FILE_PATH)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        planet = module.planet
-    print('Done')
-
-    if SAVE_PICKLE:
-        print('Saving map to .pickle file')
-        pickle.dump(planet, open(PICKLE_FILE_PATH, "wb"))
+    def classify(planet, seasons):
+        print('Classifying tiles')
+        classification = type_of_hexes(planet, seasons)
+        count('tiles', len(planet))
         print('Done')
+        return classification
 
-    print('Classifying tiles')
-    planet, planet_size = merge_slices(planet)
-    converted_tiles = type_of_hexes(planet)
-    print('Done')
+    def start_workers(planet, classification=(None, None)):
+        if planet.path is None:
+            os.makedirs(CACHE, exist_ok=True)
+            save_planet(planet, TEMPORARY_PLANET_PATH)
+        print(f'Starting {WORKERS} render workers')
+        return render_pool(WORKERS, planet.path or TEMPORARY_PLANET_PATH, classification[0])
 
-    print('\n' + '=' * 25 + '\nYou planet statistics:\n')
-    print(gather_statistics(converted_tiles))
-    print('=' * 25)
+    # the workers are only started when an image has to be rendered from scratch
+    def render_workers():
+        return pipeline['workers'] if WORKERS > 1 else None
 
-    icons = import_tile_icons()
+    # rows of the tiles whose type changed since the previous run in tune mode
+    def changed_rows(previous, codes):
+        changed = np.nonzero(previous[0] != codes)[0]
+        print(f'    {len(changed)} tiles changed type')
+        return changed
 
-    if SAVE_DYMAXION:
-        print(f'Saving Dymaxion projection to {OUTPUT}{DYMAXION}')
-        save_dymaxion(planet, planet_size, icons)
+    def dymaxion(planet, classification, icons, previous=None):
+        path = OUTPUT + DYMAXION
+        codes = classification[0]
+        if previous is not None and path in previous[1]:
+            print(f'Repainting Dymaxion projection {path}')
+            outputs, size = dymaxion_outputs(planet, icons, codes, planet.size)
+            repaint_images(outputs, dymaxion_footprints(planet, planet.size, changed_rows(previous, codes)))
+        else:
+            print(f'Saving Dymaxion projection to {path}')
+            save_dymaxion(planet, planet.size, icons, codes, render_workers())
+        saved_images.append(path)
+        print('Done')
+
+    def equirectangular(planet, classification=(None, None), icons=None, previous=None):
+        terrain_path, height_path = OUTPUT + EQUIRECTANGULAR, OUTPUT + EQUIRECTANGULAR_HEIGHT
+        codes = classification[0]
+        kept = previous[1] if previous is not None else []
+        # the height map doesn't depend on the tile types
+        save_terrain = SAVE_EQUIRECTANGULAR and terrain_path not in kept
+        save_height = SAVE_EQUIRECTANGULAR_HEIGHT and height_path not in kept
+        if SAVE_EQUIRECTANGULAR and not save_terrain:
+            print(f'Repainting Equirectangular projection {terrain_path}')
+            outputs, size = equirectangular_outputs(planet, icons, codes, save_terrain=True, save_height=False)
+            repaint_images(outputs, equirectangular_footprints(planet, changed_rows(previous, codes)))
+        if save_terrain or save_height:
+            paths = [path for path, save in [(terrain_path, save_terrain), (height_path, save_height)] if save]
+            print('Saving Equirectangular projection to ' + ' and '.join(paths))
+            save_equirectangular(planet, icons, codes, save_terrain, save_height, render_workers())
+        saved_images.extend(path for path, save in [(terrain_path, SAVE_EQUIRECTANGULAR),
+                                                    (height_path, SAVE_EQUIRECTANGULAR_HEIGHT)] if save)
         print('Done')
 
-    if SAVE_EQUIRECTANGULAR:
-        message = ('Saving Equirectangular projection ' + ('and Heigtmap ' if SAVE_EQUIRECTANGULAR_HEIGHT else '') +
-                   f'to {OUTPUT}{EQUIRECTANGULAR}' +
-                   (f'and {OUTPUT}{EQUIRECTANGULAR_HEIGHT}' if SAVE_EQUIRECTANGULAR_HEIGHT else '')) 
-        print(message)
-        save_equirectangular(planet, icons, save_height=SAVE_EQUIRECTANGULAR_HEIGHT)
+    def season_animations(planet):
+        print('Saving the animations of ' + ', '.join(SEASON_ANIMATIONS) + ' over the seasons')
+        os.makedirs(OUTPUT, exist_ok=True)
+        for path in save_season_animations(planet, SEASON_ANIMATIONS, render_workers()):
+            saved_images.append(path)
+            print(f'    {path}')
         print('Done')
 
+    # Layers of the run (see pipeline.py). Only the ones the requested outputs depend on are computed
+    classified_outputs = SAVE_DYMAXION or SAVE_EQUIRECTANGULAR
+    previous = ['previous'] if TUNE else []
+    pipeline = Pipeline()
+    pipeline.add('export', lambda: generated_planet(GENERATED_PLANETS))
+    pipeline.add('planet', read, ['export'] if GENERATE_FROM_SCRATCH else [])
+    pipeline.add('seasons', season_summary, ['planet'])
+    pipeline.add('classification', classify, ['planet', 'seasons'])
+    pipeline.add('statistics', lambda planet, classification: gather_statistics(planet, *classification),
+                 ['planet', 'classification'])
+    pipeline.add('icons', lambda: StampCache(import_tile_icons()))
+    pipeline.add('workers', start_workers, ['planet'] + (['classification'] if classified_outputs else []))
+    pipeline.add('fingerprint', planet_fingerprint, ['planet'])
+    pipeline.add('previous', lambda fingerprint: load_tune_state(TUNE_STATE_PATH, fingerprint), ['fingerprint'])
+    pipeline.add('dymaxion', dymaxion, ['planet', 'classification', 'icons'] + previous)
+    pipeline.add('equirectangular', equirectangular,
+                 ['planet'] + (['classification', 'icons'] if SAVE_EQUIRECTANGULAR else []) + previous)
+    pipeline.add('animations', season_animations, ['planet'])
+
+    if PRINT_STATISTICS:
+        print('\n' + '=' * 25 + '\nYou planet statistics:\n')
+        print(format_statistics(pipeline['statistics']))
+        print('=' * 25)
+    if SAVE_STATISTICS:
+        os.makedirs(OUTPUT, exist_ok=True)
+        with stage('save_statistics'):
+            for path in save_statistics(pipeline['statistics'], os.path.join(OUTPUT, STATISTICS)):
+                count_file(path)
+        print(f'Statistics saved to {os.path.join(OUTPUT, STATISTICS)}.json')
+    if SAVE_DYMAXION:
+        pipeline['dymaxion']
+    if SAVE_EQUIRECTANGULAR or SAVE_EQUIRECTANGULAR_HEIGHT:
+        pipeline['equirectangular']
+    if SEASON_ANIMATIONS:
+        pipeline['animations']
+    # images saved since by runs without TUNE don't match their stamps in the state, so they're rendered again
+    if TUNE and pipeline.computed('classification'):
+        save_tune_state(TUNE_STATE_PATH, pipeline['fingerprint'], pipeline['classification'][0], saved_images)
+
+    if pipeline.computed('workers'):
+        pipeline['workers'].close()
+        pipeline['workers'].join()
+        if os.path.exists(TEMPORARY_PLANET_PATH):
+            os.remove(TEMPORARY_PLANET_PATH)
+    elif pipeline.computed('icons'):
+        print(f'Icon cache: {pipeline["icons"].hits} hits, {pipeline["icons"].misses} misses')
+    print('Stages:')
+    print(pipeline.format_report())
+    if REPORT:
+        # the icons of the workers aren't counted
+        icons = pipeline['icons'] if pipeline.computed('icons') and not pipeline.computed('workers') else None
+        save_report(os.path.join(OUTPUT, REPORT), planet_size=PLANET_CHARACTERISTIC_SIZE, workers=WORKERS,
+                    tune=TUNE, images=saved_images, skipped=pipeline.skipped(),
+                    icon_cache=None if icons is None else {'hits': icons.hits, 'misses': icons.misses})
+        print(f'Report saved to {os.path.join(OUTPUT, REPORT)}')
     print('Finished')
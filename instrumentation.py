@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import contextlib
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# Measures the stages of a run. Every stage records its wall and CPU seconds, the CPU seconds of the child
+# processes that finished while it ran (e.g. racket), the peak of the memory traced by tracemalloc while it ran
+# (if tracing), the maximum resident memory of the process so far (where the resource module exists) and the
+# counters added with count() while it ran. Stages can be nested: a nested stage is
+# reported with the names of the stages containing it (e.g. 'planet/merge_slices') and its time and counters
+# are also part of the stages containing it. Nothing is measured until start() is called.
+#   start(trace_memory=True)
+#   with stage('classification'):
+#       ...
+#       count('tiles', len(planet))
+#   save_report('report.json')
+# CPU seconds and counters only cover the current process, not the render workers.
+
+_enabled = False
+_trace_memory = False
+_profile = set()
+_profile_directory = '.'
+_profiling = False
+_running = []
+_finished = []
+# Memory traced before tracemalloc was restarted, where tracemalloc.reset_peak doesn't exist (Python < 3.9)
+_forgotten_bytes = 0
+
+
+# Starts measuring. The stages named in profile (by name or by full name) are also profiled with cProfile, their
+# statistics are saved to profile_<stage>.prof in profile_directory (see the pstats module)
+def start(trace_memory=False, profile=(), profile_directory='.'):
+    global _enabled, _trace_memory, _profile, _profile_directory
+    _enabled = True
+    _trace_memory = trace_memory
+    _profile = set(profile)
+    _profile_directory = profile_directory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# Adds amount to the counter in all the running stages
+def count(name, amount=1):
+    for record in _running:
+        record['counters'][name] = record['counters'].get(name, 0) + amount
+
+# Adds the size of the file at path to the 'bytes_written' counter
+def count_file(path):
+    if _running:
+        count('bytes_written', os.path.getsize(path))
+
+# Current and peak traced memory
+def _traced_memory():
+    current, peak = tracemalloc.get_traced_memory()
+    return current + _forgotten_bytes, peak + _forgotten_bytes
+
+# Sets the peak of the traced memory to the current memory. Before Python 3.9 tracemalloc is restarted instead,
+# which forgets the blocks traced so far: they're counted as still allocated
+def _reset_peak():
+    global _forgotten_bytes
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        _forgotten_bytes += tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+
+# CPU seconds of the finished child processes (always 0 on Windows)
+def _child_cpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+def _max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+@contextlib.contextmanager
+def stage(name):
+    global _profiling
+    if not _enabled:
+        yield
+        return
+    record = {'stage': '/'.join([parent['stage'] for parent in _running[-1:]] + [name]), 'counters': {}}
+    if _trace_memory:
+        current, peak = _traced_memory()
+        if _running:
+            _running[-1]['peak_traced_bytes'] = max(_running[-1]['peak_traced_bytes'], peak)
+        _reset_peak()
+        record['peak_traced_bytes'] = current
+    profiler = None
+    # only one profiler can run at a time
+    if (name in _profile or record['stage'] in _profile) and not _profiling:
+        profiler = cProfile.Profile()
+        _profiling = True
+        profiler.enable()
+    _running.append(record)
+    wall, cpu, child_cpu = time.perf_counter(), time.process_time(), _child_cpu()
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - wall
+        record['cpu_seconds'] = time.process_time() - cpu
+        record['child_cpu_seconds'] = _child_cpu() - child_cpu
+        _running.pop()
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+            os.makedirs(_profile_directory, exist_ok=True)
+            path = os.path.join(_profile_directory, f'profile_{record["stage"].replace("/", "_")}.prof')
+            profiler.dump_stats(path)
+            record['profile'] = path
+        if _trace_memory:
+            record['peak_traced_bytes'] = max(record['peak_traced_bytes'], _traced_memory()[1])
+            if _running:
+                _running[-1]['peak_traced_bytes'] = max(_running[-1]['peak_traced_bytes'],
+                                                        record['peak_traced_bytes'])
+            _reset_peak()
+        record['max_rss_bytes'] = _max_rss()
+        _finished.append(record)
+
+# The finished stages in the order they finished, so nested stages come before the stages containing them
+def stages():
+    return list(_finished)
+
+# Saves the stages to a JSON file, together with the other values given
+def save_report(path, **values):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({**values, 'stages': stages()}, f, indent=1)
@@ -0,0 +1,45 @@
+import time
+from instrumentation import stage
+
+
+# Named layers evaluated lazily. A layer is a function of the layers it depends on, which are passed to it
+# as keyword arguments named after them. A layer is computed the first time it's needed and kept for the
+# rest of the run, so asking for the outputs only computes the layers they depend on.
+#   pipeline = Pipeline()
+#   pipeline.add('planet', read_planet)
+#   pipeline.add('classification', lambda planet: type_of_hexes(planet), ['planet'])
+#   pipeline['classification']      <- reads the planet, then classifies it
+# report holds the (name, seconds) of the computed layers in the order they finished, not counting the
+# time spent on their dependencies. Every layer is computed in a stage of the same name (see instrumentation.py).
+class Pipeline:
+    def __init__(self):
+        self._layers = {}
+        self._values = {}
+        self.report = []
+
+    def add(self, name, function, dependencies=()):
+        self._layers[name] = function, tuple(dependencies)
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            function, dependencies = self._layers[name]
+            values = {dependency: self[dependency] for dependency in dependencies}
+            start = time.perf_counter()
+            with stage(name):
+                self._values[name] = function(**values)
+            self.report.append((name, time.perf_counter() - start))
+        return self._values[name]
+
+    def computed(self, name):
+        return name in self._values
+
+    # Names of the layers that were never needed
+    def skipped(self):
+        return [name for name in self._layers if name not in self._values]
+
+    # The report as text, one layer per line
+    def format_report(self):
+        lines = [f'    {name:<16}{seconds:8.2f} s' for name, seconds in self.report]
+        if self.skipped():
+            lines.append('    skipped: ' + ', '.join(self.skipped()))
+        return '\n'.join(lines)
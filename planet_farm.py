@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import argparse
+import traceback
+import contextlib
+import multiprocessing
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from artifact_cache import ArtifactCache
+from planet_store import load_planet
+from planet_statistics import format_statistics, save_statistics
+import generate_images as images
+
+# Generates and renders many planets in one run. The jobs are read from a JSON file with a list of jobs, e.g.
+#   [{"name": "tilted", "size": 3, "terrain": "./terrain-generation/seed75.txt",
+#     "climate": {"axial-tilt": 0.6, "seasons-per-cycle": 2},
+#     "outputs": ["statistics", "dymaxion", "equirectangular", "height"],
+#     "settings": {"EQUIRECTANGULAR_DEGREE": 10, "MOUNTAIN_ELEVATION": 1200}}]
+# Only size is required. name defaults to the position of the job in the list, terrain to TERRAIN of
+# generate_images.py, climate to the climate parameters in export.rkt (only the ones given are replaced), and
+# outputs to the ones turned on in generate_images.py. settings replace the settings of generate_images.py for
+# the images of the job (except FIXED_SETTINGS). Planets are generated with racket in EXPORTS processes, and
+# every planet is rendered as soon as it's generated in one of RENDERS other processes, so generation and
+# rendering overlap. Jobs with the same size, terrain and climate share one planet, and planets generated before
+# are reused (see REUSE_GENERATED_PLANETS in generate_images.py).
+#   python planet_farm.py jobs.json --exports 2 --renders 4
+
+# Directory with a subdirectory for every job (its images, statistics.txt, statistics.json and .csv files and
+# log.txt) and summary.json
+FARM_OUTPUT = r'./farm/'
+# Number of racket processes generating planets at the same time
+EXPORTS = 2
+# Number of processes rendering the images of the jobs
+RENDERS = 2
+# Outputs a job can list
+OUTPUTS = ['statistics', 'dymaxion', 'equirectangular', 'height']
+# Settings of generate_images.py jobs can't replace: the tile types and their codes are derived from COLORS when
+# generate_images.py is imported, so other COLORS would not match them
+FIXED_SETTINGS = ('COLORS', 'TILE_TYPES', 'TILE_CODES')
+
+
+# Outputs turned on in generate_images.py
+def default_outputs():
+    return [output for output, save in zip(OUTPUTS, [images.PRINT_STATISTICS, images.SAVE_DYMAXION,
+                                                     images.SAVE_EQUIRECTANGULAR,
+                                                     images.SAVE_EQUIRECTANGULAR_HEIGHT]) if save]
+
+# Reads the jobs and fills in the defaults. Raises ValueError for jobs that can't be run
+def load_jobs(path):
+    with open(path) as f:
+        jobs = json.load(f)
+    settings = {name for name in vars(images) if name.isupper()}
+    loaded = []
+    for i, job in enumerate(jobs):
+        if 'size' not in job:
+            raise ValueError(f'job {i} has no size')
+        job = {'name': str(i), 'terrain': images.TERRAIN, 'climate': {}, 'outputs': default_outputs(),
+               'settings': {}, **job}
+        unknown = [output for output in job['outputs'] if output not in OUTPUTS] + \
+                  [name for name in job['settings'] if name not in settings]
+        fixed = [name for name in job['settings'] if name in FIXED_SETTINGS]
+        if fixed:
+            raise ValueError(f'job {job["name"]}: the settings {", ".join(fixed)} can\'t be changed by a job')
+        if unknown:
+            raise ValueError(f'job {job["name"]}: unknown outputs or settings {", ".join(unknown)}')
+        loaded.append(job)
+    names = [job['name'] for job in loaded]
+    if len(set(names)) < len(names):
+        raise ValueError('the names of the jobs must be different')
+    return loaded
+
+# Runs in a thread of the main process. Returns the path of the planet of the job, whether it was generated
+# before, the seconds spent and the error (None if there was none)
+def _export(cache, job):
+    start = time.perf_counter()
+    try:
+        key = images.generator_key(job['size'], job['terrain'], job['climate'])
+        reused = images.REUSE_GENERATED_PLANETS and cache.get(key) is not None
+        path = images.generated_planet(cache, job['size'], job['terrain'], job['climate'])
+        return path, reused, time.perf_counter() - start, None
+    except Exception:
+        return None, False, time.perf_counter() - start, traceback.format_exc()
+
+# Settings of generate_images.py when the render process started
+_defaults = {}
+
+def _init_render_job():
+    _defaults.update((name, value) for name, value in vars(images).items() if name.isupper())
+
+# Renders the outputs of the job in a render process. The settings of the previous job are replaced by the ones
+# of this job, and everything generate_images.py prints goes to the log of the job
+def _render_job(job, planet_path):
+    start = time.perf_counter()
+    directory = os.path.join(FARM_OUTPUT, job['name'])
+    os.makedirs(directory, exist_ok=True)
+    size = job['size']
+    vars(images).update(_defaults)
+    vars(images).update(job['settings'])
+    vars(images).update(OUTPUT=os.path.join(directory, ''), PLANET_CHARACTERISTIC_SIZE=size,
+                        DYMAXION=f'dymaxion_{size}.png', EQUIRECTANGULAR=f'equirectangular_{size}.png',
+                        EQUIRECTANGULAR_HEIGHT=f'equirectangular_height_{size}.png')
+    outputs = job['outputs']
+    saved = []
+    error = None
+    with open(os.path.join(directory, 'log.txt'), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            planet = load_planet(planet_path)
+            codes, icons = None, None
+            if {'statistics', 'dymaxion', 'equirectangular'} & set(outputs):
+                codes, names = images.type_of_hexes(planet)
+            if {'dymaxion', 'equirectangular'} & set(outputs):
+                icons = images.StampCache(images.import_tile_icons())
+            if 'statistics' in outputs:
+                statistics = images.gather_statistics(planet, codes, names)
+                saved.append(os.path.join(directory, 'statistics.txt'))
+                with open(saved[-1], 'w') as f:
+                    f.write(format_statistics(statistics) + '\n')
+                saved += save_statistics(statistics, os.path.join(directory, 'statistics'))
+            if 'dymaxion' in outputs:
+                images.save_dymaxion(planet, planet.size, icons, codes)
+                saved.append(images.OUTPUT + images.DYMAXION)
+            if 'equirectangular' in outputs or 'height' in outputs:
+                images.save_equirectangular(planet, icons, codes, 'equirectangular' in outputs, 'height' in outputs)
+                saved += [images.OUTPUT + name for output, name in [('equirectangular', images.EQUIRECTANGULAR),
+                                                                    ('height', images.EQUIRECTANGULAR_HEIGHT)]
+                          if output in outputs]
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+    return saved, time.perf_counter() - start, error
+
+# Runs the jobs and returns their summary
+def run_farm(jobs, exports=EXPORTS, renders=RENDERS):
+    start = time.perf_counter()
+    # planets are only evicted once all the images are rendered
+    cache = ArtifactCache(images.INPUT)
+    planets = {}
+    for job in jobs:
+        planets.setdefault(images.generator_key(job['size'], job['terrain'], job['climate']), []).append(job)
+    summary = {job['name']: {'job': job} for job in jobs}
+
+    def rendered(name, result):
+        saved, seconds, error = result
+        summary[name].update(images=saved, render_seconds=seconds, error=error)
+        print(f'{"Failed to render" if error else "Rendered"} {name} in {seconds:.1f} s')
+
+    with multiprocessing.Pool(renders, initializer=_init_render_job) as render_pool, \
+            ThreadPool(exports) as export_pool:
+        results = []
+        # the planets are rendered in the order they're generated
+        exported = export_pool.imap_unordered(lambda shared: (shared, _export(cache, shared[0])), planets.values())
+        for shared, (path, reused, seconds, error) in exported:
+            for job in shared:
+                summary[job['name']].update(planet=path, reused=reused, export_seconds=seconds, error=error)
+                if error is None:
+                    results.append(render_pool.apply_async(_render_job, (job, path),
+                                                           callback=partial(rendered, job['name'])))
+                else:
+                    print(f'Failed to generate the planet of {job["name"]}')
+        for result in results:
+            result.wait()
+
+    cache.max_bytes = images.GENERATED_PLANETS_BYTES
+    cache.evict()
+    return {'seconds': time.perf_counter() - start, 'jobs': list(summary.values())}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates and renders the planets of a list of jobs')
+    parser.add_argument('jobs', help='JSON file with the list of jobs')
+    parser.add_argument('--exports', type=int, default=EXPORTS, metavar='N',
+                        help=f'number of racket processes generating planets (default {EXPORTS})')
+    parser.add_argument('--renders', type=int, default=RENDERS, metavar='N',
+                        help=f'number of processes rendering the images (default {RENDERS})')
+    arguments = parser.parse_args()
+
+    summary = run_farm(load_jobs(arguments.jobs), max(1, arguments.exports), max(1, arguments.renders))
+    os.makedirs(FARM_OUTPUT, exist_ok=True)
+    with open(os.path.join(FARM_OUTPUT, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+    failed = [job['job']['name'] for job in summary['jobs'] if job.get('error')]
+    print(f'{len(summary["jobs"]) - len(failed)} of {len(summary["jobs"])} jobs done in {summary["seconds"]:.1f} s')
+    if failed:
+        print('Failed: ' + ', '.join(failed))
+    print(f'Summary saved to {os.path.join(FARM_OUTPUT, "summary.json")}')
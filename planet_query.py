@@ -0,0 +1,169 @@
+import os
+import csv
+import argparse
+import numpy as np
+from planet_store import SEASONAL_FIELDS, STATIC_FIELDS, load_planet, grid_fingerprint, atomic_write
+
+# Finds the tiles at points of the planet given by their latitudes and longitudes in degrees (longitude = atan2(y, x)
+# and latitude = asin(z), as in the equirectangular projection).
+#   index = tile_index(planet)
+#   rows = index.query(lats, lons)              <- rows of the planet arrays, any shape of lats and lons
+#   values = tile_values(planet, rows, codes, names)
+#   values['type'], values['elevation'], values['lai'][season]
+# The centers of the tiles are put in a grid of cubes covering the unit sphere. The cubes are as large as the
+# largest distance from the center of a tile to its corners, so the tile containing a point has its center in
+# one of the 27 cubes around the point. A point is given to the nearest of those centers if it's inside the
+# polygon of that tile, otherwise to the nearest tile among them whose polygon contains it. The points are
+# queried in chunks of QUERY_CHUNK points, each with a few array operations.
+#   python planet_query.py input/earthgen_export_4.planet points.csv tiles.csv
+# looks up the points of a CSV file with lat and lon columns (see the end of the file).
+
+# Number of points queried at once. The memory used is about 4 KB per point
+QUERY_CHUNK = 4096
+# Directory where the indexes are kept by planet size and grid (None keeps them in memory only)
+INDEX_CACHE = r'./cache/'
+
+# Offsets of the 27 cubes around a cube
+_NEIGHBOURS = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+# Points on the unit sphere at the latitudes and longitudes (in degrees): (points, 3) array
+def sphere_points(lats, lons):
+    lats, lons = np.radians(lats).ravel(), np.radians(lons).ravel()
+    return np.stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)], axis=1)
+
+
+class TileIndex:
+    # centers are the (tiles, 3) centers of the tiles and corners their (tiles, 6, 3) corners. The tiles are
+    # sorted by cube: the tiles of the cube keys[i] are order[starts[i]:starts[i] + counts[i]]
+    def __init__(self, centers, corners, cube, cubes, keys, starts, counts, order):
+        self.centers = centers
+        self.corners = corners
+        self.cube = cube
+        self.cubes = cubes
+        self.keys = keys
+        self.starts = starts
+        self.counts = counts
+        self.order = order
+        self.max_count = int(counts.max())
+
+    # Rows of the tiles at the latitudes and longitudes (in degrees), an int32 array of their broadcast shape
+    def query(self, lats, lons):
+        lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+        points = sphere_points(lats, lons)
+        rows = np.empty(len(points), dtype=np.int32)
+        for start in range(0, len(points), QUERY_CHUNK):
+            rows[start:start + QUERY_CHUNK] = self._query_points(points[start:start + QUERY_CHUNK])
+        return rows.reshape(lats.shape)
+
+    # (points, 27 * max_count) rows of the tiles in the cubes around the points, and where they're valid
+    def _candidates(self, points):
+        cubes = np.floor((points + 1) / self.cube).astype(np.int64)[:, None] + _NEIGHBOURS
+        inside = ((cubes >= 0) & (cubes < self.cubes)).all(axis=2)
+        keys = (cubes[..., 0] * self.cubes + cubes[..., 1]) * self.cubes + cubes[..., 2]
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = inside & (self.keys[positions] == keys)
+        counts = np.where(found, self.counts[positions], 0)
+        slots = np.arange(self.max_count)
+        valid = (slots < counts[..., None]).reshape(len(points), -1)
+        candidates = np.where(valid, (self.starts[positions][..., None] + slots).reshape(len(points), -1), 0)
+        return self.order[candidates], valid
+
+    # True where the points are inside the polygons of the tiles at rows: on the same side of every edge as the
+    # center of the tile (the repeated corner of the pentagons gives an empty edge, which is ignored)
+    def _contains(self, rows, points):
+        corners = self.corners[rows]
+        normals = np.cross(corners, np.roll(corners, -1, axis=-2))
+        sides = (np.einsum('...kd,...d->...k', normals, points) *
+                 np.einsum('...kd,...d->...k', normals, self.centers[rows]))
+        return (sides >= -1e-15).all(axis=-1)
+
+    def _query_points(self, points):
+        candidates, valid = self._candidates(points)
+        closeness = np.where(valid, np.einsum('pcd,pd->pc', self.centers[candidates], points), -np.inf)
+        nearest = np.take_along_axis(candidates, closeness.argmax(axis=1)[:, None], axis=1)[:, 0]
+        # points near the edges can be closer to the center of a neighbouring tile
+        outside = np.nonzero(~self._contains(nearest, points))[0]
+        if len(outside):
+            contains = valid[outside] & self._contains(candidates[outside], points[outside][:, None])
+            closeness = np.where(contains, closeness[outside], -np.inf)
+            best = closeness.argmax(axis=1)
+            found = contains.any(axis=1)
+            nearest[outside[found]] = candidates[outside[found], best[found]]
+        return nearest
+
+
+# Builds the index of the tiles of the planet
+def build_index(planet):
+    centers = planet.centers()
+    corners = np.asarray(planet.corners, dtype=np.float64)
+    # with a margin for the rounding of the cube of a point
+    cube = np.sqrt(((corners - centers[:, None]) ** 2).sum(axis=2)).max() * (1 + 1e-6)
+    cubes = int(np.ceil(2 / cube)) + 1
+    cells = np.floor((centers + 1) / cube).astype(np.int64)
+    tile_keys = (cells[:, 0] * cubes + cells[:, 1]) * cubes + cells[:, 2]
+    order = np.argsort(tile_keys, kind='stable').astype(np.int32)
+    keys, starts, counts = np.unique(tile_keys[order], return_index=True, return_counts=True)
+    return TileIndex(centers, corners, cube, cubes, keys, starts, counts, order)
+
+
+# Indexes built or loaded during this run, by planet size and grid
+_indexes = {}
+
+# Index of the tiles of the planet. Indexes only depend on the grid, so they're kept in memory and in cache (if
+# not None) for every planet size and grid
+def tile_index(planet, cache=INDEX_CACHE):
+    key = planet.size, grid_fingerprint(planet)
+    if key not in _indexes:
+        path = cache and os.path.join(cache, f'tile_index_{key[0]}_{key[1]}.npz')
+        if path and os.path.exists(path):
+            with np.load(path) as data:
+                _indexes[key] = TileIndex(planet.centers(), np.asarray(planet.corners, dtype=np.float64),
+                                          float(data['cube']), int(data['cubes']), data['keys'], data['starts'],
+                                          data['counts'], data['order'])
+        else:
+            index = build_index(planet)
+            if path:
+                os.makedirs(cache, exist_ok=True)
+                atomic_write(path, lambda f: np.savez(f, cube=index.cube, cubes=index.cubes, keys=index.keys,
+                                                      starts=index.starts, counts=index.counts, order=index.order))
+            _indexes[key] = index
+    return _indexes[key]
+
+# Values of the tiles at rows (from TileIndex.query): 'row', 'id', the static fields with the shape of rows, the
+# seasonal fields with a first axis for the seasons, and 'type' (the names of the tile types) if the codes and
+# names from type_of_hexes are given
+def tile_values(planet, rows, codes=None, names=None, fields=SEASONAL_FIELDS):
+    rows = np.asarray(rows)
+    values = {'row': rows, 'id': np.asarray(planet.ids)[rows]}
+    values.update({field: np.asarray(planet.fields[field])[rows] for field in STATIC_FIELDS})
+    values.update({field: np.asarray(planet.fields[field])[:, rows] for field in fields})
+    if codes is not None:
+        values['type'] = np.asarray(names)[np.asarray(codes)[rows]]
+    return values
+
+# Looks up the points of a CSV file with 'lat' and 'lon' columns (in degrees) and writes them to another CSV file
+# with the id, type, static fields and seasonal fields (one column per season) of their tiles
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Finds the tiles of a planet at the points of a CSV file')
+    parser.add_argument('planet', help='.planet file')
+    parser.add_argument('points', help='CSV file with lat and lon columns')
+    parser.add_argument('output', help='CSV file with the tiles of the points')
+    arguments = parser.parse_args()
+
+    import generate_images as images
+    planet = load_planet(arguments.planet)
+    with open(arguments.points, newline='') as f:
+        points = list(csv.DictReader(f))
+    lats = np.array([float(point['lat']) for point in points])
+    lons = np.array([float(point['lon']) for point in points])
+    values = tile_values(planet, tile_index(planet).query(lats, lons), *images.type_of_hexes(planet))
+
+    columns = ['lat', 'lon', 'id', 'type'] + list(STATIC_FIELDS)
+    seasonal = [(field, s) for field in SEASONAL_FIELDS for s in range(planet.seasons)]
+    with open(arguments.output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns + [f'{field}_{s}' for field, s in seasonal])
+        table = [lats, lons] + [values[column] for column in columns[2:]] + [values[field][s] for field, s in seasonal]
+        writer.writerows(zip(*[column.tolist() for column in table]))
+    print(f'{len(points)} points written to {arguments.output}')
@@ -0,0 +1,135 @@
+import argparse
+import numpy as np
+from planet_store import load_planet, tile_neighbours
+
+# Regions of the tiles of a planet: connected land masses, oceans or biomes, coastlines and the smoothing of the
+# classification. The neighbours of the tiles are kept as a compressed sparse row (CSR) adjacency: the neighbours
+# of the tile at row i are neighbours[offsets[i]:offsets[i + 1]].
+#   adjacency = tile_adjacency(planet)
+#   continents, count = connected_components(adjacency, land)       <- -1 on the ocean
+#   coast = coastline(adjacency, land)
+#   codes = majority_filter(adjacency, codes, passes=2, groups=ocean)
+# Every function takes a few array operations per tile and edge (connected_components a few rounds of them), so
+# they're near-linear in the number of tiles.
+#   python planet_regions.py input/earthgen_export_4.planet
+# prints the continents and oceans of a planet.
+
+# Tiles whose majority is computed at once by majority_filter. The memory used is about 100 bytes per tile
+FILTER_CHUNK = 2 ** 18
+
+
+# CSR adjacency (offsets, neighbours) of the tiles of the planet: (tiles + 1,) and (edges,) int32 arrays
+def tile_adjacency(planet):
+    neighbours = np.asarray(tile_neighbours(planet))
+    valid = neighbours >= 0
+    offsets = np.concatenate([[0], np.cumsum(valid.sum(axis=1))]).astype(np.int32)
+    return offsets, neighbours[valid].astype(np.int32)
+
+# The edges of the adjacency as (tiles, neighbours) arrays, every edge in both directions
+def adjacency_edges(adjacency):
+    offsets, neighbours = adjacency
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets)), neighbours
+
+# (tiles, max neighbours) array of the neighbours of every tile, -1 in the unused slots
+def padded_neighbours(adjacency):
+    offsets, neighbours = adjacency
+    counts = np.diff(offsets)
+    padded = np.full((len(counts), int(counts.max(initial=0))), -1, dtype=np.int32)
+    padded[np.arange(padded.shape[1]) < counts[:, None]] = neighbours
+    return padded
+
+# Labels the connected regions of the tiles with the same label: two neighbouring tiles are in the same region if
+# their labels are equal. labels is a (tiles,) array, or a boolean array selecting the tiles to label (the others
+# get -1). Returns the (tiles,) int32 region of every tile, numbered in the order of their first tiles, and the
+# number of regions
+def connected_components(adjacency, labels):
+    labels = np.asarray(labels)
+    selected = labels if labels.dtype == bool else np.ones(len(labels), dtype=bool)
+    tiles, neighbours = adjacency_edges(adjacency)
+    linked = selected[tiles] & (labels[tiles] == labels[neighbours])
+    tiles, neighbours = tiles[linked], neighbours[linked]
+
+    # every tile points to a tile of its region, the roots point to themselves. Roots are hooked onto the smallest
+    # root they're linked to, then every tile is pointed at its root, until no link joins two roots
+    parent = np.arange(len(labels), dtype=np.int32)
+    while True:
+        low = np.minimum(parent[tiles], parent[neighbours])
+        high = np.maximum(parent[tiles], parent[neighbours])
+        joined = low != high
+        if not joined.any():
+            break
+        np.minimum.at(parent, high[joined], low[joined])
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    roots, regions = np.unique(parent[selected], return_inverse=True)
+    components = np.full(len(labels), -1, dtype=np.int32)
+    components[selected] = regions.ravel()
+    return components, len(roots)
+
+# Tiles with at least one neighbour with another label
+def boundary(adjacency, labels):
+    labels = np.asarray(labels)
+    tiles, neighbours = adjacency_edges(adjacency)
+    return np.bincount(tiles, weights=labels[tiles] != labels[neighbours], minlength=len(labels)) > 0
+
+# Land tiles with an ocean neighbour. land is a (tiles,) boolean array
+def coastline(adjacency, land):
+    land = np.asarray(land, dtype=bool)
+    return land & boundary(adjacency, land)
+
+# Replaces every value by the most common value of the tile and its neighbours, passes times. A tile keeps its
+# value when it's one of the most common. With groups (a (tiles,) array), only the neighbours in the same group as
+# the tile vote, e.g. land and ocean tiles don't change each other
+def majority_filter(adjacency, values, passes=1, groups=None):
+    values = np.asarray(values)
+    padded = padded_neighbours(adjacency)
+    rows = np.arange(len(values))[:, None]
+    voters = np.hstack([rows, np.where(padded >= 0, padded, rows)])
+    valid = np.hstack([np.ones((len(values), 1), dtype=bool), padded >= 0])
+    if groups is not None:
+        groups = np.asarray(groups)
+        valid &= groups[voters] == groups[:, None]
+    for _ in range(passes):
+        result = values.copy()
+        for start in range(0, len(values), FILTER_CHUNK):
+            votes = values[voters[start:start + FILTER_CHUNK]]
+            chunk_valid = valid[start:start + FILTER_CHUNK]
+            counts = ((votes[:, :, None] == votes[:, None, :]) & chunk_valid[:, None, :]).sum(axis=2)
+            counts[~chunk_valid] = -1
+            # argmax takes the first of the most common values, the value of the tile if it's one of them
+            result[start:start + FILTER_CHUNK] = np.take_along_axis(votes, counts.argmax(axis=1)[:, None], axis=1)[:, 0]
+        values = result
+    return values
+
+# Areas of the regions, largest first: (regions, areas) arrays. components and count are returned by
+# connected_components
+def region_areas(components, count, area):
+    selected = components >= 0
+    areas = np.bincount(components[selected], weights=np.asarray(area)[selected], minlength=count)
+    order = np.argsort(-areas, kind='stable')
+    return order, areas[order]
+
+# Prints the number of continents and oceans of a planet, and the area of the largest ones
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prints the continents and oceans of a planet')
+    parser.add_argument('planet', help='.planet file')
+    parser.add_argument('--largest', type=int, default=5, metavar='N', help='number of regions listed (default 5)')
+    arguments = parser.parse_args()
+
+    planet = load_planet(arguments.planet)
+    adjacency = tile_adjacency(planet)
+    land = np.asarray(planet.fields['elevation']) >= 0
+    area = np.asarray(planet.fields['area'], dtype=np.float64)
+    total = area.sum()
+    for name, selected in [('Continents and islands', land), ('Oceans and lakes', ~land)]:
+        components, count = connected_components(adjacency, selected)
+        regions, areas = region_areas(components, count, area)
+        print(f'{name}: {count}')
+        for region, region_area in zip(regions[:arguments.largest].tolist(), areas.tolist()):
+            print(f'    {region:>6}: {100 * region_area / total:6.2f}% of the planet')
+    coast = coastline(adjacency, land)
+    print(f'Coastline: {coast.sum()} tiles, {100 * area[coast].sum() / total:.2f}% of the planet')
@@ -0,0 +1,218 @@
+import csv
+import json
+import numpy as np
+
+# Statistics of the tile types of a planet, weighted by the area of the tiles. Everything is aggregated from the
+# array of type codes returned by type_of_hexes with bincount, so the cost is a few passes over the tiles.
+#   statistics = planet_statistics(planet, codes, names)
+#   print(format_statistics(statistics))
+#   save_statistics(statistics, 'output/statistics_4')     <- statistics_4.json, _types.csv and _bands.csv
+# The statistics are a dict that can be saved as JSON:
+#   tiles, area         number and total area of the tiles
+#   types               per tile type: tiles, area, percent of the planet and the climate: the area-weighted mean
+#                       and the min and max over its tiles and the seasons of every field in CLIMATE_FIELDS
+#   groups              per group of SUMMARY_GROUPS: area and percent of the group it's a part of
+#   seasons             per season: snow cover (percent of the planet and of the land), mean LAI of the land,
+#                       mean precipitation and mean temperature
+#   latitude_bands      per band of band_degrees: its area, the percent of its area in every group (of the part
+#                       of the group in the band) and the same per season values as the planet
+
+# Groups of tile types of the summary: (name, indentation in the text, group it's a percentage of (None for the
+# whole planet), words one of which is in the names of its types (any type if empty), words none of which is)
+SUMMARY_GROUPS = (
+    ('Ocean', 0, None, ('Ocean',), ()),
+    ('Land', 0, None, (), ('Ocean',)),
+    ('Hill', 1, 'Land', ('Hill',), ()),
+    ('Mountain', 1, 'Land', ('Mountain',), ()),
+    ('Flat', 1, 'Land', (), ('Ocean', 'Hill', 'Mountain')),
+    ('Forests', 0, 'Land', ('Forest',), ()),
+    ('Jungle', 1, 'Forests', ('Jungle',), ()),
+    ('Deciduous', 1, 'Forests', ('Deciduous',), ()),
+    ('Boreal', 1, 'Forests', ('Boreal',), ()),
+    ('Mixed', 1, 'Forests', ('Mixed',), ()),
+    ('Savanna', 0, 'Land', ('Savanna',), ()),
+    ('Tundra', 0, 'Land', ('Tundra',), ()),
+    ('Grass', 0, 'Land', ('Grass',), ()),
+    ('Desert', 0, 'Land', ('Sand Desert', 'Snow Desert', 'Bare Land'), ()),
+    ('Warm Desert', 1, 'Desert', ('Sand Desert',), ()),
+    ('Snow Desert', 1, 'Desert', ('Snow Desert',), ()),
+    ('Bare land', 1, 'Desert', ('Bare Land',), ()),
+    ('Wetlands', 0, 'Land', ('Marsh', 'Swamp'), ()),
+    ('Marsh', 1, 'Wetlands', ('Marsh',), ()),
+    ('Swamp', 1, 'Wetlands', ('Swamp',), ()),
+)
+# Fields whose mean, min and max are given for every tile type
+CLIMATE_FIELDS = ('elevation', 'temperature', 'precipitation', 'humidity', 'snow', 'lai')
+# Values given for every season, in the order of the columns of the text and the CSV
+SEASON_VALUES = ('snow_cover', 'land_snow_cover', 'mean_lai', 'mean_precipitation', 'mean_temperature')
+# Width of the latitude bands in degrees
+BAND_DEGREES = 30
+# Groups shown for every latitude band in the text
+TEXT_BAND_GROUPS = ('Land', 'Forests', 'Desert', 'Wetlands')
+
+
+# (groups, types) array, True where the type is in the group of SUMMARY_GROUPS
+def group_membership(names):
+    member = np.zeros((len(SUMMARY_GROUPS), len(names)), dtype=bool)
+    for g, (_, _, _, include, exclude) in enumerate(SUMMARY_GROUPS):
+        for t, name in enumerate(names):
+            member[g, t] = ((not include or any(word in name for word in include)) and
+                            not any(word in name for word in exclude))
+    return member
+
+# 100 * part / whole, 0 where whole is 0
+def _percent(part, whole):
+    part, whole = np.broadcast_arrays(np.asarray(part, dtype=np.float64), np.asarray(whole, dtype=np.float64))
+    return np.divide(100 * part, whole, out=np.zeros(part.shape), where=whole > 0)
+
+# part / whole, nan where whole is 0
+def _mean(part, whole):
+    part, whole = np.broadcast_arrays(np.asarray(part, dtype=np.float64), np.asarray(whole, dtype=np.float64))
+    return np.divide(part, whole, out=np.full(part.shape, np.nan), where=whole > 0)
+
+# Floats of the array for JSON, None for nan
+def _values(array):
+    return [None if value != value else value for value in np.asarray(array, dtype=np.float64).tolist()]
+
+# Area-weighted mean and the min and max over the tiles (and seasons) of a field for every type. Types with no
+# tiles get nan. order sorts the tiles by type, starts are the first positions of the present types in it
+def _type_climate(values, codes, area, type_area, present, order, starts):
+    values = np.asarray(values, dtype=np.float64)
+    seasonal = values.ndim == 2
+    mean, low, high = (values.mean(axis=0), values.min(axis=0), values.max(axis=0)) if seasonal else (values,) * 3
+    means = _mean(np.bincount(codes, weights=area * mean, minlength=len(type_area)), type_area)
+    mins, maxs = np.full(len(type_area), np.nan), np.full(len(type_area), np.nan)
+    if len(present):
+        mins[present] = np.minimum.reduceat(low[order], starts)
+        maxs[present] = np.maximum.reduceat(high[order], starts)
+    return means, mins, maxs
+
+# Statistics of the planet (see above). codes and names are returned by type_of_hexes
+def planet_statistics(planet, codes, names, band_degrees=BAND_DEGREES):
+    codes = np.asarray(codes, dtype=np.intp)
+    area = np.asarray(planet.fields['area'], dtype=np.float64)
+    types = len(names)
+    member = group_membership(names)
+    group_names = [group[0] for group in SUMMARY_GROUPS]
+    land = member[group_names.index('Land')][codes]
+
+    type_tiles = np.bincount(codes, minlength=types)
+    type_area = np.bincount(codes, weights=area, minlength=types)
+    total = type_area.sum()
+    group_area = member @ type_area
+    parent_area = np.array([total if of is None else group_area[group_names.index(of)]
+                            for _, _, of, _, _ in SUMMARY_GROUPS])
+
+    # the last band doesn't reach the pole if band_degrees doesn't divide 180
+    edges = list(range(-90, 90, band_degrees)) + [90]
+    bands = len(edges) - 1
+    latitude = np.degrees(np.arcsin(np.clip(planet.centers()[:, 2], -1, 1)))
+    band = np.clip(((latitude + 90) // band_degrees).astype(np.intp), 0, bands - 1)
+    band_type_area = np.bincount(band * types + codes, weights=area,
+                                 minlength=bands * types).reshape(bands, types)
+    band_area = band_type_area.sum(axis=1)
+    band_group_area = band_type_area @ member.T
+    band_parent_area = np.stack([band_area if of is None else band_group_area[:, group_names.index(of)]
+                                 for _, _, of, _, _ in SUMMARY_GROUPS], axis=1)
+
+    # sums over every band, and over the planet as a last band
+    def sums(weights):
+        band_sums = np.bincount(band, weights=weights, minlength=bands)
+        return np.append(band_sums, band_sums.sum())
+
+    all_area, land_area = sums(area), sums(area * land)
+    # (seasons, bands + 1) array of every value of SEASON_VALUES
+    season_values = {name: np.zeros((planet.seasons, bands + 1)) for name in SEASON_VALUES}
+    for s in range(planet.seasons):
+        snow = np.asarray(planet.fields['snow'][s]) > 0
+        season_values['snow_cover'][s] = _percent(sums(area * snow), all_area)
+        season_values['land_snow_cover'][s] = _percent(sums(area * (land & snow)), land_area)
+        season_values['mean_lai'][s] = _mean(sums(area * land * planet.fields['lai'][s]), land_area)
+        season_values['mean_precipitation'][s] = _mean(sums(area * planet.fields['precipitation'][s]), all_area)
+        season_values['mean_temperature'][s] = _mean(sums(area * planet.fields['temperature'][s]), all_area)
+
+    def seasons(b):
+        return [dict(zip(SEASON_VALUES, _values([season_values[name][s, b] for name in SEASON_VALUES])))
+                for s in range(planet.seasons)]
+
+    present = np.nonzero(type_tiles)[0]
+    order = np.argsort(codes, kind='stable')
+    starts = (np.cumsum(type_tiles) - type_tiles)[present]
+    climate = {field: [_values(values) for values in
+                       _type_climate(planet.fields[field], codes, area, type_area, present, order, starts)]
+               for field in CLIMATE_FIELDS}
+
+    return {
+        'tiles': len(codes),
+        'area': float(total),
+        'types': [{'type': name, 'tiles': int(type_tiles[t]), 'area': float(type_area[t]),
+                   'percent': float(_percent(type_area[t], total)),
+                   'climate': {field: dict(zip(('mean', 'min', 'max'), (values[t] for values in climate[field])))
+                               for field in CLIMATE_FIELDS}}
+                  for t, name in enumerate(names)],
+        'groups': [{'group': name, 'of': of, 'area': float(group_area[g]),
+                    'percent': float(_percent(group_area[g], parent_area[g]))}
+                   for g, (name, _, of, _, _) in enumerate(SUMMARY_GROUPS)],
+        'seasons': seasons(bands),
+        'latitude_bands': [{'south': edges[b], 'north': edges[b + 1], 'area': float(band_area[b]),
+                            'groups': dict(zip(group_names,
+                                               _percent(band_group_area[b], band_parent_area[b]).tolist())),
+                            'seasons': seasons(b)}
+                           for b in range(bands)],
+    }
+
+def _latitude(degrees):
+    return f'{abs(degrees)}{"N" if degrees > 0 else "S" if degrees < 0 else ""}'
+
+def _number(value, form):
+    return 'n/a' if value is None else format(value, form)
+
+# The statistics as text: the groups, the groups of TEXT_BAND_GROUPS in every latitude band and the seasons
+def format_statistics(statistics):
+    lines = [f'{"    " * level}{name}: {group["percent"]:.2f}%'
+             for (name, level, _, _, _), group in zip(SUMMARY_GROUPS, statistics['groups'])]
+
+    lines += ['', 'Latitude'.ljust(12) + ''.join(f'{name:>10}' for name in TEXT_BAND_GROUPS) + f'{"Snow":>10}']
+    for band in reversed(statistics['latitude_bands']):
+        # the mean snow cover of the seasons
+        snow = np.mean([season['snow_cover'] for season in band['seasons']]) if band['seasons'] else 0
+        lines.append(f'{_latitude(band["north"]) + "-" + _latitude(band["south"]):<12}' +
+                     ''.join(f'{band["groups"][name]:>9.2f}%' for name in TEXT_BAND_GROUPS) + f'{snow:>9.2f}%')
+
+    lines += ['', f'{"Season":<8}{"Snow":>10}{"Land snow":>11}{"Land LAI":>10}{"Precipitation":>15}'
+                  f'{"Temperature":>13}']
+    for s, season in enumerate(statistics['seasons']):
+        lines.append(f'{s:<8}{season["snow_cover"]:>9.2f}%{season["land_snow_cover"]:>10.2f}%'
+                     f'{_number(season["mean_lai"], ".2f"):>10}{_number(season["mean_precipitation"], ".3e"):>15}'
+                     f'{_number(season["mean_temperature"], ".1f"):>13}')
+    return '\n'.join(lines)
+
+# Saves the statistics to path.json, the tile types to path_types.csv and the latitude bands and seasons (the
+# whole planet is the band from -90 to 90) to path_bands.csv. Returns the paths of the files
+def save_statistics(statistics, path):
+    paths = [path + '.json', path + '_types.csv', path + '_bands.csv']
+    with open(paths[0], 'w') as f:
+        json.dump(statistics, f, indent=1)
+
+    with open(paths[1], 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['type', 'tiles', 'area', 'percent'] +
+                        [f'{field}_{value}' for field in CLIMATE_FIELDS for value in ('mean', 'min', 'max')])
+        for tpe in statistics['types']:
+            writer.writerow([tpe['type'], tpe['tiles'], tpe['area'], tpe['percent']] +
+                            [tpe['climate'][field][value] for field in CLIMATE_FIELDS
+                             for value in ('mean', 'min', 'max')])
+
+    with open(paths[2], 'w', newline='') as f:
+        writer = csv.writer(f)
+        group_names = [group[0] for group in SUMMARY_GROUPS]
+        writer.writerow(['south', 'north', 'season', 'area'] + group_names + list(SEASON_VALUES))
+        planet = {'south': -90, 'north': 90, 'area': statistics['area'],
+                  'groups': {group['group']: group['percent'] for group in statistics['groups']},
+                  'seasons': statistics['seasons']}
+        for band in statistics['latitude_bands'] + [planet]:
+            for s, season in enumerate(band['seasons']):
+                writer.writerow([band['south'], band['north'], s, band['area']] +
+                                [band['groups'][name] for name in group_names] +
+                                [season[name] for name in SEASON_VALUES])
+    return paths
@@ -0,0 +1,417 @@
+import os
+import hashlib
+import struct
+import sys
+import threading
+import numpy as np
+
+# Per-tile fields that change from season to season. Stored as (seasons, tiles) arrays
+SEASONAL_FIELDS = ('sunlight', 'temperature', 'humidity', 'precipitation', 'snow', 'lai')
+# Per-tile fields that are the same in every season. Stored as (tiles,) arrays
+STATIC_FIELDS = ('elevation', 'area')
+
+
+# Structure-of-arrays planet.
+#   Every tile of the planet is one row, shared by all the arrays:
+#       ids         (tiles,) earthgen tile id
+#       fields      name -> (seasons, tiles) array for SEASONAL_FIELDS, (tiles,) array for STATIC_FIELDS
+#       corners     (tiles, 6, 3) cartesian coordinates of the tile corners on the unit sphere.
+#                   Pentagons repeat their last corner in the 6th slot
+#       pentagon    (tiles,) True for the 12 pentagons
+#       neighbours  (tiles, 6) rows of the neighbouring tiles, -1 in the 6th slot of pentagons. None if the planet
+#                   was read from a file without them (see tile_neighbours)
+#   The Dymaxion layout is described by
+#       hexes       (hexes, 2) hex indices (a, b), in the order they appear in the export
+#       hex_rows    (hexes,) row of the tile at the corresponding hex
+#   A tile on the border of two icosahedral slices can appear at several hexes, so there can be
+#   more hexes than tiles.
+#   path is the .planet file the arrays are memory-mapped from, None if they are in memory.
+class Planet:
+    def __init__(self, size, ids, fields, corners, pentagon, hexes, hex_rows, path=None, neighbours=None):
+        self.size = size
+        self.ids = ids
+        self.fields = fields
+        self.corners = corners
+        self.pentagon = pentagon
+        self.hexes = hexes
+        self.hex_rows = hex_rows
+        self.path = path
+        self.neighbours = neighbours
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def seasons(self):
+        return self.fields[SEASONAL_FIELDS[0]].shape[0]
+
+    # Centers of all the tiles on the unit sphere: (tiles, 3) means of their corners, projected back to the sphere
+    def centers(self):
+        corners = np.asarray(self.corners, dtype=np.float64)
+        # the repeated corner of the pentagons is counted once
+        sums = corners[:, :5].sum(axis=1) + np.where(self.pentagon, 0, 1)[:, None] * corners[:, 5]
+        return sums / np.linalg.norm(sums, axis=1, keepdims=True)
+
+    # Memory used by the arrays, in bytes
+    def nbytes(self):
+        arrays = [self.ids, self.corners, self.pentagon, self.hexes, self.hex_rows, *self.fields.values()]
+        if self.neighbours is not None:
+            arrays.append(self.neighbours)
+        return sum(array.nbytes for array in arrays)
+
+
+# Identifies the grid of the planet (the corners of the tiles and the order of their hexes, which is the order
+# the tiles are drawn in) in the names of cached files that only depend on the grid
+def grid_fingerprint(planet):
+    sha = hashlib.sha1(np.ascontiguousarray(planet.corners).tobytes())
+    sha.update(np.ascontiguousarray(planet.hex_rows).tobytes())
+    return sha.hexdigest()[:12]
+
+
+# Neighbours of the tiles found from their corners: two tiles are neighbours if they share an edge. Returns a
+# (tiles, 6) int32 array of rows, -1 in the 6th slot of pentagons, as Planet.neighbours
+def corner_neighbours(corners, pentagon):
+    tiles = len(corners)
+    # the corners shared by several tiles have the same coordinates. np.unique(axis=0) is several times slower
+    points = np.asarray(corners, dtype=np.float64).reshape(-1, 3)
+    order = np.lexsort(points.T[::-1])
+    sorted_points = points[order]
+    new = np.concatenate([[True], (sorted_points[1:] != sorted_points[:-1]).any(axis=1)])
+    corner_ids = np.empty(len(points), dtype=np.int64)
+    corner_ids[order] = np.cumsum(new) - 1
+    corner_ids = corner_ids.reshape(tiles, 6)
+    following = np.roll(corner_ids, -1, axis=1)
+    low, high = np.minimum(corner_ids, following), np.maximum(corner_ids, following)
+    # the 5th edge of the pentagons ends at the repeated corner
+    edges = np.nonzero((low != high).ravel())[0]
+    keys = (low * (corner_ids.max() + 1) + high).ravel()[edges]
+    order = np.argsort(keys, kind='stable')
+    edges, keys = edges[order], keys[order]
+    # every edge is shared by two tiles
+    pairs = np.nonzero(keys[:-1] == keys[1:])[0]
+    first, second = edges[pairs], edges[pairs + 1]
+    neighbours = np.full(tiles * 6, -1, dtype=np.int32)
+    neighbours[first] = second // 6
+    neighbours[second] = first // 6
+    neighbours = neighbours.reshape(tiles, 6)
+    neighbours[pentagon, 4] = neighbours[pentagon, 5]
+    neighbours[pentagon, 5] = -1
+    return neighbours
+
+# Neighbours of the tiles of the planet (see Planet), found from the corners if the planet doesn't have them
+def tile_neighbours(planet):
+    if planet.neighbours is None:
+        return corner_neighbours(planet.corners, planet.pentagon)
+    return planet.neighbours
+
+
+# Allocates an empty planet that is filled tile by tile
+def empty_planet(size, tiles, seasons, hexes, dtype=np.float64):
+    fields = {field: np.zeros((seasons, tiles), dtype=dtype) for field in SEASONAL_FIELDS}
+    fields.update({field: np.zeros(tiles, dtype=dtype) for field in STATIC_FIELDS})
+    return Planet(size,
+                  ids=np.zeros(tiles, dtype=np.int32),
+                  fields=fields,
+                  corners=np.zeros((tiles, 6, 3), dtype=dtype),
+                  pentagon=np.zeros(tiles, dtype=bool),
+                  hexes=np.zeros((hexes, 2), dtype=np.int32),
+                  hex_rows=np.zeros(hexes, dtype=np.int32))
+
+
+# Writes the file at path so that readers never see it half-written, e.g. cached files that several processes may
+# read or write at the same time. write(f) writes to a temporary file opened in mode next to path (with mode None,
+# write gets the path of the temporary file instead), which then replaces path. The temporary file is named after
+# the process and the thread, so concurrent writers don't share it, and is removed if write fails
+def atomic_write(path, write, mode='wb'):
+    partial_path = f'{path}.{os.getpid()}.{threading.get_ident()}.partial'
+    try:
+        if mode is None:
+            write(partial_path)
+        else:
+            with open(partial_path, mode) as f:
+                write(f)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+# Binary planet format (.planet). Written by export.rkt and save_planet, read by load_planet.
+# All numbers are little-endian.
+#   header
+#       8 bytes         b'EARTHGEN'
+#       uint32          format version (2)
+#       uint32          planet size (the size of a side of an icosahedral triangle in tiles)
+#       uint32          number of seasons
+#       uint32          number of tiles
+#       uint32          number of hexes of the Dymaxion layout
+#       uint32          number of fields
+#       per field       uint8 length of the name, the name (ascii), uint8 1 if the field is seasonal, else 0
+#       uint8, ascii    length and numpy notation of the float type of the arrays ('<f8' or '<f4')
+#   arrays, in this order. Each array starts at a multiple of 8 bytes, the gaps are filled with zeros
+#       int32[tiles]            earthgen tile id of every row
+#       uint8[tiles]            number of corners of the tile (5 for pentagons, 6 for hexagons)
+#       float[tiles, 6, 3]      corners (pentagons repeat the last corner)
+#       int32[tiles, 6]         rows (= ids) of the neighbouring tiles, -1 in the 6th slot of pentagons.
+#                               Only in version 2, version 1 files are read without them
+#       int32[hexes, 2]         hex indices (a, b)
+#       int32[hexes]            row of the tile at the hex
+#       float[tiles]            for every static field, in the order of the header
+#       float[tiles]            for every season, for every seasonal field in the order of the header
+# Fields of one season are next to each other, so a render that only needs some of the seasons
+# never reads the others.
+PLANET_MAGIC = b'EARTHGEN'
+PLANET_VERSION = 2
+# Versions load_planet reads
+PLANET_VERSIONS = (1, 2)
+
+
+def _aligned(n):
+    return (n + 7) // 8 * 8
+
+
+# Reads the header. Returns the header values and the offset of the first array
+def _read_header(data):
+    if bytes(data[:8]) != PLANET_MAGIC:
+        raise ValueError('not a planet file')
+    version, size, seasons, tiles, hexes, field_count = struct.unpack_from('<6I', data, 8)
+    if version not in PLANET_VERSIONS:
+        raise ValueError(f'unsupported planet file version {version}')
+    offset = 8 + 6 * 4
+    fields = []
+    for _ in range(field_count):
+        length = int(data[offset])
+        name = bytes(data[offset + 1:offset + 1 + length]).decode('ascii')
+        fields.append((name, bool(data[offset + 1 + length])))
+        offset += length + 2
+    length = int(data[offset])
+    dtype = np.dtype(bytes(data[offset + 1:offset + 1 + length]).decode('ascii'))
+    offset += length + 1
+    return (version, size, seasons, tiles, hexes, fields, dtype), _aligned(offset)
+
+
+# Loads a .planet file. The arrays are memory-mapped, nothing is read from the disk until it's used
+def load_planet(path):
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    (version, size, seasons, tiles, hexes, fields, dtype), offset = _read_header(data)
+
+    def array(shape, array_dtype):
+        nonlocal offset
+        result = np.ndarray(shape, dtype=array_dtype, buffer=data, offset=offset)
+        offset += _aligned(result.nbytes)
+        return result
+
+    ids = array(tiles, np.dtype('<i4'))
+    pentagon = array(tiles, np.uint8) == 5
+    corners = array((tiles, 6, 3), dtype)
+    neighbours = array((tiles, 6), np.dtype('<i4')) if version >= 2 else None
+    hex_indices = array((hexes, 2), np.dtype('<i4'))
+    hex_rows = array(hexes, np.dtype('<i4'))
+
+    planet_fields = {}
+    for name, seasonal in fields:
+        if not seasonal:
+            planet_fields[name] = array(tiles, dtype)
+    seasonal_fields = [name for name, seasonal in fields if seasonal]
+    block = _aligned(tiles * dtype.itemsize)
+    for i, name in enumerate(seasonal_fields):
+        planet_fields[name] = np.ndarray((seasons, tiles), dtype=dtype, buffer=data, offset=offset + i * block,
+                                         strides=(len(seasonal_fields) * block, dtype.itemsize))
+
+    return Planet(size, ids, planet_fields, corners, pentagon, hex_indices, hex_rows, path, neighbours)
+
+
+# Writes the header of a .planet file. fields are (name, seasonal) pairs, static fields first
+def _write_header(out, size, seasons, tiles, hexes, fields, dtype):
+    out.write(PLANET_MAGIC)
+    out.write(struct.pack('<6I', PLANET_VERSION, size, seasons, tiles, hexes, len(fields)))
+    for name, seasonal in fields:
+        out.write(struct.pack('<B', len(name)) + name.encode('ascii'))
+        out.write(struct.pack('<B', seasonal))
+    out.write(struct.pack('<B', len(dtype.str)) + dtype.str.encode('ascii'))
+    out.write(bytes(_aligned(out.tell()) - out.tell()))
+
+
+# Position of the number of seasons in the header
+_SEASONS_OFFSET = 8 + 2 * 4
+
+
+def _write_array(out, array, dtype):
+    out.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+    out.write(bytes(_aligned(out.tell()) - out.tell()))
+
+
+# Writes everything that comes before the seasonal fields
+def _write_layout(out, planet, dtype):
+    _write_array(out, planet.ids, '<i4')
+    _write_array(out, np.where(planet.pentagon, 5, 6), np.uint8)
+    _write_array(out, planet.corners, dtype)
+    _write_array(out, tile_neighbours(planet), '<i4')
+    _write_array(out, planet.hexes, '<i4')
+    _write_array(out, planet.hex_rows, '<i4')
+    for name in STATIC_FIELDS:
+        _write_array(out, planet.fields[name], dtype)
+
+
+# Saves the planet to a .planet file
+def save_planet(planet, path):
+    dtype = planet.corners.dtype.newbyteorder('<')
+    fields = [(name, False) for name in STATIC_FIELDS] + [(name, True) for name in SEASONAL_FIELDS]
+    with open(path, 'wb') as out:
+        _write_header(out, planet.size, planet.seasons, len(planet), len(planet.hexes), fields, dtype)
+        _write_layout(out, planet, dtype)
+        for season in range(planet.seasons):
+            for name in SEASONAL_FIELDS:
+                _write_array(out, planet.fields[name][season], dtype)
+
+
+# Legacy earthgen_export_N.py files.
+#   The file is a python literal written by print-planet of export.rkt:
+#       planet = [
+#         [                         <- season
+#           {                       <- slice
+#             (x, y): {'id': ..., 'sunlight': ..., ..., 'coords': ((x, y, z), ...)},
+#           },
+#         ],
+#       ]
+#   Every tile is on its own line with the keys in _LEGACY_KEYS order, so the file can be read line by
+#   line without building the nested lists and dicts.
+_LEGACY_KEYS = (b'id', b'sunlight', b'temperature', b'humidity', b'precipitation', b'area', b'snow', b'lai',
+                b'elevation', b'coords')
+_LEGACY_PUNCTUATION = bytes.maketrans(b"(){}:,'", b' ' * 7)
+# Tokens of a tile line: x, y, then key, value pairs. Positions of the values
+_LEGACY_ID = 3
+_LEGACY_VALUES = {name.decode('ascii'): 5 + 2 * i for i, name in enumerate(_LEGACY_KEYS[1:-1])}
+_LEGACY_COORDS = 2 * len(_LEGACY_KEYS) + 1
+# Progress is reported every _LEGACY_PROGRESS_LINES tiles
+_LEGACY_PROGRESS_LINES = 10000
+
+
+def _legacy_tokens(line, with_coords):
+    if not with_coords:
+        line = line[:line.find(b"'coords'")]
+    tokens = line.translate(_LEGACY_PUNCTUATION).split()
+    if tokens[2:_LEGACY_COORDS:2] != list(_LEGACY_KEYS[:len(tokens[2:_LEGACY_COORDS:2])]):
+        raise ValueError('unexpected tile line: ' + line.decode('ascii', 'replace').strip())
+    return tokens
+
+
+# Reads a legacy .py file season by season. Yields (planet, season values, estimated number of seasons)
+# after each season. planet is a Planet with one season; its seasonal arrays are reused for every
+# season, so the values have to be copied before the next season is read.
+# progress(bytes read, file size) is called from time to time.
+def _legacy_seasons(path, dtype, progress):
+    total = os.path.getsize(path)
+    done = 0
+    planet = None
+    season = -1
+    slice_index = -1
+    season_start = 0
+    first_slice = []
+    hexes = {}
+
+    def add_tile(tokens, slice_index):
+        row = int(tokens[_LEGACY_ID])
+        if row >= len(planet):
+            raise ValueError(f'tile id {row} is out of range for {len(planet)} tiles')
+        for name in SEASONAL_FIELDS:
+            planet.fields[name][0, row] = float(tokens[_LEGACY_VALUES[name]])
+        if season == 0:
+            corrected_hx = int(tokens[0]) + (planet.size - 1) * slice_index, int(tokens[1])
+            hexes.setdefault(corrected_hx, row)
+            for name in STATIC_FIELDS:
+                planet.fields[name][row] = float(tokens[_LEGACY_VALUES[name]])
+            coords = [float(token) for token in tokens[_LEGACY_COORDS:]]
+            planet.pentagon[row] = len(coords) == 15
+            planet.corners[row].flat[:len(coords)] = coords
+            planet.corners[row, len(coords) // 3:] = coords[-3:]
+
+    with open(path, 'rb') as f:
+        for line_number, line in enumerate(f):
+            done += len(line)
+            stripped = line.strip()
+            if stripped.startswith(b'('):
+                if planet is None:
+                    first_slice.append(_legacy_tokens(line, True))
+                else:
+                    add_tile(_legacy_tokens(line, season == 0), slice_index)
+                if progress and line_number % _LEGACY_PROGRESS_LINES == 0:
+                    progress(done, total)
+            elif stripped == b'{':
+                slice_index += 1
+            elif stripped == b'},' and planet is None:
+                # the size of the planet is known after the first slice
+                hexes_in_slice = len({(tokens[0], tokens[1]) for tokens in first_slice})
+                size = int(((1 + 8 * hexes_in_slice)**0.5 + 1) / 4)
+                planet = empty_planet(size, 10 * (size - 1)**2 + 2, 1, 0, dtype)
+                for tokens in first_slice:
+                    add_tile(tokens, 0)
+                first_slice = None
+            elif stripped == b'[':
+                season += 1
+                slice_index = -1
+                season_start = done
+            elif stripped == b'],':
+                if season == 0:
+                    planet.hexes = np.array(list(hexes.keys()), dtype=np.int32).reshape(-1, 2)
+                    planet.hex_rows = np.array(list(hexes.values()), dtype=np.int32)
+                    planet.ids[:] = np.arange(len(planet))
+                    hexes = None
+                seasons = max(season + 1, round(total / (done - season_start)))
+                yield planet, {name: planet.fields[name][0] for name in SEASONAL_FIELDS}, seasons
+    if progress:
+        progress(total, total)
+
+
+# Reads a legacy .py file into a Planet without importing it. The seasonal arrays are allocated after
+# the first season (the number of seasons is estimated from the size of the file) and grown if needed
+def read_legacy_planet(path, dtype=np.float64, progress=None):
+    planet = None
+    fields = None
+    season = 0
+    for planet, values, seasons in _legacy_seasons(path, dtype, progress):
+        if fields is None:
+            fields = {name: np.zeros((seasons, len(planet)), dtype=dtype) for name in SEASONAL_FIELDS}
+        for name in SEASONAL_FIELDS:
+            if season == len(fields[name]):
+                fields[name] = np.concatenate([fields[name], np.zeros_like(fields[name])])
+            fields[name][season] = values[name]
+        season += 1
+    if planet is None:
+        raise ValueError(f'no planet in {path}')
+    planet.fields.update({name: fields[name][:season] for name in SEASONAL_FIELDS})
+    return planet
+
+
+# Converts a legacy .py file to a .planet file in one pass. Only one season is kept in memory
+def convert_legacy_planet(path, planet_path, dtype=np.float64, progress=None):
+    dtype = np.dtype(dtype).newbyteorder('<')
+    fields = [(name, False) for name in STATIC_FIELDS] + [(name, True) for name in SEASONAL_FIELDS]
+    season = 0
+    with open(planet_path, 'wb') as out:
+        for planet, values, _ in _legacy_seasons(path, dtype, progress):
+            if season == 0:
+                _write_header(out, planet.size, 0, len(planet), len(planet.hexes), fields, dtype)
+                _write_layout(out, planet, dtype)
+            for name in SEASONAL_FIELDS:
+                _write_array(out, values[name], dtype)
+            season += 1
+        if season == 0:
+            raise ValueError(f'no planet in {path}')
+        out.seek(_SEASONS_OFFSET)
+        out.write(struct.pack('<I', season))
+
+
+# Progress callback that prints the percentage of the file that has been read
+def print_progress(done, total):
+    print(f'    {100 * done / total:.0f}%', end='\n' if done == total else '\r')
+
+
+# Converts legacy .py files given in the command line to .planet files next to them:
+#   python planet_store.py input/earthgen_export_4.py [...]
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        planet_path = os.path.splitext(path)[0] + '.planet'
+        print(f'Converting {path} to {planet_path}')
+        convert_legacy_planet(path, planet_path, progress=print_progress)
+        print('Done')
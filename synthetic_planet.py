@@ -0,0 +1,224 @@
+import pickle
+import argparse
+import numpy as np
+from planet_store import SEASONAL_FIELDS, STATIC_FIELDS, empty_planet, save_planet
+
+# Deterministic synthetic planets with the structure of the earthgen export, for benchmarks and for trying the
+# python scripts without racket. As in earthgen, the grid is an icosahedron with the edges of its faces divided
+# into 3 ** size parts, and the tiles are cut into 5 slices of 4 faces with the same hex indices as in
+# export.rkt. The fields are smooth random functions of the position and the season. The planets don't look
+# like the ones of earthgen, but have the same numbers of tiles, hexes and seasons.
+#   python synthetic_planet.py 3 input/earthgen_export_3.planet [--seasons 4] [--seed 0]
+# The file is written in the legacy formats if its name ends with .py or .pickle
+
+# Latitude of the 10 vertices of the icosahedron that aren't poles
+_LATITUDE = np.arctan(0.5)
+
+
+def _icosahedron():
+    vertices = [(0.0, 0.0, 1.0)]
+    for i in range(5):
+        t = 2 * np.pi * i / 5
+        vertices.append((np.cos(t) * np.cos(_LATITUDE), np.sin(t) * np.cos(_LATITUDE), np.sin(_LATITUDE)))
+    for i in range(5):
+        t = 2 * np.pi * i / 5 + np.pi / 5
+        vertices.append((np.cos(t) * np.cos(_LATITUDE), np.sin(t) * np.cos(_LATITUDE), -np.sin(_LATITUDE)))
+    vertices.append((0.0, 0.0, -1.0))
+    return np.array(vertices)
+
+
+# Faces of the icosahedron, 4 per slice in the order of the triangles of a slice in export.rkt
+def _faces():
+    faces = []
+    for i in range(5):
+        top, upper, upper_previous = 0, 1 + i % 5, 1 + (i - 1) % 5
+        lower, lower_previous, bottom = 6 + i % 5, 6 + (i - 1) % 5, 11
+        faces += [(top, upper, upper_previous), (upper, lower_previous, upper_previous),
+                  (upper, lower, lower_previous), (lower, bottom, lower_previous)]
+    return np.array(faces)
+
+
+# Grid with the edges of the faces divided into m = 3 ** size parts. Returns
+#   face_tiles  (20, points) tile at every point (j, k) of every face, points in the order of np.tril_indices(m + 1)
+#   centers     (tiles, 3) centers of the tiles on the unit sphere
+#   corners     (tiles, 6, 3) corners of the tiles, pentagons repeat the last one
+#   pentagon    (tiles,) True for the 12 pentagons, which are tiles 0 to 11 as in earthgen
+def synthetic_grid(size):
+    m = 3 ** size
+    vertices = _icosahedron()
+    faces = _faces()
+    j, k = np.tril_indices(m + 1)
+    weights = np.stack([m - j, j - k, k], axis=1)
+    # a point is identified by the vertices of the face it's a weighted sum of, so that the points on the edges
+    # of neighbouring faces are the same. Vertices with zero weight are replaced by a dummy one
+    base = 13 * (m + 1)
+    keys = []
+    for face in faces:
+        ids = np.where(weights > 0, face * (m + 1) + weights, 12 * (m + 1))
+        ids = np.sort(ids, axis=1)
+        keys.append((ids[:, 0] * base + ids[:, 1]) * base + ids[:, 2])
+    unique, inverse = np.unique(np.array(keys), return_inverse=True)
+    inverse = inverse.reshape(len(faces), -1)
+    tile_of_unique = np.full(len(unique), -1)
+    corner_points = np.nonzero((weights == m).any(axis=1))[0]
+    for f, face in enumerate(faces):
+        tile_of_unique[inverse[f, corner_points]] = face[np.argmax(weights[corner_points], axis=1)]
+    others = tile_of_unique < 0
+    tile_of_unique[others] = np.arange(12, 12 + np.count_nonzero(others))
+    face_tiles = tile_of_unique[inverse]
+    tiles = len(unique)
+
+    centers = np.zeros((tiles, 3))
+    centers[face_tiles.ravel()] = np.einsum('pk,fkd->fpd', weights / m, vertices[faces]).reshape(-1, 3)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    # the corners are the centers of the small triangles between the tiles, sorted by the angle around the tile
+    rows, columns = np.tril_indices(m)
+    index = lambda a, b: a * (a + 1) // 2 + b
+    up = np.stack([index(rows, columns), index(rows + 1, columns), index(rows + 1, columns + 1)], axis=1)
+    rows, columns = np.tril_indices(m, -1)
+    down = np.stack([index(rows, columns), index(rows + 1, columns + 1), index(rows, columns + 1)], axis=1)
+    triangles = face_tiles[:, np.concatenate([up, down])].reshape(-1, 3)
+    triangle_centers = centers[triangles].sum(axis=1)
+    triangle_centers /= np.linalg.norm(triangle_centers, axis=1, keepdims=True)
+    owners = triangles.ravel()
+    points = np.repeat(triangle_centers, 3, axis=0)
+    owner_centers = centers[owners]
+    reference = np.where(np.abs(owner_centers[:, 2:3]) < 0.9, [[0.0, 0.0, 1.0]], [[1.0, 0.0, 0.0]])
+    e1 = np.cross(owner_centers, reference)
+    e1 /= np.linalg.norm(e1, axis=1, keepdims=True)
+    e2 = np.cross(owner_centers, e1)
+    angles = np.arctan2((points * e2).sum(axis=1), (points * e1).sum(axis=1))
+    order = np.lexsort((angles, owners))
+    starts = np.searchsorted(owners[order], np.arange(tiles))
+    sides = np.bincount(owners, minlength=tiles)
+    corners = np.zeros((tiles, 6, 3))
+    for corner in range(6):
+        corners[:, corner] = points[order[starts + np.minimum(corner, sides - 1)]]
+    return face_tiles, centers, corners, sides == 5
+
+
+# Hex indices (x, y) of the points of the 4 faces of a slice, as in slice-tiles of export.rkt. Returns a
+# (4, points, 2) array
+def _slice_hexes(size):
+    m = 3 ** size
+    j, k = np.tril_indices(m + 1)
+    return np.array([np.stack([-k, j], axis=1),
+                     np.stack([-j, j + m - k], axis=1),
+                     np.stack([-k, m + j], axis=1),
+                     np.stack([-j, j + 2 * m - k], axis=1)])
+
+
+# Static and seasonal fields of the tiles. The elevation is a sum of random waves, and the climate depends on
+# the latitude relative to a solar equator that moves with the seasons
+def synthetic_fields(centers, seasons, seed):
+    rng = np.random.default_rng(seed)
+    x = centers[:, 0]
+    latitude = np.arcsin(np.clip(centers[:, 2], -1, 1))
+    waves = np.zeros(len(centers))
+    for _ in range(12):
+        direction = rng.normal(size=3)
+        direction /= np.linalg.norm(direction)
+        waves += np.sin((centers @ direction) * rng.uniform(2, 9) + rng.uniform(0, 6.3)) / 12 ** 0.5
+    elevation = waves * 4000 - 800
+    static = {'elevation': elevation, 'area': np.full(len(centers), 4 * np.pi / len(centers))}
+    seasonal = {name: np.zeros((seasons, len(centers))) for name in SEASONAL_FIELDS}
+    for s in range(seasons):
+        tilt = np.pi / 8 * np.sin(2 * np.pi * s / seasons)
+        temperature = 240 + 65 * np.cos(latitude - tilt) - 0.0065 * np.maximum(elevation, 0)
+        precipitation = 4e-8 * (1 + np.sin(3 * latitude + s) * np.cos(5 * x)) + 1e-9
+        seasonal['temperature'][s] = temperature
+        seasonal['precipitation'][s] = precipitation
+        seasonal['snow'][s] = np.clip((268 - temperature) / 10, 0, 1)
+        seasonal['lai'][s] = np.clip((temperature - 260) / 5, 0, 12) * np.clip(precipitation / 4e-8, 0, 1.5)
+        seasonal['humidity'][s] = precipitation * 1e5
+        seasonal['sunlight'][s] = 400 * np.cos(latitude - tilt).clip(0)
+    return static, seasonal
+
+
+# Synthetic planet as a Planet, the same as merge_slices of the synthetic_slices gives
+def synthetic_planet(size, seasons=4, seed=0, dtype=np.float64):
+    face_tiles, centers, corners, pentagon = synthetic_grid(size)
+    static, seasonal = synthetic_fields(centers, seasons, seed)
+    m = 3 ** size
+    # hexes of the slices in the order they are exported, the first tile at each hex is kept
+    hexes = (_slice_hexes(size)[None] + np.array([m, 0]) * np.arange(5)[:, None, None, None]).reshape(-1, 2)
+    _, first = np.unique(hexes, axis=0, return_index=True)
+    first = np.sort(first)
+    planet = empty_planet(m + 1, len(centers), seasons, len(first), dtype)
+    planet.hexes[:] = hexes[first]
+    planet.hex_rows[:] = face_tiles.ravel()[first]
+    planet.ids[:] = np.arange(len(centers))
+    planet.corners[:] = corners
+    planet.pentagon[:] = pentagon
+    for name in STATIC_FIELDS:
+        planet.fields[name][:] = static[name]
+    for name in SEASONAL_FIELDS:
+        planet.fields[name][:] = seasonal[name]
+    return planet
+
+
+# Synthetic planet in the legacy structure merge_slices reads (the `planet` variable of the .py files):
+# a list of seasons, each a list of 5 slices of {hex: tile}
+def synthetic_slices(size, seasons=4, seed=0):
+    face_tiles, centers, corners, pentagon = synthetic_grid(size)
+    static, seasonal = synthetic_fields(centers, seasons, seed)
+    hexes = [[tuple(hx) for hx in triangle] for triangle in _slice_hexes(size).tolist()]
+    coords = [tuple(map(tuple, tile_corners[:5 if is_pentagon else 6]))
+              for tile_corners, is_pentagon in zip(corners.tolist(), pentagon)]
+    static = {name: values.tolist() for name, values in static.items()}
+    planet = []
+    for s in range(seasons):
+        values = {name: seasonal[name][s].tolist() for name in SEASONAL_FIELDS}
+        season = []
+        for i in range(5):
+            tiles = {}
+            for triangle in range(4):
+                for hx, tile in zip(hexes[triangle], face_tiles[4 * i + triangle].tolist()):
+                    tiles[hx] = {'id': tile, 'sunlight': values['sunlight'][tile],
+                                 'temperature': values['temperature'][tile], 'humidity': values['humidity'][tile],
+                                 'precipitation': values['precipitation'][tile], 'area': static['area'][tile],
+                                 'snow': values['snow'][tile], 'lai': values['lai'][tile],
+                                 'elevation': static['elevation'][tile], 'coords': coords[tile]}
+            season.append(tiles)
+        planet.append(season)
+    return planet
+
+
+# Writes the legacy structure to a .py file, formatted as print-planet of export.rkt
+def write_legacy_py(slices, path):
+    with open(path, 'w') as out:
+        out.write('planet = [\n')
+        for season in slices:
+            out.write('  [\n')
+            for sl in season:
+                out.write('    {\n')
+                for (x, y), tile in sl.items():
+                    coords = ' '.join('(' + ', '.join(repr(value) for value in corner) + '),'
+                                      for corner in tile['coords'])
+                    out.write(f"      ({x}, {y}): {{'id': {tile['id']}, 'sunlight': {tile['sunlight']!r}, "
+                              f"'temperature': {tile['temperature']!r}, 'humidity': {tile['humidity']!r}, "
+                              f"'precipitation': {tile['precipitation']!r}, 'area':{tile['area']!r}, "
+                              f"'snow':{tile['snow']!r}, 'lai':{tile['lai']!r}, "
+                              f"'elevation':{tile['elevation']!r}, 'coords': ({coords})}},\n")
+                out.write('    },\n')
+            out.write('  ],\n')
+        out.write(']\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a synthetic planet')
+    parser.add_argument('size', type=int, help='planet size, as PLANET_CHARACTERISTIC_SIZE in generate_images.py')
+    parser.add_argument('path', help='.planet, .py or .pickle file')
+    parser.add_argument('--seasons', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    if arguments.path.endswith('.py') or arguments.path.endswith('.pickle'):
+        slices = synthetic_slices(arguments.size, arguments.seasons, arguments.seed)
+        if arguments.path.endswith('.py'):
+            write_legacy_py(slices, arguments.path)
+        else:
+            with open(arguments.path, 'wb') as f:
+                pickle.dump(slices, f)
+    else:
+        save_planet(synthetic_planet(arguments.size, arguments.seasons, arguments.seed), arguments.path)
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+import generate_images as images
+from planet_store import SEASONAL_FIELDS
+from synthetic_planet import synthetic_planet
+
+
+# The per-tile classifier type_of_hexes replaced, on the merged planet of the old merge_slices: a list of seasons,
+# each a dict of {hex: tile}
+def type_of_hex(hx, planet):
+    def seasonal(param):
+        return [season[hx][param] for season in planet]
+    def spread(lst):
+        return max(lst) - min(lst)
+
+    lai = seasonal('lai')
+    precip = seasonal('precipitation')
+    snow = seasonal('snow')
+    temp = seasonal('temperature')
+    elevation = planet[0][hx]['elevation']
+    snowy_threshold = images.SEASONAL_SNOW_RATIO * len(planet)
+
+    result = ''
+
+    # Oceans
+    if elevation < images.DEEP_OCEAN:
+        return 'Deep Ocean'
+    elif elevation < images.MID_OCEAN:
+        return 'Mid Ocean'
+    elif elevation < 0:
+        return 'Surface Ocean'
+
+    # Wetlands
+    if (elevation < images.HILL_ELEVATION and
+      all([(pre > images.WETLANDS_PRECIPITATION or sn > 0) for (pre, sn) in zip(precip, snow)]) and
+      sum(snow) < snowy_threshold):
+        if max(lai) > images.SAVANNA_TUNDRA_LAI:
+            return 'Swamp'
+        else:
+            return 'Marsh'
+
+    # Forests
+    if max(lai) > images.FOREST_LAI:
+        if (spread(lai) < images.JUNGLE_SEASONAL_LAI_VARIATION
+          and min(temp) > images.JUNGLE_MIN_TEMPERATURE
+          and sum(snow) < snowy_threshold):
+            result += 'Jungle Forest'
+        elif (spread(lai) < images.BOREAL_SEASONAL_LAI_VARIATION or sum(snow) >= snowy_threshold):
+            if sum(snow) < snowy_threshold:
+                result += 'Boreal Forest'
+            else:
+                result += 'Snowy Boreal Forest'
+        elif spread(lai) > images.DECIDUOUS_SEASONAL_LAI_VARIATION:
+            result += 'Deciduous Forest'
+        else:
+            result += 'Mixed Forest'
+
+        if elevation > images.MOUNTAIN_ELEVATION:
+            result = ('Mountain ', 'Mountains ')[int(elevation % 2)] + result
+        elif elevation > images.HILL_ELEVATION:
+            result = 'Hill ' + result
+        elif max(lai) > images.HEAVY_FOREST_LAI:
+            result = 'Heavy ' + result
+
+        return result
+
+    # Moutains with no forests
+    if elevation > images.MOUNTAIN_ELEVATION:
+        result = ('Mountain', 'Mountains')[int(elevation % 2)]
+        if sum(snow) >= snowy_threshold or max([t - elevation / 100 for t in temp]) < 0:
+            result = 'Snowy ' + result
+
+        return result
+
+    # Hills and Flat Lands with some trees (but not forests)
+    if max(lai) > images.SAVANNA_TUNDRA_LAI:
+        if min(temp) > images.SAVANNA_MIN_TEMPERATURE:
+            result = 'Savanna'
+        else:
+            result = 'Tundra'
+        if elevation > images.HILL_ELEVATION:
+            result = 'Hill ' + result
+
+        return result
+
+    # Hills and Flat Lands with no trees (grass or deserts)
+    if sum(snow) >= snowy_threshold:
+        return 'Snow Desert'
+    elif max(lai) > images.LAND_LAI:
+        return 'Grass'
+    elif min(temp) > images.SAND_DESERT_MIN_TEMPERATURE:
+        return 'Sand Desert'
+    elif max(temp) < images.SNOW_DESERT_MAX_TEMPERATURE:
+        return 'Snow Desert'
+    else:
+        return 'Bare Land'
+
+
+# The planet in the structure of the old merge_slices: the first tile at every hex
+def merged_seasons(planet):
+    elevation = planet.fields['elevation'].tolist()
+    seasons = []
+    for s in range(planet.seasons):
+        values = {field: planet.fields[field][s].tolist() for field in SEASONAL_FIELDS}
+        seasons.append({tuple(hx): dict({field: values[field][row] for field in SEASONAL_FIELDS},
+                                        elevation=elevation[row])
+                        for hx, row in zip(planet.hexes.tolist(), planet.hex_rows.tolist())})
+    return seasons
+
+
+# Fields spread around the thresholds, so that every rule of the classification is used. The snow, LAI and
+# temperature of a tile vary around values of the tile from season to season
+def random_fields(planet, seed):
+    rng = np.random.default_rng(seed)
+    tiles, seasons = len(planet), planet.seasons
+    planet.fields['elevation'][:] = rng.uniform(-5000, 3000, tiles)
+    # some tiles are covered by snow in most seasons, some never
+    snow_chance = rng.choice([0, 0.5, 1], tiles)
+    covered = rng.uniform(size=(seasons, tiles)) < snow_chance
+    planet.fields['snow'][:] = rng.uniform(0.5, 1, (seasons, tiles)) * covered
+    # LAI varies by more than DECIDUOUS_SEASONAL_LAI_VARIATION in some tiles, and is negative in some seasons so
+    # that flat deciduous forests aren't heavy forests
+    lai_spread = rng.uniform(0, 14, tiles)
+    planet.fields['lai'][:] = rng.uniform(-2, 8, tiles) + lai_spread * rng.uniform(size=(seasons, tiles))
+    planet.fields['temperature'][:] = rng.uniform(260, 330, tiles) + rng.uniform(-10, 10, (seasons, tiles))
+    planet.fields['precipitation'][:] = rng.uniform(0, 2.5e-8, (seasons, tiles))
+    return planet
+
+
+# type_of_hexes gives the types of the per-tile classifier, on the synthetic planet and on random fields that
+# give every type (at size 3 with 4 seasons)
+@pytest.mark.parametrize('seasons', [1, 4])
+@pytest.mark.parametrize('size, random', [(2, False), (3, True)])
+def test_type_of_hexes(monkeypatch, seasons, size, random):
+    monkeypatch.setattr(images, 'SMOOTHING_PASSES', 0)
+    planet = synthetic_planet(size, seasons)
+    if random:
+        planet = random_fields(planet, seasons)
+    codes, names = images.type_of_hexes(planet)
+    assert names == images.TILE_TYPES
+    merged = merged_seasons(planet)
+    types = [names[code] for code in codes[planet.hex_rows]]
+    assert types == [type_of_hex(hx, merged) for hx in merged[0]]
+    if random and seasons > 1:
+        assert set(types) == set(names)
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pytest
+import generate_images as images
+import planet_query
+from planet_query import tile_index, build_index, tile_values, sphere_points
+from synthetic_planet import synthetic_planet
+
+
+@pytest.fixture(scope='module')
+def planet():
+    return synthetic_planet(2)
+
+
+# (points, tiles) array, True where the point is inside the polygon of the tile: the corners of every tile go
+# around it in one direction, so a point inside is on the same side of all its edges (and in the same hemisphere
+# as the tile, the tile on the opposite side of the planet has the same sides). Points within tolerance of an edge
+# are in the tiles on both sides
+def containing_tiles(planet, points, tolerance=1e-12):
+    corners = np.asarray(planet.corners, dtype=np.float64)
+    normals = np.cross(corners, np.roll(corners, -1, axis=1))
+    lengths = np.linalg.norm(normals, axis=2)
+    # the repeated corner of the pentagons gives an edge of length 0
+    edges = lengths > 0
+    sides = np.einsum('tkd,pd->ptk', normals / np.where(edges, lengths, 1)[..., None], points)
+    positive = ((sides >= -tolerance) | ~edges).all(axis=2)
+    negative = ((sides <= tolerance) | ~edges).all(axis=2)
+    return (positive | negative) & (points @ corners.mean(axis=1).T > 0)
+
+
+def random_points(count, seed):
+    rng = np.random.default_rng(seed)
+    return np.degrees(np.arcsin(rng.uniform(-1, 1, count))), rng.uniform(-180, 180, count)
+
+
+# Every point is in the tile of the query, checked against all the tiles of the planet. The points are queried
+# in several chunks
+def test_query(planet, monkeypatch):
+    monkeypatch.setattr(planet_query, 'QUERY_CHUNK', 500)
+    lats, lons = random_points(3000, 0)
+    # the poles, the date line and the corners of the tiles, which are in several tiles
+    corners = np.asarray(planet.corners, dtype=np.float64)[:50].reshape(-1, 3)
+    lats = np.concatenate([lats, [90, -90, 0, 45], np.degrees(np.arcsin(np.clip(corners[:, 2], -1, 1)))])
+    lons = np.concatenate([lons, [0, 0, 180, -180], np.degrees(np.arctan2(corners[:, 1], corners[:, 0]))])
+    rows = build_index(planet).query(lats, lons)
+    assert rows.dtype == np.int32 and rows.shape == lats.shape
+    contains = containing_tiles(planet, sphere_points(lats, lons))
+    assert contains.any(axis=1).all()
+    assert contains[np.arange(len(rows)), rows].all()
+
+
+def test_query_shape(planet):
+    index = build_index(planet)
+    lats, lons = random_points(60, 1)
+    rows = index.query(lats.reshape(3, 4, 5), lons.reshape(3, 4, 5))
+    assert rows.shape == (3, 4, 5)
+    assert np.array_equal(rows.ravel(), index.query(lats, lons))
+    # a point is broadcast with the longitudes
+    assert np.array_equal(index.query(lats[0], lons), index.query(np.full(60, lats[0]), lons))
+    assert index.query(lats[0], lons[0]).shape == ()
+
+
+def test_cached_index(planet, tmp_path, monkeypatch):
+    monkeypatch.setattr(planet_query, '_indexes', {})
+    lats, lons = random_points(500, 2)
+    rows = tile_index(planet, str(tmp_path)).query(lats, lons)
+    assert len(os.listdir(tmp_path)) == 1
+    # loaded from the cache
+    monkeypatch.setattr(planet_query, '_indexes', {})
+    assert np.array_equal(tile_index(planet, str(tmp_path)).query(lats, lons), rows)
+    assert np.array_equal(build_index(planet).query(lats, lons), rows)
+
+
+def test_tile_values(planet):
+    codes, names = images.type_of_hexes(planet)
+    rows = np.array([[0, 5], [17, 811]])
+    values = tile_values(planet, rows, codes, names)
+    assert np.array_equal(values['id'], planet.ids[rows])
+    assert values['elevation'].shape == (2, 2)
+    assert values['lai'].shape == (planet.seasons, 2, 2)
+    assert np.array_equal(values['lai'][1], planet.fields['lai'][1][rows])
+    assert values['type'][1, 0] == names[codes[17]]
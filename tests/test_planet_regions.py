@@ -0,0 +1,116 @@
+from collections import Counter, deque
+import numpy as np
+import pytest
+import generate_images as images
+import planet_regions
+from planet_regions import (tile_adjacency, connected_components, boundary, coastline, majority_filter,
+                            region_areas)
+from planet_store import corner_neighbours
+from synthetic_planet import synthetic_planet
+
+
+@pytest.fixture(scope='module')
+def planet():
+    return synthetic_planet(2)
+
+
+# Neighbours of every tile as lists
+def neighbour_lists(adjacency):
+    offsets, neighbours = adjacency
+    return [neighbours[offsets[i]:offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+
+# Regions found tile by tile with a breadth-first search, numbered in the order of their first tiles
+def search_components(neighbours, labels):
+    labels = np.asarray(labels).tolist()
+    selected = labels if isinstance(labels[0], bool) else [True] * len(labels)
+    components = [-1] * len(labels)
+    count = 0
+    for start in range(len(labels)):
+        if not selected[start] or components[start] >= 0:
+            continue
+        components[start] = count
+        queue = deque([start])
+        while queue:
+            tile = queue.popleft()
+            for neighbour in neighbours[tile]:
+                if components[neighbour] < 0 and selected[neighbour] and labels[neighbour] == labels[tile]:
+                    components[neighbour] = count
+                    queue.append(neighbour)
+        count += 1
+    return components, count
+
+
+def test_adjacency(planet):
+    adjacency = tile_adjacency(planet)
+    neighbours = neighbour_lists(adjacency)
+    assert [len(tile_neighbours) for tile_neighbours in neighbours] == [5 if p else 6 for p in planet.pentagon]
+    assert all(row in neighbours[neighbour] for row in range(len(planet)) for neighbour in neighbours[row])
+    # the neighbours of the planet are used when it has them
+    planet.neighbours = corner_neighbours(planet.corners, planet.pentagon)
+    try:
+        assert all(np.array_equal(a, b) for a, b in zip(tile_adjacency(planet), adjacency))
+    finally:
+        planet.neighbours = None
+
+
+@pytest.mark.parametrize('labels', ['land', 'ocean', 'codes', 'random'])
+def test_connected_components(planet, labels):
+    elevation = planet.fields['elevation']
+    labels = {'land': elevation >= 0, 'ocean': elevation < 0, 'codes': images.type_of_hexes(planet)[0],
+              'random': np.random.default_rng(0).integers(0, 3, len(planet))}[labels]
+    adjacency = tile_adjacency(planet)
+    components, count = connected_components(adjacency, labels)
+    assert (components.tolist(), count) == search_components(neighbour_lists(adjacency), labels)
+
+
+def test_boundary(planet):
+    adjacency = tile_adjacency(planet)
+    neighbours = neighbour_lists(adjacency)
+    land = (planet.fields['elevation'] >= 0).tolist()
+    coast = [land[tile] and any(not land[neighbour] for neighbour in neighbours[tile]) for tile in range(len(land))]
+    assert coastline(adjacency, land).tolist() == coast
+    codes = images.type_of_hexes(planet)[0].tolist()
+    assert boundary(adjacency, codes).tolist() == [any(codes[n] != codes[tile] for n in neighbours[tile])
+                                                   for tile in range(len(codes))]
+
+
+def test_region_areas(planet):
+    land = planet.fields['elevation'] >= 0
+    area = np.random.default_rng(0).uniform(1, 2, len(planet))
+    components, count = connected_components(tile_adjacency(planet), land)
+    regions, areas = region_areas(components, count, area)
+    expected = [sum(area[tile] for tile in range(len(planet)) if components[tile] == region)
+                for region in range(count)]
+    assert sorted(regions.tolist()) == list(range(count))
+    assert areas.tolist() == pytest.approx([expected[region] for region in regions])
+    assert (np.diff(areas) <= 0).all()
+
+
+# The filter applied tile by tile: the first of the tile and its neighbours (in the same group) whose value is the
+# most common among them
+def filter_tiles(neighbours, values, passes, groups):
+    values = list(values)
+    for _ in range(passes):
+        result = []
+        for tile in range(len(values)):
+            voters = [tile] + [n for n in neighbours[tile] if groups is None or groups[n] == groups[tile]]
+            counts = Counter(values[voter] for voter in voters)
+            most = max(counts.values())
+            result.append(next(values[voter] for voter in voters if counts[values[voter]] == most))
+        values = result
+    return values
+
+
+@pytest.mark.parametrize('passes', [1, 3])
+@pytest.mark.parametrize('grouped', [False, True])
+def test_majority_filter(planet, monkeypatch, passes, grouped):
+    # a few chunks
+    monkeypatch.setattr(planet_regions, 'FILTER_CHUNK', 300)
+    adjacency = tile_adjacency(planet)
+    values = np.random.default_rng(passes).integers(0, 4, len(planet)).astype(np.uint8)
+    groups = (planet.fields['elevation'] < 0) if grouped else None
+    filtered = majority_filter(adjacency, values, passes, groups)
+    assert filtered.dtype == values.dtype
+    assert filtered.tolist() == filter_tiles(neighbour_lists(adjacency), values.tolist(), passes,
+                                             None if groups is None else groups.tolist())
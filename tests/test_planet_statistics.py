@@ -0,0 +1,112 @@
+import math
+import numpy as np
+import pytest
+import generate_images as images
+from planet_statistics import (SUMMARY_GROUPS, CLIMATE_FIELDS, planet_statistics, format_statistics,
+                               save_statistics)
+from synthetic_planet import synthetic_planet
+
+
+# Synthetic planet with tiles of different areas, so that weighting by area matters
+@pytest.fixture(scope='module')
+def planet():
+    planet = synthetic_planet(2, seasons=3)
+    planet.fields['area'][:] = np.random.default_rng(0).uniform(0.5, 2, len(planet)) / len(planet)
+    return planet
+
+
+def in_group(name, group):
+    _, _, _, include, exclude = group
+    return (not include or any(word in name for word in include)) and not any(word in name for word in exclude)
+
+
+def weighted_mean(values, weights):
+    return sum(v * w for v, w in zip(values, weights)) / sum(weights) if sum(weights) > 0 else None
+
+
+def approx(value):
+    return None if value is None else pytest.approx(value, rel=1e-9, abs=1e-12)
+
+
+# Every value of the statistics computed tile by tile
+@pytest.mark.parametrize('band_degrees', [30, 25])
+def test_planet_statistics(planet, band_degrees):
+    codes, names = images.type_of_hexes(planet)
+    statistics = planet_statistics(planet, codes, names, band_degrees)
+
+    tiles = range(len(planet))
+    area = planet.fields['area'].tolist()
+    types = [names[code] for code in codes]
+    total = sum(area)
+    land = ['Ocean' not in name for name in types]
+    centers = planet.centers()
+    latitude = [math.degrees(math.asin(min(1, max(-1, z)))) for z in centers[:, 2].tolist()]
+    assert statistics['tiles'] == len(planet)
+    assert statistics['area'] == approx(total)
+
+    for t, name in enumerate(names):
+        rows = [row for row in tiles if types[row] == name]
+        weights = [area[row] for row in rows]
+        entry = statistics['types'][t]
+        assert (entry['type'], entry['tiles']) == (name, len(rows))
+        assert entry['area'] == approx(sum(weights))
+        assert entry['percent'] == approx(100 * sum(weights) / total)
+        for field in CLIMATE_FIELDS:
+            values = np.asarray(planet.fields[field], dtype=np.float64)
+            seasonal = values if values.ndim == 2 else values[None]
+            climate = entry['climate'][field]
+            if rows:
+                assert climate['mean'] == approx(weighted_mean([seasonal[:, row].mean() for row in rows], weights))
+                assert climate['min'] == seasonal[:, rows].min()
+                assert climate['max'] == seasonal[:, rows].max()
+            else:
+                assert climate == {'mean': None, 'min': None, 'max': None}
+
+    groups = {group[0]: group for group in SUMMARY_GROUPS}
+    group_area = {}
+    for group, entry in zip(SUMMARY_GROUPS, statistics['groups']):
+        name, _, of, _, _ = group
+        group_area[name] = sum(area[row] for row in tiles if in_group(types[row], group))
+        whole = total if of is None else group_area[of]
+        assert (entry['group'], entry['of']) == (name, of)
+        assert entry['area'] == approx(group_area[name])
+        assert entry['percent'] == approx(100 * group_area[name] / whole if whole else 0)
+
+    def season_values(rows, s):
+        weights = [area[row] for row in rows]
+        land_weights = [area[row] * land[row] for row in rows]
+        field = {name: planet.fields[name][s].tolist() for name in ('snow', 'lai', 'precipitation', 'temperature')}
+        snow = [area[row] for row in rows if field['snow'][row] > 0]
+        land_snow = [area[row] for row in rows if field['snow'][row] > 0 and land[row]]
+        return {'snow_cover': approx(100 * sum(snow) / sum(weights) if sum(weights) else 0),
+                'land_snow_cover': approx(100 * sum(land_snow) / sum(land_weights) if sum(land_weights) else 0),
+                'mean_lai': approx(weighted_mean([field['lai'][row] for row in rows], land_weights)),
+                'mean_precipitation': approx(weighted_mean([field['precipitation'][row] for row in rows], weights)),
+                'mean_temperature': approx(weighted_mean([field['temperature'][row] for row in rows], weights))}
+
+    assert statistics['seasons'] == [season_values(tiles, s) for s in range(planet.seasons)]
+
+    edges = list(range(-90, 90, band_degrees)) + [90]
+    assert [(band['south'], band['north']) for band in statistics['latitude_bands']] == list(zip(edges, edges[1:]))
+    for b, band in enumerate(statistics['latitude_bands']):
+        # the last band goes up to the pole
+        rows = [row for row in tiles if edges[b] <= latitude[row] < edges[b + 1] or
+                (b == len(edges) - 2 and latitude[row] >= edges[b + 1])]
+        band_area = sum(area[row] for row in rows)
+        assert band['area'] == approx(band_area)
+        for group in SUMMARY_GROUPS:
+            name, _, of, _, _ = group
+            part = sum(area[row] for row in rows if in_group(types[row], group))
+            whole = band_area if of is None else sum(area[row] for row in rows if in_group(types[row], groups[of]))
+            assert band['groups'][name] == approx(100 * part / whole if whole else 0)
+        assert band['seasons'] == [season_values(rows, s) for s in range(planet.seasons)]
+    assert sum(band['area'] for band in statistics['latitude_bands']) == approx(total)
+
+
+def test_save_statistics(planet, tmp_path):
+    codes, names = images.type_of_hexes(planet)
+    statistics = planet_statistics(planet, codes, names)
+    paths = save_statistics(statistics, str(tmp_path / 'statistics_2'))
+    assert all((tmp_path / path).exists() for path in paths)
+    text = format_statistics(statistics)
+    assert text.splitlines()[0].startswith('Ocean: ')
@@ -0,0 +1,121 @@
+import struct
+import numpy as np
+import pytest
+import planet_store
+from generate_images import merge_slices
+from planet_store import (SEASONAL_FIELDS, STATIC_FIELDS, save_planet, load_planet, corner_neighbours,
+                          tile_neighbours, read_legacy_planet, convert_legacy_planet)
+from synthetic_planet import synthetic_planet, synthetic_slices, write_legacy_py
+
+
+def assert_same_planet(planet, expected):
+    assert planet.size == expected.size
+    assert planet.seasons == expected.seasons
+    assert np.array_equal(planet.ids, expected.ids)
+    assert np.array_equal(planet.pentagon, expected.pentagon)
+    assert np.array_equal(planet.corners, expected.corners)
+    assert np.array_equal(planet.hexes, expected.hexes)
+    assert np.array_equal(planet.hex_rows, expected.hex_rows)
+    for field in SEASONAL_FIELDS + STATIC_FIELDS:
+        assert np.array_equal(planet.fields[field], expected.fields[field]), field
+
+
+@pytest.mark.parametrize('seasons', [1, 2, 4])
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_round_trip(tmp_path, seasons, dtype):
+    planet = synthetic_planet(2, seasons, dtype=dtype)
+    path = str(tmp_path / 'planet.planet')
+    save_planet(planet, path)
+    loaded = load_planet(path)
+    assert_same_planet(loaded, planet)
+    assert loaded.corners.dtype == np.dtype(dtype)
+    assert loaded.path == path
+    # planets without neighbours get them from their corners
+    assert np.array_equal(loaded.neighbours, corner_neighbours(planet.corners, planet.pentagon))
+
+
+def test_neighbours(tmp_path):
+    planet = synthetic_planet(1)
+    neighbours = corner_neighbours(planet.corners, planet.pentagon)
+    assert (neighbours[planet.pentagon, 5] == -1).all()
+    assert (neighbours[planet.pentagon, :5] >= 0).all() and (neighbours[~planet.pentagon] >= 0).all()
+    # every tile is a neighbour of its neighbours, and they share an edge
+    corners = [set(map(tuple, tile_corners)) for tile_corners in planet.corners.tolist()]
+    for row, row_neighbours in enumerate(neighbours):
+        for neighbour in row_neighbours[row_neighbours >= 0]:
+            assert row in neighbours[neighbour]
+            assert len(corners[row] & corners[neighbour]) == 2
+
+    # the neighbours of the planet are saved as they are, not found again from the corners
+    planet.neighbours = np.roll(neighbours, 1, axis=1)
+    path = str(tmp_path / 'planet.planet')
+    save_planet(planet, path)
+    assert np.array_equal(load_planet(path).neighbours, planet.neighbours)
+
+
+# Version 1 files are the same without the neighbours block
+def test_version_1(tmp_path):
+    planet = synthetic_planet(1)
+    path, old_path = str(tmp_path / 'planet.planet'), str(tmp_path / 'old.planet')
+    save_planet(planet, path)
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    _, offset = planet_store._read_header(data)
+    tiles = len(planet)
+    start = offset + sum(planet_store._aligned(n) for n in (tiles * 4, tiles, tiles * 6 * 3 * 8))
+    del data[start:start + planet_store._aligned(tiles * 6 * 4)]
+    struct.pack_into('<I', data, 8, 1)
+    with open(old_path, 'wb') as f:
+        f.write(data)
+
+    loaded = load_planet(old_path)
+    assert loaded.neighbours is None
+    assert_same_planet(loaded, planet)
+    assert np.array_equal(tile_neighbours(loaded), load_planet(path).neighbours)
+
+
+def test_not_a_planet(tmp_path):
+    path = tmp_path / 'planet.planet'
+    path.write_bytes(b'NOTAPLANET' + bytes(64))
+    with pytest.raises(ValueError, match='not a planet file'):
+        load_planet(str(path))
+
+
+# The .py file is read line by line into the planet merge_slices builds from the imported file. With padding,
+# the first season is so long that the number of seasons estimated from it is too low and the arrays are grown
+@pytest.mark.parametrize('seasons', [1, 2, 4, 5])
+@pytest.mark.parametrize('padding', [False, True])
+def test_legacy_planet(tmp_path, seasons, padding):
+    slices = synthetic_slices(2, seasons)
+    path = str(tmp_path / 'earthgen_export_2.py')
+    write_legacy_py(slices, path)
+    if padding:
+        with open(path) as f:
+            text = f.read()
+        with open(path, 'w') as f:
+            f.write(text.replace('  [\n', '  [\n' + ' ' * len(text) + '\n', 1))
+    namespace = {}
+    with open(path) as f:
+        exec(f.read(), namespace)
+    assert namespace['planet'] == slices
+    merged, size = merge_slices(slices)
+    assert size == merged.size
+    assert_same_planet(merged, synthetic_planet(2, seasons))
+
+    progress = []
+    assert_same_planet(read_legacy_planet(path, progress=lambda done, total: progress.append((done, total))), merged)
+    assert progress[-1][0] == progress[-1][1]
+
+    planet_path = str(tmp_path / 'earthgen_export_2.planet')
+    convert_legacy_planet(path, planet_path)
+    assert_same_planet(load_planet(planet_path), merged)
+
+
+def test_legacy_planet_errors(tmp_path):
+    path = tmp_path / 'earthgen_export_2.py'
+    path.write_text('planet = [\n]\n')
+    with pytest.raises(ValueError, match='no planet'):
+        read_legacy_planet(str(path))
+    path.write_text("planet = [\n  [\n    {\n      (0, 0): {'id': 0, 'temperature': 1.0},\n")
+    with pytest.raises(ValueError, match='unexpected tile line'):
+        read_legacy_planet(str(path))
@@ -0,0 +1,54 @@
+import threading
+import urllib.error
+import urllib.request
+from io import BytesIO
+import pytest
+from PIL import Image
+import generate_images as images
+import tile_server
+from planet_store import save_planet, load_planet
+from synthetic_planet import synthetic_planet
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, 'CACHE', str(tmp_path / 'cache'))
+    path = str(tmp_path / 'synthetic_1.planet')
+    save_planet(synthetic_planet(1), path)
+    codes, names = images.type_of_hexes(load_planet(path))
+    pool = images.render_pool(1, path, codes)
+    server = tile_server.ThreadingHTTPServer(('localhost', 0), tile_server.TileHandler)
+    server.tiles = tile_server.TileSource(pool)
+    server.verbose = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://localhost:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+    pool.terminate()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+def test_tile(server):
+    status, data = get(server + '/mercator/terrain/1/1/0.png')
+    assert status == 200
+    assert Image.open(BytesIO(data)).size == (tile_server.TILE_SIZE, tile_server.TILE_SIZE)
+
+
+# Map viewers add query strings to the tile URLs, e.g. to get around the browser cache
+def test_tile_with_query_string(server):
+    status, data = get(server + '/equirectangular/height/0/1/0.png?v=2')
+    assert status == 200
+    assert data == get(server + '/equirectangular/height/0/1/0.png')[1]
+
+
+def test_missing_tiles(server):
+    assert get(server + '/mercator/terrain/1/2/0.png')[0] == 404
+    assert get(server + '/mercator/roads/0/0/0.png?v=2')[0] == 404
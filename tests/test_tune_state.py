@@ -0,0 +1,74 @@
+import os
+import numpy as np
+from PIL import Image
+import generate_images as images
+from synthetic_planet import synthetic_planet
+
+PICS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pics', '')
+
+
+def write_image(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+# --tune, then a run without --tune (which saves no state), then --tune again: the image of the run without
+# --tune was drawn with other tile types, so it's rendered again instead of repainted
+def test_tune_after_normal_run(tmp_path):
+    state, image = str(tmp_path / 'tune_2.npz'), str(tmp_path / 'equirectangular_2.png')
+    tune_codes = np.array([0, 1, 2])
+    write_image(image, b'tune run')
+    images.save_tune_state(state, 'planet', tune_codes, [image])
+    write_image(image, b'run without --tune')
+
+    codes, kept = images.load_tune_state(state, 'planet')
+    assert np.array_equal(codes, tune_codes)
+    assert kept == []
+
+
+def test_unchanged_image_is_kept(tmp_path):
+    state, image = str(tmp_path / 'tune_2.npz'), str(tmp_path / 'equirectangular_2.png')
+    write_image(image, b'tune run')
+    images.save_tune_state(state, 'planet', np.array([0, 1, 2]), [image])
+    assert images.load_tune_state(state, 'planet')[1] == [image]
+
+
+def test_other_planet(tmp_path):
+    state, image = str(tmp_path / 'tune_2.npz'), str(tmp_path / 'equirectangular_2.png')
+    write_image(image, b'tune run')
+    images.save_tune_state(state, 'planet', np.array([0, 1, 2]), [image])
+    assert images.load_tune_state(state, 'other planet') is None
+
+
+# Repainting the tiles that changed type gives the image rendered from scratch, and the work shared by the
+# rectangles (the grid fingerprint, the labels and the palette) is only done once
+def test_repaint(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, 'CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(images, 'PICS', PICS)
+    monkeypatch.setattr(images, 'EQUIRECTANGULAR_DEGREE', 4)
+    planet = synthetic_planet(1)
+    stamps = images.StampCache(images.import_tile_icons())
+    codes = images.type_of_hexes(planet)[0]
+    changed = np.arange(0, len(planet), 7)
+    new_codes = codes.copy()
+    new_codes[changed] = (codes[changed] + 1) % len(images.TILE_TYPES)
+
+    monkeypatch.setattr(images, 'OUTPUT', str(tmp_path / 'fresh') + os.sep)
+    os.makedirs(images.OUTPUT)
+    images.save_equirectangular(planet, stamps, new_codes, save_height=False)
+    monkeypatch.setattr(images, 'OUTPUT', str(tmp_path / 'tuned') + os.sep)
+    os.makedirs(images.OUTPUT)
+    images.save_equirectangular(planet, stamps, codes, save_height=False)
+
+    fingerprints = []
+    grid_fingerprint = images.grid_fingerprint
+    monkeypatch.setattr(images, 'grid_fingerprint', lambda planet: fingerprints.append(1) or grid_fingerprint(planet))
+    outputs, size = images.equirectangular_outputs(planet, stamps, new_codes, save_height=False)
+    rectangles = images.equirectangular_footprints(planet, changed)
+    images.repaint_images(outputs, rectangles)
+    assert len(rectangles) > 10
+    assert len(fingerprints) <= 1
+
+    tuned, fresh = [np.asarray(Image.open(os.path.join(tmp_path, directory, images.EQUIRECTANGULAR)))
+                    for directory in ('tuned', 'fresh')]
+    assert np.array_equal(tuned, fresh)
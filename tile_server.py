@@ -0,0 +1,285 @@
+import os
+import re
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit
+from io import BytesIO
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from PIL import Image
+from planet_store import load_planet, atomic_write
+import generate_images as images
+
+# Local server of map tiles of a planet, rendered when they're requested instead of rendering a whole image.
+#   python tile_server.py input/earthgen_export_4.planet --port 8000 --workers 4
+# serves the tiles at
+#   http://localhost:8000/<projection>/<layer>/<z>/<x>/<y>.png
+# where projection is 'mercator' (Web Mercator, 2 ** z by 2 ** z tiles, as in most web maps) or 'equirectangular'
+# (2 ** (z + 1) by 2 ** z tiles of 180 / 2 ** z degrees), and layer is 'terrain' (the colors, grid and icons of
+# the equirectangular map of generate_images.py) or 'height' (the height map). The planet is loaded and classified
+# once with the settings of generate_images.py. The tiles are rendered by the workers of render_pool from the
+# equirectangular polygons of the tiles, projected once and scaled to every tile. Rendered tiles are kept in an
+# LRU cache of TILE_CACHE_BYTES and in TILE_DISK_CACHE, and a tile requested again while it's rendered is only
+# rendered once.
+
+# Port of the server
+PORT = 8000
+# Number of processes rendering the tiles
+WORKERS = 4
+# Width and height of the tiles in pixels
+TILE_SIZE = 256
+# Largest zoom level served
+MAX_ZOOM = 14
+# Maximum total size of the tiles kept in memory, in bytes
+TILE_CACHE_BYTES = 256 * 2 ** 20
+# Directory where the tiles are kept between runs, under a directory named after the planet and the image settings,
+# or None
+TILE_DISK_CACHE = r'./cache/tiles/'
+# Web Mercator only covers the latitudes up to this one
+MERCATOR_LATITUDE = 85.0511287798
+# Icons wider or higher than this many pixels are not drawn (at high zoom levels the icons would be much larger
+# than the tiles)
+MAX_ICON_PIXELS = 2 * TILE_SIZE
+# Color of the pixels without tiles (RGBA)
+BACKGROUND = (0, 0, 0, 255)
+
+PROJECTIONS = ('mercator', 'equirectangular')
+LAYERS = ('terrain', 'height')
+TILE_PATH = re.compile(r'/(\w+)/(\w+)/(\d+)/(\d+)/(\d+)\.png')
+
+
+# Number of tiles (columns, rows) of the zoom level
+def tile_counts(projection, z):
+    return (2 ** z, 2 ** z) if projection == 'mercator' else (2 ** (z + 1), 2 ** z)
+
+# Renders the tiles of one projection of a planet. The polygons are those of the equirectangular projection with
+# one unit per degree (the world is 360 by 180 units); in the Mercator projection, their latitudes are replaced by
+# Mercator ordinates (the world is 360 by 360 units)
+class TileRenderer:
+    def __init__(self, planet, codes, stamps, projection):
+        self.planet = planet
+        self.codes = codes
+        self.stamps = stamps
+        self.projection = projection
+        (rows, offsets, points), bounds = images.equirectangular_geometry(planet, 1)
+        if projection == 'mercator':
+            latitudes = np.radians(np.clip(90 - points[:, 1], -MERCATOR_LATITUDE, MERCATOR_LATITUDE))
+            points = np.stack([points[:, 0], 180 - np.degrees(np.log(np.tan(np.pi / 4 + latitudes / 2)))], axis=1)
+            bounds = images.polygon_bounds((rows, offsets, points))
+        self.polygons = rows, offsets, points
+        self.bounds = bounds
+        self.palettes = {'height': images.label_palette(images.height_colors(planet), BACKGROUND)}
+        if codes is not None:
+            self.palettes['terrain'] = images.label_palette(images.terrain_colors(codes), BACKGROUND)
+
+    # The polygons of the tile (z, x, y) in its pixels, and their bounds
+    def tile_polygons(self, z, x, y):
+        rows, offsets, points = self.polygons
+        span = (360 if self.projection == 'mercator' else 180) / 2 ** z
+        scale = TILE_SIZE / span
+        left, top = x * span, y * span
+        in_tile = images.polygons_in_band(self.bounds, top, top + span, left, left + span)
+        lengths = offsets[in_tile + 1] - offsets[in_tile]
+        tile_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        gather = np.repeat(offsets[in_tile] - tile_offsets[:-1], lengths) + np.arange(tile_offsets[-1])
+        tile_points = (points[gather] - (left, top)) * scale
+        tile_bounds = (self.bounds[in_tile] - (left, top, left, top)) * scale
+        return (rows[in_tile], tile_offsets, tile_points), tile_bounds
+
+    # The tile as a PNG file
+    def render(self, layer, z, x, y):
+        polygons, bounds = self.tile_polygons(z, x, y)
+        # one more row and column to find the boundaries of the last ones
+        labels = images.rasterize_labels(polygons, bounds, TILE_SIZE + 1, 0, TILE_SIZE + 1)
+        pixels = images.paint_labels(labels[:TILE_SIZE, :TILE_SIZE], self.palettes[layer])
+        if layer == 'terrain' and images.GRID_COLOR:
+            pixels[images.label_boundaries(labels)[:TILE_SIZE, :TILE_SIZE]] = images.GRID_COLOR
+        image = Image.fromarray(pixels, 'RGBA')
+        if layer == 'terrain':
+            sizes = (bounds[:, 2:] - bounds[:, :2]).max(axis=1) * images.PIC_RATIO
+            small = np.nonzero(sizes <= MAX_ICON_PIXELS)[0]
+            # only the rows and bounds of the polygons are used
+            images.paste_equirectangular_icons(image, (polygons[0][small], None, None), bounds[small],
+                                               self.stamps, self.codes)
+        data = BytesIO()
+        image.save(data, 'PNG')
+        return data.getvalue()
+
+# Renderers of the projections in a render worker
+_renderers = {}
+
+def _render_tile(projection, layer, z, x, y):
+    if projection not in _renderers:
+        worker = images._render_worker
+        _renderers[projection] = TileRenderer(worker['planet'], worker['codes'], worker['stamps'], projection)
+    return _renderers[projection].render(layer, z, x, y)
+
+# LRU cache of rendered tiles of at most max_bytes, shared by the threads of the server. hits and misses count the
+# lookups
+class TileCache:
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._tiles:
+                self.hits += 1
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            self.misses += 1
+            return None
+
+    def add(self, key, data):
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and self._tiles:
+                self.bytes -= len(self._tiles.popitem(last=False)[1])
+
+# Tiles of a planet: from the memory cache, the disk cache (in directory, if not None) or rendered by the pool
+class TileSource:
+    def __init__(self, pool, directory=None, max_bytes=TILE_CACHE_BYTES):
+        self.pool = pool
+        self.directory = directory
+        self.cache = TileCache(max_bytes)
+        self.rendered = 0
+        # tiles being rendered, so that a tile requested again meanwhile is rendered once
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        projection, layer, z, x, y = key
+        return os.path.join(self.directory, projection, layer, str(z), str(x), f'{y}.png')
+
+    # The PNG file of the tile key = (projection, layer, z, x, y)
+    def get(self, key):
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            self.cache.add(key, data)
+            return data
+        with self._lock:
+            result = self._pending.get(key)
+            if result is None:
+                result = self._pending[key] = self.pool.apply_async(_render_tile, key)
+        try:
+            data = result.get()
+        except Exception:
+            with self._lock:
+                if self._pending.get(key) is result:
+                    del self._pending[key]
+            raise
+        with self._lock:
+            # the first thread waiting for the tile stores it
+            if self._pending.get(key) is result:
+                del self._pending[key]
+                self.rendered += 1
+                self.cache.add(key, data)
+                if self.directory is not None:
+                    self._save(key, data)
+        return data
+
+    def _save(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, lambda f: f.write(data))
+
+# Directory of the tiles of the planet in TILE_DISK_CACHE: the tiles depend on the planet, its tile types (codes)
+# and the image settings
+def disk_cache_directory(planet, codes):
+    sha = hashlib.sha1(images.planet_fingerprint(planet).encode())
+    sha.update(np.ascontiguousarray(codes).tobytes())
+    sha.update((images.tune_settings() + repr((TILE_SIZE, MAX_ICON_PIXELS, MERCATOR_LATITUDE, BACKGROUND))).encode())
+    return os.path.join(TILE_DISK_CACHE, sha.hexdigest()[:16])
+
+INDEX_PAGE = '''<!DOCTYPE html>
+<html><head><title>earthgen tiles</title></head><body>
+<p>Tiles: <code>/&lt;projection&gt;/&lt;layer&gt;/{z}/{x}/{y}.png</code> with projection mercator or equirectangular
+and layer terrain or height, zoom levels 0 to %d.</p>
+<p><img src="/equirectangular/terrain/0/0/0.png"><img src="/equirectangular/terrain/0/1/0.png"></p>
+</body></html>
+'''
+
+class TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # map viewers may add a query string, e.g. ?v=2 to get around the browser cache
+        path = urlsplit(self.path).path
+        if path == '/':
+            self._send(200, 'text/html', (INDEX_PAGE % MAX_ZOOM).encode())
+            return
+        match = TILE_PATH.fullmatch(path)
+        if match is None:
+            self._send(404, 'text/plain', b'not found')
+            return
+        projection, layer = match.group(1), match.group(2)
+        z, x, y = (int(group) for group in match.groups()[2:])
+        if projection not in PROJECTIONS or layer not in LAYERS or z > MAX_ZOOM:
+            self._send(404, 'text/plain', b'not found')
+            return
+        columns, rows = tile_counts(projection, z)
+        if x >= columns or y >= rows:
+            self._send(404, 'text/plain', b'no such tile')
+            return
+        try:
+            data = self.server.tiles.get((projection, layer, z, x, y))
+        except Exception as error:
+            self._send(500, 'text/plain', f'{type(error).__name__}: {error}'.encode())
+            raise
+        self._send(200, 'image/png', data)
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves map tiles of a planet rendered on request')
+    parser.add_argument('planet', help='.planet file')
+    parser.add_argument('--port', type=int, default=PORT, help=f'port of the server (default {PORT})')
+    parser.add_argument('--workers', type=int, default=WORKERS, metavar='N',
+                        help=f'number of processes rendering the tiles (default {WORKERS})')
+    parser.add_argument('--no-disk-cache', action='store_true', help='only keep the tiles in memory')
+    parser.add_argument('--verbose', action='store_true', help='print every request')
+    arguments = parser.parse_args()
+
+    print(f'Loading {arguments.planet}')
+    planet = load_planet(arguments.planet)
+    codes, names = images.type_of_hexes(planet)
+    # projected once here, the workers read the polygons from CACHE
+    images.equirectangular_geometry(planet, 1)
+    directory = None if arguments.no_disk_cache or TILE_DISK_CACHE is None else disk_cache_directory(planet, codes)
+    print(f'Starting {arguments.workers} render workers')
+    pool = images.render_pool(max(1, arguments.workers), arguments.planet, codes)
+
+    server = ThreadingHTTPServer(('localhost', arguments.port), TileHandler)
+    server.daemon_threads = True
+    server.tiles = TileSource(pool, directory)
+    server.verbose = arguments.verbose
+    print(f'Serving tiles at http://localhost:{arguments.port}/ (Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        cache = server.tiles.cache
+        print(f'{server.tiles.rendered} tiles rendered, {cache.hits} memory cache hits, {cache.misses} misses')
+        pool.terminate()